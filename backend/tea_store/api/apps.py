@@ -1,4 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_index(sender, using, **kwargs):
+    # SQLite пересоздаёт таблицу при части миграций и теряет триггеры FTS, поэтому восстанавливаем их после migrate
+    from django.db import connections
+    from .search import install_search_index
+    install_search_index(connections[using])
 
 
 class ApiConfig(AppConfig):
@@ -7,3 +15,4 @@ class ApiConfig(AppConfig):
 
     def ready(self):
        import api.signals
+       post_migrate.connect(ensure_search_index, sender=self)
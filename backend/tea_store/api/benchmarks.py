@@ -0,0 +1,200 @@
+'''
+Общие помощники для бенчмарков (manage.py bench_*).
+Бенчмарки всегда работают во временной тестовой базе, чтобы не трогать рабочие данные.
+'''
+import platform
+import random
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+
+import django
+
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from .models import CartItem
+
+TEA_NAMES = [
+    'Улун', 'Пуэр', 'Сенча', 'Да Хун Пао', 'Те Гуань Инь', 'Ассам', 'Дарджилинг', 'Эрл Грей',
+    'Матча', 'Генмайча', 'Лапсанг Сушонг', 'Цейлон', 'Кения', 'Ройбуш', 'Каркаде', 'Мате',
+    'Бай Му Дань', 'Шу Пуэр', 'Шэн Пуэр', 'Лунцзин', 'Би Ло Чунь', 'Габа', 'Ходзича', 'Кудин',
+]
+TEA_ADJECTIVES = [
+    'Жасминовый', 'Молочный', 'Дикий', 'Горный', 'Выдержанный', 'Весенний', 'Осенний', 'Копчёный',
+    'Имперский', 'Классический', 'Золотой', 'Красный', 'Зелёный', 'Белый', 'Чёрный', 'Медовый',
+]
+
+
+@contextmanager
+def isolated_database(verbosity=0):
+    '''
+    Создаёт отдельную тестовую базу (с миграциями) на время бенчмарка и удаляет её после.
+    Заодно включает тестовое окружение (ALLOWED_HOSTS с testserver, DEBUG=False, чтобы не копить connection.queries).
+    '''
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+@contextmanager
+def replaced_default_database(config):
+    '''
+    Подменяет настройки базы default (для всех потоков, включая новые) на config, например файл во временном
+    каталоге с другим ENGINE/OPTIONS. Соединения default, открытые в других потоках, нужно закрыть до выхода.
+    '''
+    original = connections.settings[DEFAULT_DB_ALIAS]
+    connections[DEFAULT_DB_ALIAS].close()
+    del connections[DEFAULT_DB_ALIAS] # Следующее обращение создаст DatabaseWrapper по новым настройкам
+    connections.settings[DEFAULT_DB_ALIAS] = connections.configure_settings({DEFAULT_DB_ALIAS: dict(config)})[DEFAULT_DB_ALIAS]
+    try:
+        yield connections[DEFAULT_DB_ALIAS]
+    finally:
+        connections[DEFAULT_DB_ALIAS].close()
+        del connections[DEFAULT_DB_ALIAS]
+        connections.settings[DEFAULT_DB_ALIAS] = original
+
+
+def generate_users(count, prefix='bench_user'):
+    '''Быстро создаёт пользователей одним bulk_create (без хеширования пароля - он не нужен для бенчмарков).'''
+    User = get_user_model()
+    existing = User.objects.filter(username__startswith=prefix).count()
+    users = [
+        User(username=f'{prefix}_{existing + i}', password='!', email=f'{prefix}_{existing + i}@example.com')
+        for i in range(count)
+    ]
+    User.objects.bulk_create(users, batch_size=1000)
+    return list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+
+def generate_catalog(count, author_ids, seed=42, batch_size=5000, progress=None):
+    '''Быстро генерирует count карточек товаров пачками через bulk_create.'''
+    rnd = random.Random(seed)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        CartItem.objects.bulk_create([
+            CartItem(
+                author_id=rnd.choice(author_ids),
+                product_name=f'{rnd.choice(TEA_ADJECTIVES)} {rnd.choice(TEA_NAMES)} №{rnd.randint(1, 9999)}',
+                product_price=round(rnd.uniform(50, 5000), 2),
+                product_quantity=rnd.randint(1, 500),
+            )
+            for _ in range(size)
+        ], batch_size=batch_size)
+        created += size
+        if progress:
+            progress(created)
+    return created
+
+
+def measure(func, repeat=20, warmup=2):
+    '''Вызывает func несколько раз и возвращает список длительностей в секундах.'''
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    '''Сводка по длительностям в миллисекундах.'''
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+class QueryCounter:
+    "Считает SQL-запросы через execute_wrapper (дешевле CaptureQueriesContext, который включает отладочный курсор)"
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_requests(make_request, repeat=100, warmup=5):
+    '''
+    Выполняет make_request() repeat раз (после warmup прогревочных) и возвращает сводку:
+    задержки (summarize), запросов в секунду для одного клиента и SQL-запросов на запрос.
+    make_request возвращает ответ, ответ с кодом 4xx/5xx считается ошибкой бенчмарка.
+    '''
+    for _ in range(warmup):
+        make_request()
+    counter = QueryCounter()
+    samples = []
+    with connection.execute_wrapper(counter):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = make_request()
+            samples.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f'Запрос бенчмарка вернул {response.status_code}: {response.content[:200]!r}')
+    return scenario_result(samples, counter.count)
+
+
+def scenario_result(samples, queries=None):
+    result = summarize(samples)
+    result['rps'] = round(len(samples) / sum(samples), 1) if samples else 0.0
+    if queries is not None:
+        result['queries_per_request'] = round(queries / len(samples), 2) if samples else 0.0
+    return result
+
+
+def git_revision():
+    "Текущий коммит, чтобы результаты можно было сопоставить с историей; None вне git"
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+def compare(previous, current, keys=('p50_ms', 'p99_ms', 'rps', 'queries_per_request')):
+    "Изменение метрик сценариев относительно предыдущего прогона: {сценарий: {метрика: (было, стало, %)}}"
+    changes = {}
+    for name, result in current.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        changes[name] = {}
+        for key in keys:
+            if key in result and key in before:
+                percent = (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+                changes[name][key] = (before[key], result[key], round(percent, 1))
+    return changes
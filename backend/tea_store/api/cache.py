@@ -0,0 +1,237 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.response import Response
+
+from .models import CatalogVersion
+
+CATALOG_VERSION_ID = 1 # Единственная строка api.CatalogVersion
+
+
+def get_catalog_state(request=None):
+    '''
+    (версия, время последнего изменения) каталога из api.CatalogVersion - одна и та же для всех воркеров.
+    До первого изменения каталога - (0, None). С request читается один раз за запрос: ETag, Last-Modified
+    и ключ кэша ответов должны видеть одну и ту же версию.
+    '''
+    state = getattr(request, '_catalog_state', None)
+    if state is None:
+        row = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', 'modified_at').first()
+        state = row or (0, None)
+        if request is not None:
+            request._catalog_state = state
+    return state
+
+
+def get_catalog_version(request=None):
+    return get_catalog_state(request)[0]
+
+
+def bump_catalog_version():
+    '''
+    Меняет версию каталога в текущей транзакции: все закэшированные ответы со старой версией перестают использоваться.
+    Версия не меньше текущего времени в наносекундах: после отката транзакции или восстановления базы из копии
+    она не повторит уже выданную, и воркер не отдаст из своего кэша ответ, собранный по другим данным.
+    '''
+    now = timezone.now()
+    floor = time.time_ns()
+    updated = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(
+        version=Greatest(F('version') + 1, Value(floor)), modified_at=now,
+    )
+    if not updated: # Первое изменение каталога
+        CatalogVersion.objects.bulk_create(
+            [CatalogVersion(pk=CATALOG_VERSION_ID, version=floor, modified_at=now)], ignore_conflicts=True,
+        )
+
+
+def normalized_query(request):
+    "Параметры запроса в отсортированном виде, чтобы ?a=1&b=2 и ?b=2&a=1 считались одним и тем же запросом"
+    return sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+
+
+class CacheStats:
+    "Потокобезопасные счётчики попаданий/промахов/вытеснений"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.sets = 0
+            self.evictions = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'sets': self.sets,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class BaseResponseCache:
+    '''
+    Кэш данных ответа (response.data) для list/retrieve.
+    Ключ - версия каталога + путь + нормализованная строка запроса, поэтому инвалидация - это просто смена версии.
+    '''
+
+    def __init__(self, timeout=300, **options):
+        self.timeout = timeout
+        self.stats = CacheStats()
+
+    def make_key(self, request, action):
+        raw = repr((get_catalog_version(request), action, request.scheme, request.get_host(), request.path, normalized_query(request)))
+        return 'api:response:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, data):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUResponseCache(BaseResponseCache):
+    "Ограниченный LRU-кэш в памяти процесса"
+
+    def __init__(self, timeout=300, max_entries=1024, **options):
+        super().__init__(timeout=timeout, **options)
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.stats.incr('hits')
+                return entry[1]
+            if entry is not None: # Протухшая запись
+                del self._data[key]
+        self.stats.incr('misses')
+        return None
+
+    def set(self, key, data):
+        expires = time.monotonic() + self.timeout if self.timeout else float('inf')
+        evicted = 0
+        with self._lock:
+            self._data[key] = (expires, data)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        self.stats.incr('sets')
+        if evicted:
+            self.stats.incr('evictions', evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoResponseCache(BaseResponseCache):
+    "Кэш поверх бэкенда Django (CACHES), общий для всех воркеров, если бэкенд общий. Вытеснения считает сам бэкенд."
+
+    def __init__(self, timeout=300, cache_alias='default', **options):
+        super().__init__(timeout=timeout, **options)
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get(self, key):
+        data = self.cache.get(key)
+        self.stats.incr('misses' if data is None else 'hits')
+        return data
+
+    def set(self, key, data):
+        self.cache.set(key, data, timeout=self.timeout)
+        self.stats.incr('sets')
+
+    def clear(self):
+        self.cache.clear()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    '''Возвращает кэш ответов, настроенный в CARTITEMS_RESPONSE_CACHE, или None, если кэш выключен.'''
+    global _response_cache
+    config = getattr(settings, 'CARTITEMS_RESPONSE_CACHE', None)
+    if not config:
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                backend = import_string(config['BACKEND'])
+                options = {key.lower(): value for key, value in config.get('OPTIONS', {}).items()}
+                _response_cache = backend(**options)
+    return _response_cache
+
+
+@receiver(setting_changed)
+def _reset_response_cache(setting, **kwargs):
+    global _response_cache
+    if setting in ('CARTITEMS_RESPONSE_CACHE', 'CACHES'):
+        _response_cache = None
+
+
+class CachedResponseMixin:
+    '''
+    Миксин для ViewSet: отдаёт list/retrieve из кэша, если данные для этой версии каталога и этих параметров уже есть.
+    Кэшируются данные (response.data), а не готовые байты, поэтому рендерер (JSON, browsable API) выбирается как обычно.
+    '''
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response('list', super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response('retrieve', super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, action, handler, request, *args, **kwargs):
+        cache = get_response_cache()
+        if cache is None:
+            return handler(request, *args, **kwargs)
+
+        key = cache.make_key(request, action)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,112 @@
+'''
+Журнал изменений карточек (api.ProductChange) для догоняния пропущенного по WebSocket.
+
+Каждая запись в CartItem (post_save/post_delete и bulk-операции) в той же транзакции добавляет строку в журнал,
+и её seq попадает в операцию, которую получают клиенты. Клиент запоминает последний seq и при переподключении
+открывает ws/products/?since=<seq>: сначала ему приходят пропущенные операции, потом живые.
+Если нужных записей уже нет (журнал хранит последние RETENTION изменений) или пропущено слишком много,
+вместо операций приходит компактный снимок каталога.
+'''
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min
+
+from .models import CartItem, ProductChange
+
+SNAPSHOT_FIELDS = ['id', 'author', 'product_name', 'product_price', 'product_quantity'] # Как в CartItemSerializer
+
+DEFAULTS = {
+    'RETENTION': 10000, # Сколько последних изменений хранить
+    'PRUNE_EVERY': 100, # Как часто (в изменениях) удалять старые записи
+    'MAX_CATCH_UP': 5000, # Если пропущено больше - дешевле отдать снимок
+    'SNAPSHOT_MAX_ROWS': 10000, # Каталог больше - вместо снимка просим клиента перезагрузить список через API
+    'BATCH': 500, # Операций в одном кадре при догонянии
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PRODUCT_CHANGELOG', {})}
+
+
+def payload_for(op):
+    if op['op'] == ProductChange.CREATED:
+        return op['data']
+    if op['op'] == ProductChange.UPDATED:
+        return op['changes']
+    return {}
+
+
+def record_changes(ops):
+    "Записывает операции в журнал (в текущей транзакции) и проставляет им seq"
+    if not ops:
+        return ops
+    changes = ProductChange.objects.bulk_create([
+        ProductChange(product_id=op['id'], op=op['op'], payload=payload_for(op)) for op in ops
+    ])
+    for op, change in zip(ops, changes):
+        op['seq'] = change.seq
+
+    config = get_config()
+    first, last = changes[0].seq, changes[-1].seq
+    if config['RETENTION'] and last // config['PRUNE_EVERY'] != (first - 1) // config['PRUNE_EVERY']:
+        prune(last, config['RETENTION'])
+    return ops
+
+
+def prune(last_seq=None, retention=None):
+    "Удаляет записи старше последних retention изменений. Возвращает число удалённых"
+    retention = retention or get_config()['RETENTION']
+    if last_seq is None:
+        last_seq = ProductChange.objects.aggregate(seq=Max('seq'))['seq'] or 0
+    deleted, _ = ProductChange.objects.filter(seq__lte=last_seq - retention).delete()
+    return deleted
+
+
+def reset():
+    '''
+    Очищает журнал, когда каталог изменили мимо него (manage.py import_catalog).
+    Клиенты с ?since= из любого прежнего seq после этого получают снимок, а не неполный список операций.
+    '''
+    ProductChange.objects.all().delete()
+
+
+def as_op(change):
+    "Запись журнала в виде операции для клиента (тот же формат, что у живых событий)"
+    op = {'op': change.op, 'id': change.product_id, 'seq': change.seq}
+    if change.op == ProductChange.CREATED:
+        op['data'] = change.payload
+    elif change.op == ProductChange.UPDATED:
+        op['changes'] = change.payload
+    return op
+
+
+def snapshot():
+    "Компактный снимок каталога: имена полей один раз и строки значений"
+    rows = CartItem.objects.order_by('id').values_list(*SNAPSHOT_FIELDS)
+    return {'fields': SNAPSHOT_FIELDS, 'rows': [list(row) for row in rows]}
+
+
+def catch_up(since):
+    '''
+    Что отправить клиенту, который видел изменения до since включительно:
+        {'ops': [...], 'seq': N}       - пропущенные операции (возможно, пустой список)
+        {'snapshot': {...}, 'seq': N}  - журнал не покрывает пропуск, отдаём снимок
+        {'resync': True, 'seq': N}     - каталог слишком большой для снимка, клиент перезагружает список сам
+    seq - последний номер изменения, учтённый в ответе.
+    '''
+    config = get_config()
+    with transaction.atomic(): # Одно согласованное чтение журнала и каталога
+        bounds = ProductChange.objects.aggregate(oldest=Min('seq'), latest=Max('seq'))
+        oldest, latest = bounds['oldest'], bounds['latest'] or 0
+        if since == latest:
+            return {'ops': [], 'seq': latest}
+
+        covered = oldest is not None and oldest <= since + 1 and since < latest
+        if covered and latest - since <= config['MAX_CATCH_UP']:
+            changes = ProductChange.objects.filter(seq__gt=since, seq__lte=latest).order_by('seq')
+            return {'ops': [as_op(change) for change in changes], 'seq': latest}
+
+        # Журнал уже не содержит нужных записей, пропущено слишком много или since из другой базы (больше latest)
+        if CartItem.objects.count() > config['SNAPSHOT_MAX_ROWS']:
+            return {'resync': True, 'seq': latest}
+        return {'snapshot': snapshot(), 'seq': latest}
@@ -0,0 +1,90 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.views.decorators.http import condition
+
+from .cache import get_catalog_state, normalized_query
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+class ConditionalResponseMixin:
+    '''
+    Условные запросы для ViewSet карточек.
+    GET list/retrieve отдают сильный ETag и Last-Modified; при совпадении If-None-Match возвращается 304
+    ещё до запроса строк и сериализации. Для списка валидатор - версия каталога и время её смены из api.CatalogVersion
+    (одна строка в базе, общая для всех воркеров, поэтому ETag у них совпадает и меняется после записи в любом из них),
+    для карточки - её updated_at (один запрос по первичному ключу).
+    PUT/PATCH/DELETE учитывают If-Match: если карточку уже изменили, возвращается 412 вместо перезаписи.
+    '''
+
+    def list(self, request, *args, **kwargs):
+        handler = condition(etag_func=self.list_etag, last_modified_func=self.list_last_modified)(super().list)
+        return handler(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = condition(etag_func=self.detail_etag, last_modified_func=self.detail_last_modified)(super().retrieve)
+        return handler(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        handler = condition(etag_func=self.detail_etag, last_modified_func=self.detail_last_modified)(super().update)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200: # Новый ETag, чтобы клиент мог сразу делать следующее условное изменение
+            instance = self.get_object()
+            response['ETag'] = '"%s"' % self.make_detail_etag(request, instance.pk, instance.updated_at)
+        return response
+
+    def destroy(self, request, *args, **kwargs):
+        handler = condition(etag_func=self.detail_etag, last_modified_func=self.detail_last_modified)(super().destroy)
+        return handler(request, *args, **kwargs)
+
+    # partial_update вызывает update, поэтому отдельно его оборачивать не нужно
+
+    def get_object(self):
+        # Для изменяющих запросов объект уже загружен (и права проверены) при вычислении ETag
+        obj = getattr(self, '_conditional_object', None)
+        if obj is None:
+            obj = super().get_object()
+            if self.request.method not in ('GET', 'HEAD'):
+                self._conditional_object = obj
+        return obj
+
+    def list_etag(self, request, *args, **kwargs):
+        return make_etag(
+            get_catalog_state(request)[0], request.get_host(), request.path, normalized_query(request), request.accepted_media_type
+        )
+
+    def list_last_modified(self, request, *args, **kwargs):
+        return get_catalog_state(request)[1]
+
+    def get_detail_validator(self, request):
+        "(pk, updated_at) карточки или None, если её нет. Считается один раз за запрос."
+        if not hasattr(self, '_detail_validator'):
+            if request.method in ('GET', 'HEAD'):
+                # Только updated_at по первичному ключу - без загрузки строки целиком
+                lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+                pk = self.kwargs[lookup_url_kwarg]
+                try:
+                    updated_at = self.get_queryset().filter(**{self.lookup_field: pk}).values_list('updated_at', flat=True).first()
+                except (TypeError, ValueError, ValidationError): # pk не того типа: 404 вернёт get_object() во view
+                    updated_at = None
+                self._detail_validator = None if updated_at is None else (pk, updated_at)
+            else:
+                # Для записи сначала проверяем права на объект, чтобы чужой пользователь получил 403, а не 412
+                obj = self.get_object()
+                self._detail_validator = (obj.pk, obj.updated_at)
+        return self._detail_validator
+
+    def make_detail_etag(self, request, pk, updated_at):
+        fields = self.get_sparse_fields() if hasattr(self, 'get_sparse_fields') else None
+        return make_etag(str(pk), updated_at.isoformat(), request.accepted_media_type, *([','.join(fields)] if fields else []))
+
+    def detail_etag(self, request, *args, **kwargs):
+        validator = self.get_detail_validator(request)
+        return None if validator is None else self.make_detail_etag(request, *validator)
+
+    def detail_last_modified(self, request, *args, **kwargs):
+        validator = self.get_detail_validator(request)
+        return None if validator is None else validator[1]
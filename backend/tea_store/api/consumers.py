@@ -1,20 +1,247 @@
-import json
-from channels.generic.websocket import WebsocketConsumer
-from asgiref.sync import async_to_sync 
-
-class ProductConsumer(WebsocketConsumer):
-    def connect(self): # Метод connect вызывается, когда устанавливается новое вебсокет соединение
-        async_to_sync(self.channel_layer.group_add)(
-            'products_updates',
-            self.channel_name
-        )
-        self.accept()
-
-    def disconnect(self, close_code): # Метод disconnect вызывается, когда вебсокет соединение закрывается 
-        async_to_sync(self.channel_layer.group_discard)(
-            'products_updates',
-            self.channel_name
-        )
-
-    def product_update(self, event): # Мой хендлер сообщений
-        self.send(text_data=json.dumps(event['message']))
\ No newline at end of file
+import asyncio
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.consumer import get_handler_name
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from tea_store import metrics
+
+from . import changelog, protocol
+from .events import CATALOG_GROUP, PRODUCTS_GROUP
+from .topics import Subscription, SubscriptionError
+
+IDLE_CLOSE_CODE = 4000 # Клиент давно ничего не присылал (не отвечал на ping)
+SEEN_OPS_LIMIT = 4096 # Сколько последних (eid, id) помнит соединение, чтобы не отправить одну операцию дважды
+
+
+class ProductConsumer(AsyncWebsocketConsumer):
+    '''
+    Рассылка изменений карточек подписчикам ws/products/.
+
+    Консьюмер асинхронный, поэтому соединение не занимает поток из пула sync_to_async.
+    Сообщения группы не отправляются сразу, а складываются в ограниченную очередь соединения (outbox),
+    которую разбирает отдельная задача. Если клиент читает медленно, изменения одной карточки схлопываются
+    (остаётся последнее), а при переполнении самые старые события выбрасываются и клиенту уходит {"resync": true}:
+    ему нужно перезапросить список целиком. Так медленный клиент не копит память и не тормозит остальных.
+
+    Раз в HEARTBEAT секунд клиенту уходит {"ping": <time>}, клиент отвечает {"pong": ...}.
+    Если от клиента ничего не приходило дольше IDLE_TIMEOUT секунд, соединение закрывается.
+    Только для клиентов v2: старый клиент (без подпротокола) ping не понимает, для него остаётся ping на уровне транспорта.
+
+    Формат кадров выбирается при подключении по подпротоколу WebSocket (см. protocol.py):
+    products.v2.json / products.v2.msgpack - операции created/updated/deleted с дельтами, без подпротокола - старый формат.
+
+    Сразу после подключения сокет получает все изменения (общая группа). После {"subscribe": {...}} (см. topics.py)
+    он переходит в группы своих тем и получает только подходящие операции; когда подписок не остаётся,
+    возвращается в общую группу. На каждое изменение подписок клиенту уходит {"subscribed": {...}} или {"error": "..."}.
+
+    Клиент v2 может подключиться с ?since=<seq> (последний seq, который он видел): до живых событий ему уйдут
+    пропущенные операции из журнала или снимок {"snapshot": ..., "seq": N} (см. changelog.py), затем {"caught_up": N}.
+    '''
+    group_name = PRODUCTS_GROUP
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        config = getattr(settings, 'PRODUCT_EVENTS', {})
+        self.max_pending = config.get('MAX_PENDING', 1000)
+        self.heartbeat = config.get('HEARTBEAT', 25)
+        self.idle_timeout = config.get('IDLE_TIMEOUT', 60)
+
+        self.subprotocol = protocol.LEGACY
+        self.outbox = OrderedDict() # id -> операция (protocol.created_op/updated_op/deleted_op)
+        self.outbox_ready = asyncio.Event()
+        self.resync_required = False
+        self.resync_details = None # Что сообщить вместе с resync (итоги импорта каталога)
+        self.stats = {'received': 0, 'coalesced': 0, 'dropped': 0, 'sent': 0}
+        self.last_seen = time.monotonic()
+        self.tasks = []
+        self.subscription = Subscription()
+        self.joined = set() # Группы channel layer, в которых сейчас состоит соединение
+        self.seen = OrderedDict()
+        self.counted = False # Соединение учтено в metrics.WS_CONNECTIONS
+        self.caught_up_seq = None # Живые операции с seq не больше этого клиент уже получил при догонянии
+
+    async def dispatch(self, message):
+        # AsyncConsumer.dispatch перед каждым хендлером вызывает aclose_old_connections() - это переход через sync_to_async,
+        # а все такие переходы выполняются по очереди в одном потоке. Консьюмер в базу не ходит, поэтому обходимся без него:
+        # иначе рассылка на тысячи сокетов упирается в этот поток
+        handler = getattr(self, get_handler_name(message), None)
+        if handler is None:
+            raise ValueError('No handler for message type %s' % message['type'])
+        await handler(message)
+
+    async def connect(self): # Метод connect вызывается, когда устанавливается новое вебсокет соединение
+        self.subprotocol = protocol.choose_subprotocol(self.scope.get('subprotocols', []))
+        await self.sync_groups() # Сначала группы: живые события, пришедшие во время догоняния, подождут в очереди
+        await self.accept(subprotocol=self.subprotocol)
+        self.counted = True
+        metrics.WS_CONNECTIONS.inc(consumer='products')
+        metrics.WS_CONNECTIONS_TOTAL.inc(consumer='products')
+        since = self.get_since()
+        if since is not None and self.subprotocol is not protocol.LEGACY:
+            await self.send_catch_up(since)
+        self.tasks.append(asyncio.create_task(self.sender()))
+        if self.heartbeat and self.subprotocol is not protocol.LEGACY: # Старые клиенты не знают ping и не отвечают pong
+            self.tasks.append(asyncio.create_task(self.heartbeat_loop()))
+
+    async def disconnect(self, close_code): # Метод disconnect вызывается, когда вебсокет соединение закрывается
+        for task in self.tasks:
+            task.cancel()
+        if self.counted:
+            self.counted = False
+            metrics.WS_CONNECTIONS.dec(consumer='products')
+        for group in self.joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.joined = set()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Любое сообщение от клиента (в том числе pong) продлевает соединение
+        self.last_seen = time.monotonic()
+        message = protocol.decode(text_data, bytes_data)
+        if not isinstance(message, dict):
+            return
+        if 'subscribe' in message:
+            await self.change_subscription(self.subscription.add, message['subscribe'])
+        elif 'unsubscribe' in message:
+            await self.change_subscription(self.subscription.remove, message['unsubscribe'])
+
+    # --- Догоняние по журналу изменений ---
+
+    def get_since(self):
+        values = parse_qs(self.scope.get('query_string', b'').decode('latin-1')).get('since')
+        try:
+            since = int(values[-1])
+        except (TypeError, ValueError):
+            return None
+        return since if since >= 0 else None
+
+    async def send_catch_up(self, since):
+        result = await database_sync_to_async(changelog.catch_up)(since)
+        self.caught_up_seq = result['seq']
+        if 'ops' in result:
+            batch = changelog.get_config()['BATCH']
+            for start in range(0, len(result['ops']), batch):
+                for frame in protocol.encode_ops(result['ops'][start:start + batch], self.subprotocol):
+                    await self.send_frame(frame)
+        elif 'snapshot' in result:
+            await self.send_frame(protocol.encode_control({'snapshot': result['snapshot'], 'seq': result['seq']}, self.subprotocol))
+        else:
+            await self.send_frame(protocol.encode_control({'resync': True}, self.subprotocol))
+        await self.send_frame(protocol.encode_control({'caught_up': result['seq']}, self.subprotocol))
+
+    # --- Подписки ---
+
+    async def change_subscription(self, change, spec):
+        try:
+            change(spec, self.scope.get('user'))
+        except SubscriptionError as error:
+            await self.send_frame(protocol.encode_control({'error': str(error)}, self.subprotocol))
+            return
+        await self.sync_groups()
+        await self.send_frame(protocol.encode_control({'subscribed': self.subscription.as_dict()}, self.subprotocol))
+
+    async def sync_groups(self):
+        "Приводит членство в группах channel layer к текущим подпискам"
+        if self.subscription:
+            groups, firehose = self.subscription.groups()
+        else:
+            groups, firehose = set(), True
+        if firehose: # Нет подписок или диапазон цены слишком широк для корзин - нужна общая группа
+            groups.add(self.group_name)
+        groups.add(CATALOG_GROUP) # События о каталоге целиком получают все
+        for group in groups - self.joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.joined - groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.joined = groups
+
+    def is_duplicate(self, eid, pk):
+        "Одна и та же операция приходит из нескольких групп, если сокет подписан на несколько её тем"
+        if eid is None:
+            return False
+        key = (eid, pk)
+        if key in self.seen:
+            return True
+        self.seen[key] = None
+        if len(self.seen) > SEEN_OPS_LIMIT:
+            self.seen.popitem(last=False)
+        return False
+
+    # --- Хендлеры сообщений группы: только кладут события в очередь соединения ---
+
+    async def product_events(self, event): # Пачка операций от ProductEventDispatcher
+        ops = event['ops']
+        if self.caught_up_seq is not None:
+            ops = [op for op in ops if op.get('seq') is None or op['seq'] > self.caught_up_seq]
+        if self.subscription:
+            # Корзины цены шире диапазонов, а общая группа приносит всё подряд - оставляем только подходящее
+            eid = event.get('eid')
+            ops = [op for op in ops if self.subscription.matches(op) and not self.is_duplicate(eid, op['id'])]
+        if ops:
+            self.enqueue(ops)
+
+    async def product_update(self, event): # Старый формат сообщения: одна карточка или список карточек целиком
+        message = event['message']
+        items = message if isinstance(message, list) else [message]
+        self.enqueue(protocol.updated_op(item) for item in items)
+
+    async def product_delete(self, event): # Старый формат сообщения: {"deleted": [id, ...]}
+        self.enqueue(protocol.deleted_op(pk) for pk in event['message']['deleted'])
+
+    async def catalog_changed(self, event): # Каталог изменён целиком (импорт): накопленные операции устарели
+        self.outbox.clear()
+        self.resync_required = True
+        self.resync_details = event.get('details')
+        self.outbox_ready.set()
+
+    def enqueue(self, ops):
+        for op in ops:
+            self.stats['received'] += 1
+            previous = self.outbox.pop(op['id'], None) # Порядок - по последнему изменению
+            if previous is not None:
+                self.stats['coalesced'] += 1
+            self.outbox[op['id']] = protocol.merge_ops(previous, op)
+        while len(self.outbox) > self.max_pending:
+            self.outbox.popitem(last=False)
+            self.stats['dropped'] += 1
+            self.resync_required = True
+        self.outbox_ready.set()
+
+    def take_outbox(self):
+        "Накопленные операции и служебное сообщение resync (или None)"
+        pending, self.outbox = self.outbox, OrderedDict()
+        resync = None
+        if self.resync_required:
+            resync = {'resync': True}
+            if self.resync_details is not None:
+                resync['import'] = self.resync_details
+        self.resync_required, self.resync_details = False, None
+        self.outbox_ready.clear()
+        return pending, resync
+
+    # --- Фоновые задачи соединения ---
+
+    async def sender(self):
+        while True:
+            await self.outbox_ready.wait()
+            pending, resync = self.take_outbox()
+            if resync:
+                metrics.WS_RESYNCS.inc(consumer='products')
+                await self.send_frame(protocol.encode_control(resync, self.subprotocol))
+            for frame in protocol.encode_ops(list(pending.values()), self.subprotocol) if pending else []:
+                await self.send_frame(frame) # Пока идёт отправка, новые события копятся и схлопываются
+
+    async def heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            if self.idle_timeout and time.monotonic() - self.last_seen > self.idle_timeout:
+                await self.close(code=IDLE_CLOSE_CODE)
+                return
+            await self.send_frame(protocol.encode_control({'ping': time.time()}, self.subprotocol))
+
+    async def send_frame(self, frame):
+        await self.send(**frame)
+        self.stats['sent'] += 1
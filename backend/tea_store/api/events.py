@@ -0,0 +1,202 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import SyncToAsync, async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from tea_store import metrics
+
+from .protocol import PROTOCOL_VERSION, merge_ops
+from .topics import op_groups
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_GROUP = 'products_updates'
+CATALOG_GROUP = 'products_catalog' # В ней все сокеты ws/products/ независимо от подписок
+
+
+def _server_loop():
+    '''
+    Event loop ASGI-сервера, если нас вызвали из его потока или из sync-кода, который он запустил через sync_to_async.
+    InMemoryChannelLayer держит очереди, привязанные к этому loop, поэтому отправлять сообщения нужно именно из него.
+    '''
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+    if loop is not None and getattr(SyncToAsync.threadlocal, 'main_event_loop_pid', None) == os.getpid():
+        return loop
+    return None
+
+
+class ProductEventDispatcher:
+    '''
+    Рассылка изменений карточек подписчикам ws/products/ вне пути запроса.
+
+    Запрос только кладёт операции (created/updated/deleted, см. protocol.py) в словарь ожидающих (после коммита
+    транзакции), а фоновая asyncio-задача через небольшое окно (debounce) отправляет всё накопленное одним сообщением.
+    Внутри окна операции над одной карточкой схлопываются (merge_ops), поэтому десять изменений одной карточки
+    дают одну операцию, а изменения разных карточек уходят одним списком.
+
+    Все операции уходят в общую группу (клиенты без подписок), а каждая операция ещё и в группы своих тем
+    (автор, карточка, корзина цены - см. topics.py), где её получат только подписчики этих тем.
+
+    Ожидающие операции и отложенная отправка свои у каждого loop: операции из запросов ASGI-сервера уходят из его loop,
+    операции из manage.py и тестов - из собственного фонового loop, и одни не задерживают и не забирают другие.
+    '''
+
+    def __init__(self, debounce=0.05, group=PRODUCTS_GROUP, channel_layer_alias='default'):
+        self.debounce = debounce
+        self.group = group
+        self.channel_layer_alias = channel_layer_alias
+        self.stats = {'published': 0, 'coalesced': 0, 'flushes': 0, 'messages': 0, 'errors': 0}
+
+        self._lock = threading.Lock()
+        self._pending = {} # loop -> {id: операция}; есть ключ - в этом loop уже запланирована отправка
+        self._server_loop = None
+        self._own_loop = None
+        self._own_loop_lock = threading.Lock()
+
+    # --- Публикация (вызывается из запросов, после коммита) ---
+
+    def publish(self, ops):
+        "Операции из protocol.py (created_op/updated_op/deleted_op)"
+        loop = _server_loop()
+        with self._lock:
+            if loop is not None:
+                self._server_loop = loop
+            loop = self._get_loop()
+            pending = self._pending.get(loop)
+            schedule = pending is None
+            if schedule:
+                pending = self._pending[loop] = OrderedDict()
+            for op in ops:
+                self.stats['published'] += 1
+                previous = pending.pop(op['id'], None) # Переставляем в конец: порядок - по последнему изменению
+                if previous is not None:
+                    self.stats['coalesced'] += 1
+                pending[op['id']] = merge_ops(previous, op)
+        if schedule:
+            loop.call_soon_threadsafe(self._arm, loop)
+
+    # --- Фоновая отправка ---
+
+    def _get_loop(self):
+        loop = self._server_loop
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            return loop
+        # Нет ASGI-сервера (WSGI, manage.py, тесты) - поднимаем свой loop в фоновом потоке
+        with self._own_loop_lock:
+            if self._own_loop is None:
+                self._own_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._own_loop.run_forever, name='product-events', daemon=True).start()
+        return self._own_loop
+
+    def _arm(self, loop):
+        loop.call_later(self.debounce, lambda: loop.create_task(self.flush(loop)))
+
+    def _take_pending(self, loop=None):
+        "Забирает ожидающие операции loop (None - всех loop)"
+        with self._lock:
+            if loop is not None:
+                return self._pending.pop(loop, OrderedDict())
+            pending = OrderedDict()
+            for ops in self._pending.values():
+                pending.update(ops)
+            self._pending.clear()
+        return pending
+
+    def build_message(self, pending):
+        "Сообщение для общей группы со всеми накопленными операциями"
+        return {'type': 'product_events', 'v': PROTOCOL_VERSION, 'ops': list(pending.values())}
+
+    def build_messages(self, pending):
+        '''
+        Сообщения для всех групп: {группа: сообщение}. У сообщений одной пачки общий eid,
+        по нему консьюмер, подписанный на несколько тем, отбрасывает повторы одной и той же операции.
+        '''
+        message = self.build_message(pending)
+        message['eid'] = uuid.uuid4().hex
+        topics = {}
+        for op in message['ops']:
+            for group in op_groups(op):
+                topics.setdefault(group, []).append(op)
+        messages = {self.group: message}
+        for group, ops in topics.items():
+            messages[group] = {**message, 'ops': ops}
+        return messages
+
+    async def flush(self, loop=None):
+        "Отправляет операции, накопленные для loop (None - все)"
+        pending = self._take_pending(loop)
+        if not pending:
+            return
+        self.stats['flushes'] += 1
+        channel_layer = get_channel_layer(self.channel_layer_alias)
+        if channel_layer is None:
+            return
+        flush_start = time.perf_counter()
+        for group, message in self.build_messages(pending).items():
+            start = time.perf_counter()
+            try:
+                await channel_layer.group_send(group, message)
+                self.stats['messages'] += 1
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception('Не удалось разослать изменения карточек в группу %s', group)
+            metrics.GROUP_SEND_LATENCY.observe(time.perf_counter() - start, kind='all' if group == self.group else 'topic')
+        metrics.EVENT_FLUSH_LATENCY.observe(time.perf_counter() - flush_start)
+
+    def drain(self, timeout=5):
+        '''
+        Синхронно отправляет всё накопленное (для manage.py-команд и выхода из процесса).
+        Не через async_to_sync: при выходе его пул потоков уже закрыт. Операции loop отправляются из него самого,
+        а если он уже остановлен - из временного loop.
+        '''
+        with self._lock:
+            loops = list(self._pending)
+        for loop in loops:
+            if loop.is_running() and not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(self.flush(loop), loop).result(timeout)
+            else:
+                asyncio.run(self.flush(loop))
+
+    def reset(self):
+        "Отправляет накопленное и забывает loop сервера (между прогонами в одном процессе, например в бенчмарках)"
+        self.drain()
+        with self._lock:
+            self._server_loop = None
+
+
+def publish_catalog_changed(details, channel_layer_alias='default'):
+    '''
+    Одно сообщение всем сокетам ws/products/: каталог изменился целиком (например, manage.py import_catalog),
+    операций по отдельным карточкам не будет. Сокет выбрасывает накопленные операции и отправляет клиенту
+    {"resync": true, "import": details} - клиент перезагружает список.
+    '''
+    channel_layer = get_channel_layer(channel_layer_alias)
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(CATALOG_GROUP, {'type': 'catalog_changed', 'v': PROTOCOL_VERSION, 'details': details})
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                config = getattr(settings, 'PRODUCT_EVENTS', {})
+                _dispatcher = ProductEventDispatcher(debounce=config.get('DEBOUNCE', 0.05))
+                atexit.register(_dispatcher.drain)
+    return _dispatcher
@@ -0,0 +1,129 @@
+'''
+Быстрое чтение карточек для GET list/retrieve.
+
+CartItemSerializer на каждую строку создаёт экземпляр модели и вызывает to_representation каждого поля.
+Для плоских полей это лишняя работа: здесь строки читаются через .values(), а словари ответа собираются
+по карте полей, которая один раз строится из самого сериализатора (имя в ответе, колонка, преобразование).
+Поэтому ответ совпадает с ответом сериализатора байт в байт (это проверяют тесты), а при добавлении
+в сериализатор поля, которое карта не умеет (вложенный сериализатор, SerializerMethodField, source='a.b'),
+быстрый путь просто выключается и работает обычный сериализатор.
+
+Выключается настройкой CARTITEMS_FAST_READ = False.
+'''
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404 # В отличие от django.shortcuts: id не того типа - 404
+from rest_framework.response import Response
+
+from tea_store.timing import span
+
+# Поля сериализатора, значение которых получается из значения колонки простым преобразованием
+# (то же, что делает to_representation этих полей)
+CONVERTERS = {
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+    serializers.CharField: str,
+}
+
+
+class FieldMap:
+    "Карта полей сериализатора: [(имя в ответе, колонка для .values(), преобразование или None)]"
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = [column for _, column, _ in fields]
+
+    @classmethod
+    def for_serializer(cls, serializer_class):
+        "FieldMap или None, если какое-то поле нельзя получить напрямую из колонки"
+        model_fields = {field.name: field for field in serializer_class.Meta.model._meta.concrete_fields}
+        fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if field.source not in model_fields: # Свойство модели, source='a.b' или '*'
+                return None
+            if type(field) in CONVERTERS:
+                fields.append((name, field.source, CONVERTERS[type(field)]))
+            elif type(field) is serializers.PrimaryKeyRelatedField and field.pk_field is None:
+                fields.append((name, field.source, None)) # .values('author') отдаёт id автора
+            else:
+                return None
+        return cls(fields)
+
+    def build(self, row):
+        "Словарь ответа из строки .values(); None не преобразуется, как и в Serializer.to_representation"
+        data = {}
+        for name, column, convert in self.fields:
+            value = row[column]
+            data[name] = value if convert is None or value is None else convert(value)
+        return data
+
+    def select(self, names):
+        "Карта только для полей names (?fields=, см. sparse.py)"
+        return FieldMap([field for field in self.fields if field[0] in names])
+
+    def build_many(self, rows):
+        build = self.build
+        return [build(row) for row in rows]
+
+
+class FastReadMixin:
+    '''
+    Миксин для ViewSet: list/retrieve без создания экземпляров модели и вызова сериализатора.
+    Должен стоять в базовых классах после миксинов кэша и условных запросов, чтобы они оборачивали быстрый путь.
+    '''
+    _field_maps = {}
+
+    def get_sparse_fields(self):
+        "Выбранные поля ответа (переопределяет SparseFieldsMixin)"
+        return None
+
+    def get_field_map(self):
+        if not getattr(settings, 'CARTITEMS_FAST_READ', True):
+            return None
+        serializer_class = self.get_serializer_class()
+        if serializer_class not in self._field_maps:
+            self._field_maps[serializer_class] = FieldMap.for_serializer(serializer_class)
+        field_map = self._field_maps[serializer_class]
+        fields = self.get_sparse_fields()
+        if field_map is None or fields is None:
+            return field_map
+        return field_map.select(fields)
+
+    def get_values_queryset(self, queryset, field_map):
+        # Первичный ключ, поля сортировки и аннотации (например, ранг FTS5) нужны keyset-пагинации для курсора,
+        # даже если их нет в ответе
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        columns = [queryset.model._meta.pk.name, *field_map.columns, *(name for name in ordering if name in model_fields)]
+        return queryset.values(*dict.fromkeys(columns), *queryset.query.annotations)
+
+    def list(self, request, *args, **kwargs):
+        field_map = self.get_field_map()
+        if field_map is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.get_values_queryset(self.filter_queryset(self.get_queryset()), field_map)
+        page = self.paginate_queryset(queryset)
+        with span('serialize'):
+            data = field_map.build_many(page if page is not None else queryset)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        field_map = self.get_field_map()
+        if field_map is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(self.get_values_queryset(queryset, field_map), **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        # Права на объект проверяются на экземпляре модели, собранном из той же строки (без ещё одного запроса)
+        model = queryset.model
+        attnames = {field.name: field.attname for field in model._meta.concrete_fields}
+        self.check_object_permissions(request, model(**{attnames[column]: value for column, value in row.items() if column in attnames}))
+        with span('serialize'):
+            data = field_map.build(row)
+        return Response(data)
@@ -0,0 +1,224 @@
+'''
+Массовый импорт карточек из CSV/JSONL (manage.py import_catalog).
+
+Файл читается потоком и обрабатывается пачками по batch_size записей. Каждая пачка:
+  1. проверяется правилами CartItemSerializer (тот же run_validation, что и у POST /api/cartitems/),
+     плюс id и author, которые сериализатор на запись не принимает;
+  2. пишется в одной транзакции через bulk_create: записи с id - upsert (update_conflicts по id),
+     без id - обычная вставка. post_save не срабатывает, поэтому нет ни журнала, ни рассылки по каждой строке;
+  3. в той же транзакции итоги корзин (summary.py) меняются на дельту, журнал изменений очищается
+     (changelog.reset: он не покрывает импорт), версия каталога для кэша ответов меняется;
+  4. в той же транзакции в контрольную точку (api.CatalogImport) записывается, сколько записей файла уже
+     обработано - прерванный импорт продолжается с этого места, и пачка никогда не записывается дважды
+     (записи без id иначе создались бы повторно).
+В конце подписчики ws/products/ получают одно событие {"resync": true, "import": {...}} (events.publish_catalog_changed).
+'''
+import csv
+import json
+import os
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import changelog, summary
+from .events import publish_catalog_changed
+from .models import CartItem, CatalogImport
+from .serializer import CartItemSerializer
+from .signals import invalidate_catalog
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+UPDATE_FIELDS = ['author', 'product_name', 'product_price', 'product_quantity', 'updated_at']
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+def detect_format(path):
+    return FORMATS.get(os.path.splitext(path)[1].lower())
+
+
+def read_records(handle, fmt):
+    "Записи файла по одной: словарь или строка с описанием ошибки разбора"
+    if fmt == 'csv':
+        for row in csv.DictReader(handle):
+            # Пустая ячейка - как отсутствующее поле (например, product_quantity получит значение по умолчанию)
+            yield {key: value for key, value in row.items() if key is not None and value not in ('', None)}
+        return
+    for line in handle:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield f'Не JSON: {error}'
+            continue
+        yield record if isinstance(record, dict) else 'Ожидается JSON-объект'
+
+
+def file_signature(path):
+    "По нему контрольная точка проверяет, что продолжаем тот же файл"
+    stat = os.stat(path)
+    return {'file': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_checkpoint(source, signature):
+    "Счётчики прерванного импорта этого файла или None"
+    checkpoint = CatalogImport.objects.filter(source=source).first()
+    if checkpoint is None:
+        return None
+    if checkpoint.signature != signature:
+        raise CatalogImportError(f'Контрольная точка {source} относится к другому файлу или файл изменился')
+    return checkpoint.stats
+
+
+def save_checkpoint(source, signature, stats):
+    "Вызывается в транзакции пачки: прогресс фиксируется вместе с её карточками"
+    CatalogImport.objects.update_or_create(source=source, defaults={'signature': signature, 'stats': stats})
+
+
+def clear_checkpoint(source):
+    CatalogImport.objects.filter(source=source).delete()
+
+
+class CatalogImporter:
+    '''
+    Импорт одного файла. progress(stats, position, size) вызывается после каждой пачки (position - сколько байт
+    файла прочитано, примерно), report_error(record_number, errors) - для каждой отклонённой записи.
+    '''
+
+    def __init__(self, batch_size=5000, default_author=None, max_errors=None, progress=None, report_error=None):
+        self.batch_size = batch_size
+        self.default_author = default_author
+        self.max_errors = max_errors
+        self.progress = progress
+        self.report_error = report_error
+        self.serializer = CartItemSerializer()
+        self.known_authors = set()
+
+    def run(self, path, fmt=None, checkpoint=None, restart=False):
+        fmt = fmt or detect_format(path)
+        if fmt not in FORMATS.values():
+            raise CatalogImportError('Не удалось определить формат файла, укажите --format')
+        signature = file_signature(path)
+        checkpoint = checkpoint or signature['file']
+        stats = None if restart else load_checkpoint(checkpoint, signature)
+        stats = stats or {'records': 0, 'created': 0, 'updated': 0, 'invalid': 0}
+        skip, written = stats['records'], 0
+
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as handle:
+                records = islice(read_records(handle, fmt), skip, None) # Уже обработанное при прошлом запуске
+                while batch := list(islice(records, self.batch_size)):
+                    batch_stats = dict(stats) # Счётчики меняются, только если пачка закоммичена
+                    items = self.validate(batch, first_number=stats['records'] + 1, stats=batch_stats)
+                    with transaction.atomic():
+                        created, updated = self.write(items)
+                        batch_stats['records'] += len(batch)
+                        batch_stats['created'] += created
+                        batch_stats['updated'] += updated
+                        save_checkpoint(checkpoint, signature, batch_stats)
+                    stats = batch_stats
+                    written += created + updated
+                    if self.progress:
+                        self.progress(stats, handle.buffer.tell(), signature['size'])
+                    if self.max_errors is not None and stats['invalid'] > self.max_errors:
+                        raise CatalogImportError(f'Отклонено записей: {stats["invalid"]} (больше {self.max_errors}), импорт остановлен')
+        finally:
+            if written: # Даже после ошибки: записанные пачки уже в базе, клиентам нужно перезагрузить список
+                publish_catalog_changed({key: stats[key] for key in ('records', 'created', 'updated', 'invalid')})
+        clear_checkpoint(checkpoint) # Импорт завершён, продолжать нечего
+        return stats
+
+    def validate(self, batch, first_number, stats):
+        "Проверенные записи пачки: [{'id', 'author', 'product_name', 'product_price', 'product_quantity'}]"
+        items, errors = [], {}
+        for number, record in enumerate(batch, first_number):
+            if isinstance(record, str):
+                errors[number] = {'non_field_errors': [record]}
+                continue
+            try:
+                item = dict(self.serializer.run_validation(record))
+            except ValidationError as error:
+                errors[number] = error.detail
+                continue
+            try:
+                item['id'] = self.parse_id(record.get('id'), 'id', allow_none=True)
+                item['author'] = self.parse_id(record.get('author', self.default_author), 'author')
+            except ValidationError as error:
+                errors[number] = error.detail
+                continue
+            items.append((number, item))
+
+        missing = self.missing_authors({item['author'] for _, item in items})
+        for number, item in items:
+            if item['author'] in missing:
+                errors[number] = {'author': [f'Пользователь {item["author"]} не найден.']}
+        for number in sorted(errors):
+            stats['invalid'] += 1
+            if self.report_error:
+                self.report_error(number, errors[number])
+
+        # Повтор id внутри пачки: остаётся последняя запись, как при последовательной записи
+        unique = {}
+        for number, item in items:
+            if number not in errors:
+                unique[item['id'] if item['id'] is not None else ('new', number)] = item
+        return list(unique.values())
+
+    @staticmethod
+    def parse_id(value, name, allow_none=False):
+        if value is None and allow_none:
+            return None
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({name: ['Ожидается целое число.' if value is not None else 'Обязательное поле.']})
+        if value <= 0:
+            raise ValidationError({name: ['Ожидается положительное число.']})
+        return value
+
+    def missing_authors(self, author_ids):
+        unknown = author_ids - self.known_authors
+        if unknown:
+            self.known_authors |= set(get_user_model().objects.filter(id__in=unknown).values_list('id', flat=True))
+        return author_ids - self.known_authors
+
+    def write(self, items):
+        "Пишет пачку в транзакции (run() добавляет в неё контрольную точку). Возвращает (создано, обновлено)"
+        if not items:
+            return 0, 0
+        now = timezone.now()
+        objects = [
+            CartItem(
+                id=item['id'], author_id=item['author'], product_name=item['product_name'],
+                product_price=item['product_price'], product_quantity=item['product_quantity'], updated_at=now,
+            )
+            for item in items
+        ]
+        keyed = [obj for obj in objects if obj.id is not None]
+        new = [obj for obj in objects if obj.id is None]
+
+        with transaction.atomic():
+            existing = CartItem.objects.filter(id__in=[obj.id for obj in keyed]).values_list(
+                'id', 'author_id', 'product_price', 'product_quantity',
+            ) if keyed else []
+            deltas = summary.new_deltas()
+            updated = 0
+            for pk, author_id, price, quantity in existing: # Обновлённые карточки: прежние значения вычитаются
+                summary.add(deltas, author_id, price, quantity, sign=-1)
+                updated += 1
+            summary.add_items(deltas, objects)
+
+            # Сначала записи с id: новые получат id больше уже занятых и не перезапишут их
+            if keyed:
+                CartItem.objects.bulk_create(keyed, update_conflicts=True, unique_fields=['id'], update_fields=UPDATE_FIELDS)
+            if new:
+                CartItem.objects.bulk_create(new)
+            summary.apply(deltas)
+            changelog.reset()
+            invalidate_catalog()
+        return len(objects) - updated, updated
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from api import protocol
+from api.benchmarks import (
+    QueryCounter, compare, environment, generate_catalog, generate_users, isolated_database, run_requests, scenario_result,
+)
+from api.consumers import ProductConsumer
+from api.events import get_dispatcher
+from api.models import CartItem
+
+SCENARIOS = ['list', 'list_deep_page', 'list_cursor', 'price_filter', 'search', 'ordering', 'create', 'update', 'ws_fanout']
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочные сценарии REST и ws/products/ на синтетическом каталоге (во временной базе): '
+        'запросов/с для одного клиента, p50/p95/p99 и SQL-запросов на запрос. Результат можно сохранить в JSON '
+        'и сравнить с прогоном на другом коммите (--output / --compare)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--items', type=int, default=20_000)
+        parser.add_argument('--repeat', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--sockets', type=int, default=200, help='Подписчиков в сценарии ws_fanout')
+        parser.add_argument('--ws-rounds', type=int, default=20, help='Изменений карточки в сценарии ws_fanout')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--with-cache', action='store_true', help='Не выключать кэш ответов (по умолчанию меряем путь без кэша)')
+        parser.add_argument('--output', help='Куда сохранить результаты (JSON)')
+        parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as file:
+                    previous = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Не удалось прочитать {options["compare"]}: {error}')
+
+        overrides = {
+            # Запись лога запросов не должна попадать в замеры
+            'REQUEST_LOGGING': {'DEFAULT_RATE': 0.0, 'SLOW_MS': float('inf')},
+            'PRODUCT_EVENTS': {'HEARTBEAT': None, 'IDLE_TIMEOUT': None, 'MAX_PENDING': 10_000},
+            'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        }
+        if not options['with_cache']:
+            overrides['CARTITEMS_RESPONSE_CACHE'] = None
+
+        with override_settings(**overrides), isolated_database():
+            author_ids = generate_users(options['users'])
+            self.stdout.write(f'Генерация каталога: {options["items"]} карточек...')
+            generate_catalog(options['items'], author_ids)
+            self.user = get_user_model().objects.get(pk=author_ids[0])
+            results = {}
+            dispatcher = get_dispatcher()
+            for name in options['scenarios']:
+                # Изменения прошлого сценария не должны доехать до подписчиков ws_fanout и отнимать время у следующего
+                dispatcher.reset()
+                results[name] = getattr(self, f'scenario_{name}')(options)
+                self.report(name, results[name])
+            dispatcher.reset()
+
+        report = {'environment': environment(), 'options': {
+            key: options[key] for key in ('users', 'items', 'repeat', 'warmup', 'sockets', 'ws_rounds', 'with_cache')
+        }, 'scenarios': results}
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+        if previous is not None:
+            self.report_changes(previous, report)
+
+    def report(self, name, result):
+        queries = result.get('queries_per_request')
+        self.stdout.write(
+            f'{name:<15} {result["rps"]:>8.1f} req/s | p50={result["p50_ms"]:.2f}ms p95={result["p95_ms"]:.2f}ms '
+            f'p99={result["p99_ms"]:.2f}ms' + (f' | {queries} SQL/запрос' if queries is not None else '')
+        )
+
+    def report_changes(self, previous, report):
+        self.stdout.write(f'Сравнение с {previous["environment"].get("revision")} -> {report["environment"].get("revision")}:')
+        for name, changes in compare(previous['scenarios'], report['scenarios']).items():
+            parts = [f'{key} {before} -> {after} ({percent:+.1f}%)' for key, (before, after, percent) in changes.items()]
+            self.stdout.write(f'{name:<15} ' + ' | '.join(parts))
+
+    # --- Сценарии ---
+
+    def client(self):
+        client = Client()
+        client.force_login(self.user)
+        return client
+
+    def get(self, options, params=None):
+        client, url = self.client(), reverse('cartitem-list')
+        return run_requests(lambda: client.get(url, params), options['repeat'], options['warmup'])
+
+    def scenario_list(self, options):
+        return self.get(options)
+
+    def scenario_list_deep_page(self, options):
+        return self.get(options, {'page': max(1, options['items'] // 10 // 2)}) # Середина каталога, страница по PAGE_SIZE=10
+
+    def scenario_list_cursor(self, options):
+        return self.get(options, {'pagination': 'cursor'})
+
+    def scenario_price_filter(self, options):
+        return self.get(options, {'product_price__gte': 1000, 'product_price__lte': 1200})
+
+    def scenario_search(self, options):
+        return self.get(options, {'search': 'улун'})
+
+    def scenario_ordering(self, options):
+        return self.get(options, {'ordering': '-product_price'})
+
+    def scenario_create(self, options):
+        client, url = self.client(), reverse('cartitem-list')
+        payload = {'product_name': 'Бенчмарк Улун', 'product_price': 100, 'product_quantity': 1}
+        return run_requests(lambda: client.post(url, payload, content_type='application/json'), options['repeat'], options['warmup'])
+
+    def scenario_update(self, options):
+        client = self.client()
+        item = CartItem.objects.filter(author=self.user).first()
+        url = reverse('cartitem-detail', args=[item.id])
+        prices = iter(range(1, 10 ** 9))
+        return run_requests(
+            lambda: client.patch(url, {'product_price': next(prices)}, content_type='application/json'),
+            options['repeat'], options['warmup'],
+        )
+
+    def scenario_ws_fanout(self, options):
+        "Время от PATCH карточки до получения изменения последним из N подписчиков (включая debounce диспетчера)"
+        return asyncio.run(self.ws_fanout(options))
+
+    async def ws_fanout(self, options):
+        client = await sync_to_async(self.client)()
+        item = await CartItem.objects.filter(author=self.user).afirst()
+        url = reverse('cartitem-detail', args=[item.id])
+        application = ProductConsumer.as_asgi()
+        communicators = [WebsocketCommunicator(application, '/ws/products/', subprotocols=[protocol.JSON]) for _ in range(options['sockets'])]
+        await asyncio.gather(*(communicator.connect(timeout=60) for communicator in communicators))
+
+        counter, samples = QueryCounter(), []
+
+        def patch(price):
+            with connection.execute_wrapper(counter):
+                return client.patch(url, {'product_price': price}, content_type='application/json')
+
+        for price in range(options['ws_rounds'] + 1):
+            start, queries = time.perf_counter(), counter.count
+            response = await sync_to_async(patch)(price)
+            if response.status_code != 200:
+                raise CommandError(f'PATCH вернул {response.status_code}')
+            await asyncio.gather(*(communicator.receive_output(timeout=60) for communicator in communicators))
+            if price == 0: # Прогрев: первое соединение с базой в потоке sync_to_async
+                counter.count = queries
+                continue
+            samples.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(communicator.disconnect(timeout=60) for communicator in communicators))
+        result = scenario_result(samples, counter.count)
+        result['sockets'] = options['sockets']
+        return result
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from api.benchmarks import generate_catalog, generate_users, isolated_database, run_requests
+
+PROFILES = {
+    # Как было: сессия из таблицы django_session и пользователь из таблицы users на каждый запрос
+    'db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+    },
+    'cached': {}, # Текущие настройки: users.sessions и users.backends.CachedModelBackend
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'SQL-запросов и задержка GET /api/cartitems/ для анонимного и вошедшего пользователя '
+        'с сессиями и пользователем из базы (db) и из кэша (cached, users/backends.py)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+
+    def handle(self, *args, **options):
+        overrides = {
+            'REQUEST_LOGGING': {'DEFAULT_RATE': 0.0, 'SLOW_MS': float('inf')},
+            'CARTITEMS_RESPONSE_CACHE': None, # Иначе список отдаётся из кэша ответов и запросов к базе не видно вовсе
+        }
+        with override_settings(**overrides), isolated_database():
+            author_ids = generate_users(10)
+            generate_catalog(options['items'], author_ids)
+            user = get_user_model().objects.get(pk=author_ids[0])
+            url = reverse('cartitem-list')
+            for profile, settings in PROFILES.items():
+                with override_settings(**settings):
+                    anonymous, authenticated = Client(), Client()
+                    authenticated.force_login(user) # Внутри профиля: в сессию пишется его бэкенд
+                    for name, client in (('anonymous', anonymous), ('authenticated', authenticated)):
+                        result = run_requests(lambda: client.get(url), options['repeat'], options['warmup'])
+                        self.stdout.write(
+                            f'{profile:<7} {name:<14} {result["rps"]:>8.1f} req/s | p50={result["p50_ms"]:.2f}ms '
+                            f'p99={result["p99_ms"]:.2f}ms | {result["queries_per_request"]} SQL/запрос'
+                        )
@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from tea_store.channel_layers import SQLiteChannelLayer
+
+GROUP = 'bench_products'
+
+
+def _subscriber(path, channels_per_worker, messages, ready, results):
+    "Процесс-воркер: подписывает несколько каналов на группу и ждёт все сообщения"
+    async def run():
+        layer = SQLiteChannelLayer(path=path, capacity=messages + 10)
+        names = [await layer.new_channel() for _ in range(channels_per_worker)]
+        for name in names:
+            await layer.group_add(GROUP, name)
+        ready.put(os.getpid())
+
+        latencies = []
+
+        async def consume(name):
+            for _ in range(messages):
+                message = await layer.receive(name)
+                latencies.append(time.time() - message['sent'])
+
+        await asyncio.gather(*(consume(name) for name in names))
+        await layer.close()
+        results.put(latencies)
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = 'Пропускная способность рассылки (fan-out) через SQLiteChannelLayer между N процессами-воркерами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+        parser.add_argument('--channels', type=int, default=50, help='Подписчиков (каналов) в каждом воркере')
+        parser.add_argument('--messages', type=int, default=100, help='Сколько сообщений отправить в группу')
+        parser.add_argument('--timeout', type=float, default=120)
+
+    def handle(self, *args, **options):
+        for workers in options['workers']:
+            with tempfile.TemporaryDirectory() as directory:
+                self.run_scenario(workers, os.path.join(directory, 'channels.sqlite3'), options)
+
+    def run_scenario(self, workers, path, options):
+        from api.benchmarks import summarize # Импорт моделей возможен только после настройки Django, а воркеры её не делают
+
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        processes = [
+            context.Process(target=_subscriber, args=(path, options['channels'], options['messages'], ready, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.get(timeout=options['timeout'])
+
+        async def publish():
+            layer = SQLiteChannelLayer(path=path)
+            for i in range(options['messages']):
+                await layer.group_send(GROUP, {'type': 'product_update', 'i': i, 'sent': time.time()})
+            await layer.close()
+
+        start = time.perf_counter()
+        asyncio.run(publish())
+        latencies = []
+        try:
+            for _ in processes:
+                latencies.extend(results.get(timeout=options['timeout']))
+        except queue.Empty:
+            self.stderr.write('Не все воркеры получили сообщения за отведённое время')
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+        deliveries = len(latencies)
+        summary = summarize(latencies)
+        self.stdout.write(
+            f'воркеров={workers} подписчиков={workers * options["channels"]} сообщений={options["messages"]} | '
+            f'доставок={deliveries} за {elapsed:.2f}s = {deliveries / elapsed:,.0f} доставок/с | '
+            f'задержка p50={summary["p50_ms"]:.1f}ms p99={summary["p99_ms"]:.1f}ms'
+        )
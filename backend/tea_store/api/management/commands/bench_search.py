@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import filters
+from rest_framework.test import APIRequestFactory
+
+from api.benchmarks import generate_catalog, generate_users, isolated_database, measure, summarize
+from api.views import CartItemViewSet
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает задержку поиска FTS5 и LIKE %term% на каталоге из 100k и 1M товаров (во временной базе)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--terms', nargs='+', default=['улун', 'пуэр жасм', 'дарджилинг', 'им', 'нет такого'])
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = CartItemViewSet.as_view({'get': 'list'})
+        # Тот же viewset, но со старым SearchFilter (LIKE '%term%') для сравнения
+        like_view = CartItemViewSet.as_view(
+            {'get': 'list'},
+            filter_backends=[DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter],
+        )
+
+        with isolated_database():
+            author_ids = generate_users(10)
+            generated = 0
+            for size in sorted(options['sizes']):
+                self.stdout.write(f'Генерация каталога до {size} товаров...')
+                generated += generate_catalog(size - generated, author_ids, seed=size)
+
+                for term in options['terms']:
+                    def api_search(view=view, term=term):
+                        view(factory.get('/api/cartitems/', {'search': term})).render()
+
+                    def like_search(term=term):
+                        like_view(factory.get('/api/cartitems/', {'search': term})).render()
+
+                    fts = summarize(measure(api_search, repeat=options['repeat']))
+                    like = summarize(measure(like_search, repeat=options['repeat']))
+                    self.stdout.write(
+                        f'{size:>9} товаров | {term!r:<14} | FTS5 p50={fts["p50_ms"]:.2f}ms p95={fts["p95_ms"]:.2f}ms'
+                        f' | LIKE p50={like["p50_ms"]:.2f}ms p95={like["p95_ms"]:.2f}ms'
+                    )
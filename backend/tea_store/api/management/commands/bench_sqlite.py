@@ -0,0 +1,98 @@
+import os
+import random
+import tempfile
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.test.utils import override_settings
+
+from api.benchmarks import generate_catalog, generate_users, replaced_default_database, summarize
+from api.models import CartItem
+from tea_store.sqlite_backend import production_database
+
+PROFILES = ['default', 'production', 'production_write_lock']
+
+
+def profile_config(name, path):
+    if name == 'default': # Как DATABASES до production-режима: без прагм, соединение на каждый запрос
+        return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+    return production_database(path, write_lock=name == 'production_write_lock')
+
+
+class Command(BaseCommand):
+    help = (
+        'Конкурентная нагрузка на файл SQLite: читатели (фильтр по цене) и писатели (транзакция чтение-изменение, '
+        'как get_object() + save()) в отдельных потоках. Сравнивает обычные настройки DATABASES с production-режимом '
+        '(tea_store/sqlite_backend): чтений/с, записей/с, задержки и ошибки "database is locked". '
+        'Каждый профиль - на своём свежем файле во временном каталоге'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=PROFILES)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=5, help='Секунд нагрузки на профиль')
+        parser.add_argument('--items', type=int, default=20_000)
+
+    def handle(self, *args, **options):
+        for name in options['profiles']:
+            with tempfile.TemporaryDirectory() as directory:
+                config = profile_config(name, os.path.join(directory, 'bench.sqlite3'))
+                with override_settings(CARTITEMS_RESPONSE_CACHE=None), replaced_default_database(config):
+                    call_command('migrate', verbosity=0, interactive=False)
+                    generate_catalog(options['items'], generate_users(20))
+                    self.ids = list(CartItem.objects.values_list('id', flat=True))
+                    connection.close()
+                    self.report(name, self.run_load(options))
+
+    def run_load(self, options):
+        deadline = time.perf_counter() + options['duration']
+        results = {'read': [], 'write': [], 'errors': []}
+        threads = [threading.Thread(target=self.worker, args=(self.read, deadline, results['read'], results['errors']))
+                   for _ in range(options['readers'])]
+        threads += [threading.Thread(target=self.worker, args=(self.write, deadline, results['write'], results['errors']))
+                    for _ in range(options['writers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.perf_counter() - start
+        return results
+
+    def worker(self, operation, deadline, samples, errors):
+        rnd = random.Random(threading.get_ident())
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    operation(rnd)
+                except OperationalError as error: # database is locked
+                    errors.append(str(error))
+                else:
+                    samples.append(time.perf_counter() - start)
+                close_old_connections() # Граница "запроса": при CONN_MAX_AGE=0 соединение закрывается, как после запроса
+        finally:
+            connection.close()
+
+    def read(self, rnd):
+        price = rnd.uniform(50, 4950)
+        list(CartItem.objects.filter(product_price__gte=price, product_price__lt=price + 50).order_by('product_price', 'id')[:20])
+
+    def write(self, rnd):
+        with transaction.atomic():
+            item = CartItem.objects.only('id', 'product_quantity').get(pk=rnd.choice(self.ids))
+            CartItem.objects.filter(pk=item.pk).update(product_quantity=F('product_quantity') + 1)
+
+    def report(self, name, results):
+        elapsed = results['elapsed']
+        reads, writes = summarize(results['read']), summarize(results['write'])
+        self.stdout.write(
+            f'{name:<22} чтений {len(results["read"]) / elapsed:>8.0f}/s (p50={reads["p50_ms"]:.2f}ms p99={reads["p99_ms"]:.2f}ms) | '
+            f'записей {len(results["write"]) / elapsed:>7.0f}/s (p50={writes["p50_ms"]:.2f}ms p99={writes["p99_ms"]:.2f}ms) | '
+            f'ошибок {len(results["errors"])}'
+        )
@@ -0,0 +1,110 @@
+import asyncio
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from api.benchmarks import summarize
+from api.consumers import ProductConsumer
+from api import protocol
+from api.events import PRODUCTS_GROUP
+
+
+class Command(BaseCommand):
+    help = (
+        'Рассылка изменений карточек на N WebSocket-подписчиков в одном процессе (WebsocketCommunicator): '
+        'память на соединение и задержка доставки group_send'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', nargs='+', type=int, default=[1000, 10000])
+        parser.add_argument('--rounds', type=int, default=5, help='Сколько рассылок сделать на каждый размер')
+        parser.add_argument('--batch', type=int, default=500, help='Сколько сокетов подключать одновременно')
+        parser.add_argument(
+            '--protocol', choices=['legacy', 'json', 'msgpack'], default='json',
+            help='Формат кадров: legacy - старый (карточка целиком), json/msgpack - подпротоколы products.v2.*',
+        )
+        parser.add_argument(
+            '--layer', choices=['memory', 'sqlite'], default='memory',
+            help='memory - InMemoryChannelLayer (чистит просроченное полным проходом на каждый receive, '
+                 'поэтому на 10k сокетов растёт квадратично), sqlite - tea_store.channel_layers.SQLiteChannelLayer',
+        )
+
+    def handle(self, *args, **options):
+        for sockets in options['sockets']:
+            with tempfile.TemporaryDirectory() as directory:
+                # Отдельный channel layer на каждый прогон и без heartbeat, чтобы ping не смешивались с рассылками
+                if options['layer'] == 'sqlite':
+                    layer = {
+                        'BACKEND': 'tea_store.channel_layers.SQLiteChannelLayer',
+                        'CONFIG': {'path': os.path.join(directory, 'channels.sqlite3')},
+                    }
+                else:
+                    layer = {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+                product_events = {'MAX_PENDING': 1000, 'HEARTBEAT': None, 'IDLE_TIMEOUT': None}
+                with override_settings(CHANNEL_LAYERS={'default': layer}, PRODUCT_EVENTS=product_events):
+                    result = asyncio.run(self.run_scenario(sockets, options['rounds'], options['batch'], options['protocol']))
+                self.stdout.write(
+                    f'{options["layer"]}/{options["protocol"]}: сокетов={sockets} | {result["frame_bytes"]} байт/кадр | память {result["bytes_per_socket"] / 1024:.1f} КБ/сокет, '
+                    f'подключение {result["connect_s"]:.2f}s | group_send {result["group_send"]["p50_ms"]:.1f}ms (p50) | '
+                    f'доставка всем p50={result["delivery"]["p50_ms"]:.1f}ms p99={result["delivery"]["p99_ms"]:.1f}ms '
+                    f'последнему={result["last_ms"]:.1f}ms'
+                )
+
+    async def run_scenario(self, sockets, rounds, batch, protocol_name):
+        subprotocols = {'legacy': [], 'json': [protocol.JSON], 'msgpack': [protocol.MSGPACK]}[protocol_name]
+        application = ProductConsumer.as_asgi()
+        channel_layer = get_channel_layer()
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        communicators = []
+        for offset in range(0, sockets, batch):
+            chunk = [WebsocketCommunicator(application, '/ws/products/', subprotocols=subprotocols) for _ in range(min(batch, sockets - offset))]
+            await asyncio.gather(*(communicator.connect(timeout=60) for communicator in chunk))
+            communicators.extend(chunk)
+        connect_time = time.perf_counter() - start
+        gc.collect()
+        # В цифру входят и объекты самого WebsocketCommunicator (очереди, задача приложения)
+        bytes_per_socket = (tracemalloc.get_traced_memory()[0] - before) / sockets
+        tracemalloc.stop()
+
+        delivery, group_send, last, frame_sizes = [], [], [], []
+        for i in range(rounds):
+            sent = time.perf_counter()
+            # Типичное изменение: у карточки поменялась цена
+            data = {'id': i, 'author': 1, 'product_name': 'Жасминовый Улун №42', 'product_price': 100.0 + i, 'product_quantity': 10}
+            ops = [protocol.updated_op(data, {'product_price': data['product_price']})]
+            await channel_layer.group_send(PRODUCTS_GROUP, {'type': 'product_events', 'v': protocol.PROTOCOL_VERSION, 'ops': ops})
+            group_send.append(time.perf_counter() - sent)
+
+            async def receive(communicator):
+                frame = await communicator.receive_output(timeout=60)
+                frame_sizes.append(len(frame.get('bytes') or frame.get('text', '').encode('utf-8')))
+                return time.perf_counter() - sent
+
+            round_latencies = await asyncio.gather(*(receive(communicator) for communicator in communicators))
+            delivery.extend(round_latencies)
+            last.append(max(round_latencies))
+
+        for offset in range(0, sockets, batch):
+            await asyncio.gather(*(communicator.disconnect(timeout=60) for communicator in communicators[offset:offset + batch]))
+        if hasattr(channel_layer, 'close'):
+            await channel_layer.close()
+
+        return {
+            'bytes_per_socket': bytes_per_socket,
+            'connect_s': connect_time,
+            'group_send': summarize(group_send),
+            'delivery': summarize(delivery),
+            'last_ms': summarize(last)['p50_ms'],
+            'frame_bytes': round(sum(frame_sizes) / len(frame_sizes)) if frame_sizes else 0,
+        }
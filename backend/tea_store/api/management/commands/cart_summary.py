@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет итоги корзин (api.CartSummary) с пересчётом по карточкам с нуля и пересобирает таблицу. '
+        'С --check только сообщает о расхождениях (код возврата 1, если они есть)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Только проверить, ничего не меняя')
+        parser.add_argument('--limit', type=int, default=20, help='Сколько расхождений показать')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(): # Проверка и пересборка видят один и тот же снимок карточек
+            drift = summary.drift()
+            for author_id, (stored, actual) in sorted(drift.items())[:options['limit']]:
+                self.stdout.write(f'Автор {author_id}: в таблице {stored}, по карточкам {actual}')
+            if options['check']:
+                if drift:
+                    raise CommandError(f'Расхождений: {len(drift)}')
+                self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+                return
+            rows = summary.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Расхождений: {len(drift)}. Таблица пересобрана, авторов: {rows}'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.benchmarks import generate_catalog, generate_users
+from api import summary
+from api.signals import invalidate_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        'Быстро заполняет текущую базу синтетическими пользователями и карточками (bulk_create, без сигналов). '
+        'Для разработки и нагрузочных прогонов: журнал изменений и WebSocket-подписчики об этих карточках не узнают'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=42, help='Одинаковый seed - одинаковый каталог')
+        parser.add_argument('--batch', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            author_ids = generate_users(options['users'])
+            self.stdout.write(f'Пользователей: {options["users"]}')
+            generate_catalog(
+                options['items'], author_ids, seed=options['seed'], batch_size=options['batch'],
+                progress=lambda created: self.stdout.write(f'Карточек: {created}/{options["items"]}'),
+            )
+            summary.rebuild() # Сигналов не было, итоги корзин пересчитываем целиком
+            invalidate_catalog() # Закэшированные ответы каталога больше не актуальны
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f}s ({options["items"] / elapsed if elapsed else 0:.0f} карточек/с)'
+        ))
@@ -0,0 +1,64 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import FORMATS, CatalogImporter, CatalogImportError
+
+
+class Command(BaseCommand):
+    help = (
+        'Импорт карточек из CSV/JSONL любого размера: проверка правилами CartItemSerializer, upsert по id пачками '
+        'в отдельных транзакциях, без сигналов по строкам и с одним событием resync для ws/products/ в конце. '
+        'Прерванный импорт продолжается с контрольной точки (api.CatalogImport, пишется в транзакции пачки). '
+        'Колонки: id (необязательно - без него карточка создаётся), author (id пользователя или --author), '
+        'product_name, product_price, product_quantity. '
+        'Событие дойдёт до сокетов сервера только через общий channel layer (TEA_STORE_CHANNEL_LAYER=sqlite)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())), help='По умолчанию - по расширению файла')
+        parser.add_argument('--author', help='Автор (username или id) для записей без колонки author')
+        parser.add_argument('--batch', type=int, default=5000, help='Записей в одной транзакции')
+        parser.add_argument('--max-errors', type=int, default=1000, help='Остановиться, если отклонено больше записей')
+        parser.add_argument('--checkpoint', help='Имя контрольной точки (по умолчанию - абсолютный путь файла)')
+        parser.add_argument('--restart', action='store_true', help='Начать сначала, не продолжая с контрольной точки')
+
+    def handle(self, *args, **options):
+        self.start = time.perf_counter()
+        importer = CatalogImporter(
+            batch_size=options['batch'], default_author=self.resolve_author(options['author']),
+            max_errors=options['max_errors'], progress=self.progress, report_error=self.report_error,
+        )
+        try:
+            stats = importer.run(options['path'], options['format'], options['checkpoint'], options['restart'])
+        except (OSError, CatalogImportError) as error:
+            raise CommandError(str(error))
+        elapsed = time.perf_counter() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f}s: записей {stats["records"]}, создано {stats["created"]}, '
+            f'обновлено {stats["updated"]}, отклонено {stats["invalid"]}'
+        ))
+
+    def resolve_author(self, author):
+        if author is None:
+            return None
+        User = get_user_model()
+        user = User.objects.filter(username=author).first()
+        if user is None and author.isdigit():
+            user = User.objects.filter(pk=author).first()
+        if user is None:
+            raise CommandError(f'Пользователь {author} не найден')
+        return user.pk
+
+    def progress(self, stats, position, size):
+        elapsed = time.perf_counter() - self.start
+        percent = f'{min(position / size, 1) * 100:5.1f}% ' if size else ''
+        self.stdout.write(
+            f'{percent}записей {stats["records"]} (создано {stats["created"]}, обновлено {stats["updated"]}, '
+            f'отклонено {stats["invalid"]}), {stats["records"] / elapsed if elapsed else 0:.0f} записей/с'
+        )
+
+    def report_error(self, number, errors):
+        self.stderr.write(f'Запись {number}: {errors}')
@@ -0,0 +1,45 @@
+import io
+import pstats
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tea_store import profiling
+
+
+class Command(BaseCommand):
+    help = 'Список сохранённых профилей запросов (X-Profile) или самые дорогие функции одного профиля'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help='id из заголовка X-Profile-Id; без него - список профилей')
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'])
+        parser.add_argument('--limit', type=int, default=25, help='Сколько функций показать')
+        parser.add_argument('--dir', help='Каталог профилей (по умолчанию PROFILING["DIR"])')
+
+    def handle(self, *args, **options):
+        if options['profile_id']:
+            self.summarize(options)
+        else:
+            self.list(options)
+
+    def list(self, options):
+        profiles = profiling.list_profiles(options['dir'])
+        if not profiles:
+            self.stdout.write('Профилей нет')
+            return
+        for meta in profiles:
+            created = datetime.fromtimestamp(meta['created']).strftime('%Y-%m-%d %H:%M:%S')
+            self.stdout.write(
+                f"{meta['id']}  {created}  {meta['status']}  {meta['duration_ms']:>9.1f} мс  {meta['method']} {meta['path']}"
+            )
+
+    def summarize(self, options):
+        meta = next((meta for meta in profiling.list_profiles(options['dir']) if meta['id'] == options['profile_id']), None)
+        if meta is None:
+            raise CommandError(f'Профиль {options["profile_id"]} не найден (возможно, удалён при ротации)')
+        self.stdout.write(f"{meta['method']} {meta['path']} -> {meta['status']}, {meta['duration_ms']} мс")
+
+        output = io.StringIO()
+        stats = pstats.Stats(meta['file'], stream=output)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tea_store.replication import replicate_all
+from tea_store.routers import get_config
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики из READ_REPLICAS (tea_store/replication.py). '
+        'С --interval повторяет копирование, пока не остановят'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', action='append', help='Реплика (можно несколько), по умолчанию все')
+        parser.add_argument('--interval', type=float, default=0, help='Период в секундах, 0 - один раз')
+
+    def handle(self, *args, **options):
+        aliases = options['alias'] or get_config()['ALIASES']
+        if not aliases:
+            raise CommandError('Реплик нет: READ_REPLICAS["ALIASES"] пуст (TEA_STORE_READ_REPLICA=1 включает локальную)')
+        while True:
+            for alias, (size, seconds) in replicate_all(aliases).items():
+                self.stdout.write(f'{alias}: {size / 1024:.0f} КиБ за {seconds * 1000:.0f} мс')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from api.search import install_search_index
+    install_search_index(schema_editor.connection, rebuild=True)
+
+
+def remove_search_index(apps, schema_editor):
+    from api.search import drop_search_index
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_cartitem_author'),
+    ]
+
+    operations = [
+        # FTS5-индекс для поиска по названию (только SQLite, на других СУБД миграция ничего не делает)
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
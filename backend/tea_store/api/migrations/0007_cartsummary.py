@@ -0,0 +1,41 @@
+# Generated by Django 5.2.3 on 2026-10-18 09:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def fill_summary(apps, schema_editor):
+    # Итоги для уже существующих карточек; дальше таблица меняется на дельты (api/summary.py)
+    CartItem = apps.get_model('api', 'CartItem')
+    CartSummary = apps.get_model('api', 'CartSummary')
+    using = schema_editor.connection.alias
+    rows = CartItem.objects.using(using).order_by().values('author').annotate(
+        item_count=Count('id'), total_quantity=Sum('product_quantity'), total_value=Sum(F('product_price') * F('product_quantity')),
+    )
+    CartSummary.objects.using(using).bulk_create([
+        CartSummary(author_id=row['author'], item_count=row['item_count'], total_quantity=row['total_quantity'], total_value=row['total_value'])
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_productchange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartSummary',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cart_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('item_count', models.IntegerField(default=0)),
+                ('total_quantity', models.BigIntegerField(default=0)),
+                ('total_value', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_summary, migrations.RunPython.noop),
+    ]
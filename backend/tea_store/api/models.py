@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 
 # Модель для карточки товара в магазине
@@ -8,4 +8,107 @@ class CartItem(models.Model):
     # related_name='cart_items' - имя, по которому можно будет получить все CartItems'ы пользователя (например, user.cart_items.all())
     product_name = models.CharField(max_length=200)
     product_price = models.FloatField()
-    product_quantity = models.PositiveIntegerField()
\ No newline at end of file
+    product_quantity = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True) # Время последнего изменения - по нему считаются ETag и Last-Modified
+
+    def save(self, *args, **kwargs):
+        # Одна транзакция на сохранение и всё, что делают сигналы post_save (журнал изменений api.ProductChange),
+        # чтобы журнал не разошёлся с таблицей при ошибке между ними
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Запоминаем значения, прочитанные из базы, чтобы при сохранении знать, какие поля реально изменились
+        # (для дельт в ws/products/). Для отложенных полей (.only()/.defer()) значений нет - они считаются неизменными
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_changed_fields(self):
+        "Имена полей, изменённых с момента загрузки из базы, или None, если объект не загружался из базы"
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return {
+            field.name for field in self._meta.concrete_fields
+            if field.attname in loaded and getattr(self, field.attname) != loaded[field.attname]
+        }
+
+    def get_loaded_values(self, names):
+        "Значения полей (по имени) в том виде, в каком они были загружены из базы"
+        loaded = getattr(self, '_loaded_values', None) or {}
+        fields = [self._meta.get_field(name) for name in names]
+        return {field.name: loaded[field.attname] for field in fields if field.attname in loaded}
+
+    def reset_changed_fields(self):
+        "После сохранения текущие значения становятся исходными для следующего сравнения"
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields if field.attname not in deferred
+        }
+
+    class Meta:
+        # Индексы под реальные комбинации фильтров и сортировок из CartItemViewSet:
+        # фильтр по диапазону цены + сортировка по цене, сортировка по названию и по количеству.
+        # id в конце - tie-breaker keyset-пагинации, чтобы ORDER BY (поле, id) шёл по индексу без временной сортировки.
+        indexes = [
+            models.Index(fields=['product_price', 'id'], name='cartitem_price_id_idx'),
+            models.Index(fields=['product_name', 'id'], name='cartitem_name_id_idx'),
+            models.Index(fields=['product_quantity', 'id'], name='cartitem_quantity_id_idx'),
+        ]
+
+
+# Журнал изменений карточек: по нему переподключившийся WebSocket-клиент догоняет пропущенное (?since=<seq>)
+class ProductChange(models.Model):
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    OPS = [(CREATED, 'created'), (UPDATED, 'updated'), (DELETED, 'deleted')]
+
+    seq = models.BigAutoField(primary_key=True) # Монотонно растущий номер изменения (на SQLite - AUTOINCREMENT, номера не переиспользуются)
+    product_id = models.BigIntegerField() # Не ForeignKey: запись об удалении должна пережить саму карточку
+    op = models.CharField(max_length=10, choices=OPS)
+    payload = models.JSONField(default=dict) # created - карточка целиком, updated - изменённые поля, deleted - пусто
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['seq']
+
+    def __str__(self):
+        return f'#{self.seq} {self.op} {self.product_id}'
+
+
+# Итоги корзины автора: сколько карточек, сколько товаров и на какую сумму (цена * количество).
+# Не пересчитываются на каждый запрос, а меняются на дельту в той же транзакции, что и сама карточка (см. summary.py)
+class CartSummary(models.Model):
+    author = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='cart_summary')
+    item_count = models.IntegerField(default=0)
+    total_quantity = models.BigIntegerField(default=0)
+    total_value = models.FloatField(default=0) # FloatField, как и product_price: сумма дельт может отличаться от пересчёта в последних знаках
+
+    def __str__(self):
+        return f'{self.author_id}: {self.item_count} / {self.total_quantity} / {self.total_value}'
+
+
+# Версия каталога для кэша ответов и ETag списка (см. cache.py): одна строка, общая для всех воркеров.
+# Меняется в той же транзакции, что и карточки, поэтому версия и данные фиксируются вместе
+class CatalogVersion(models.Model):
+    version = models.BigIntegerField(default=0)
+    modified_at = models.DateTimeField(null=True, blank=True) # Время последнего изменения каталога (Last-Modified списка)
+
+    def __str__(self):
+        return f'{self.version} ({self.modified_at})'
+
+
+# Контрольная точка manage.py import_catalog (см. importer.py): сколько записей файла уже обработано.
+# Пишется в той же транзакции, что и пачка карточек, поэтому после сбоя пачка не повторяется и не задваивается
+class CatalogImport(models.Model):
+    source = models.CharField(max_length=1024, unique=True) # Абсолютный путь файла или имя из --checkpoint
+    signature = models.JSONField() # Размер и mtime файла: продолжаем только тот же файл
+    stats = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.source}: {self.stats}'
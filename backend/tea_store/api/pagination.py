@@ -0,0 +1,268 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CartItemPageNumberPagination(PageNumberPagination):
+    "Обычная постраничная пагинация (?page=N), как и раньше, плюс возможность указать ?page_size="
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Пагинация по ключу (keyset / cursor).
+    Вместо OFFSET запоминаем в курсоре значения полей сортировки последней строки страницы,
+    а следующую страницу берём условием WHERE (поле, id) > (значение, id). Поэтому страница N
+    стоит столько же, сколько первая. COUNT(*) выполняется только по запросу (?count=true).
+    '''
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    include_count_default = False
+    tie_breaker = 'id' # Уникальное поле, которое добавляем в конец сортировки, чтобы порядок был однозначным
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.include_count = self.get_include_count(request)
+        self.count = queryset.count() if self.include_count else None
+
+        position, self.reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = [self._flip(field) for field in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, position))
+
+        # Берём на одну строку больше, чтобы узнать, есть ли ещё страница, без COUNT(*)
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        if self.reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.first_position = self.get_position(results[0]) if results else position
+        self.last_position = self.get_position(results[-1]) if results else position
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count_default
+        return value.lower() in ('1', 'true', 'yes', 'on')
+
+    def get_ordering(self, queryset):
+        '''
+        Сортировку уже применил OrderingFilter, поэтому читаем её прямо из queryset.
+        Добавляем id как tie-breaker в том же направлении, что и последнее поле, чтобы индекс (поле, id)
+        можно было пройти в одну сторону без сортировки во временном B-дереве.
+        '''
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        ordering = ['id' if field == 'pk' else '-id' if field == '-pk' else field for field in ordering]
+        if not ordering:
+            return [self.tie_breaker]
+        if self.tie_breaker not in [field.lstrip('-') for field in ordering]:
+            direction = '-' if ordering[-1].startswith('-') else ''
+            ordering.append(direction + self.tie_breaker)
+        return ordering
+
+    def get_keyset_filter(self, ordering, position):
+        '''
+        Строим условие "строка идёт после position" для произвольного набора полей и направлений:
+        (a > x) OR (a = x AND b > y) OR ...
+        Дополнительно ограничиваем первое поле (a >= x), чтобы база могла начать с поиска по индексу, а не со сканирования.
+        '''
+        clauses = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clauses |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+
+        first = ordering[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': position[0]}) & clauses
+
+    def get_position(self, instance):
+        if isinstance(instance, dict): # Строка .values() (быстрое чтение, api/fast_read.py)
+            return [instance[field.lstrip('-')] for field in self.ordering]
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            ordering = payload['o']
+            position = payload['p']
+            reverse = bool(payload.get('r', False))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Курсор, выданный для другой сортировки, применять нельзя
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Значения приводим к типам полей сортировки: подделанный курсор иначе упадёт с 500 при построении WHERE
+        try:
+            position = [self.coerce_value(model, field, value) for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def coerce_value(self, model, field, value):
+        if value is None:
+            raise ValueError('Пустое значение в курсоре')
+        model_field = model._meta.get_field(field.lstrip('-'))
+        value = model_field.to_python(value)
+        model_field.get_prep_value(value)
+        return value
+
+    def encode_cursor(self, position, reverse):
+        payload = {'o': self.ordering, 'p': position}
+        if reverse:
+            payload['r'] = True
+        encoded = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.include_count:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'example': 123, 'description': 'Только при ?count=true'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Курсор страницы (берётся из next/previous)',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Посчитать общее количество записей (COUNT(*)) для keyset-пагинации',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+
+class CartItemPagination(BasePagination):
+    '''
+    Пагинация для карточек товаров.
+    По умолчанию - обычная постраничная (?page=N), чтобы не ломать фронтенд.
+    Если клиент передал ?pagination=cursor или ?cursor=..., включается keyset-пагинация без OFFSET и COUNT(*).
+    '''
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+
+    def __init__(self):
+        self.page_number = CartItemPageNumberPagination()
+        self.keyset = KeysetPagination()
+        self.active = self.page_number
+
+    def use_keyset(self, request):
+        if self.keyset.cursor_query_param in request.query_params:
+            return True
+        return request.query_params.get(self.mode_query_param) == self.cursor_mode
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.active = self.keyset if self.use_keyset(request) else self.page_number
+        return self.active.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.active.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number.get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        mode = {
+            'name': self.mode_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Режим пагинации: page (по умолчанию) или cursor',
+            'schema': {'type': 'string', 'enum': ['page', self.cursor_mode]},
+        }
+        return [
+            *self.page_number.get_schema_operation_parameters(view),
+            mode,
+            *self.keyset.get_schema_operation_parameters(view),
+        ]
+
+    def get_results(self, data):
+        return data['results']
+
+    @property
+    def display_page_controls(self):
+        return self.active is self.page_number and self.page_number.display_page_controls
+
+    def to_html(self):
+        return self.active.to_html()
@@ -0,0 +1,141 @@
+'''
+Протокол событий ws/products/.
+
+Внутри (диспетчер -> channel layer -> консьюмер) изменения ходят списком операций:
+    {'op': 'created', 'id': 1, 'data': {...}}
+    {'op': 'updated', 'id': 1, 'data': {...}, 'changes': {'product_price': 120.0}, 'previous': {'product_price': 100.0}}
+    {'op': 'deleted', 'id': 1, 'data': {'id': 1, 'author': 5, 'product_price': 100.0}}
+previous и data удалённой карточки нужны только для маршрутизации по подпискам (topics.py), клиенту они не уходят.
+Операции, записанные в журнал (changelog.py), несут ещё 'seq' - номер изменения, он уходит клиенту.
+
+Клиенту они уходят в формате, о котором он договорился через подпротокол WebSocket (Sec-WebSocket-Protocol):
+    products.v2.json    - {"v": 2, "ops": [...]} текстом, для updated только изменённые поля (changes)
+    products.v2.msgpack - то же самое бинарным кадром MessagePack (если установлен пакет msgpack)
+    без подпротокола    - старый формат v1: карточка целиком (или список карточек) и {"deleted": [...]}
+'''
+import json
+
+try:
+    import msgpack
+except ImportError: # MessagePack - необязательная зависимость, без неё доступен только JSON
+    msgpack = None
+
+PROTOCOL_VERSION = 2
+
+JSON = 'products.v2.json'
+MSGPACK = 'products.v2.msgpack'
+LEGACY = None
+
+
+def supported_subprotocols():
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def choose_subprotocol(offered):
+    "Первый из предложенных клиентом подпротоколов, который мы умеем; None - старый формат"
+    supported = supported_subprotocols()
+    for subprotocol in offered:
+        if subprotocol in supported:
+            return subprotocol
+    return LEGACY
+
+
+# --- Операции ---
+
+def created_op(data):
+    return {'op': 'created', 'id': data['id'], 'data': data}
+
+
+def updated_op(data, changes=None, previous=None):
+    "previous - прежние значения изменённых полей"
+    op = {'op': 'updated', 'id': data['id'], 'data': data, 'changes': data if changes is None else changes}
+    if previous:
+        op['previous'] = previous
+    return op
+
+
+def deleted_op(pk, data=None):
+    "data - последнее известное состояние карточки (хотя бы author и product_price)"
+    op = {'op': 'deleted', 'id': pk}
+    if data is not None:
+        op['data'] = data
+    return op
+
+
+def merge_ops(previous, op):
+    '''
+    Схлопывает две операции над одной карточкой в одну:
+    created + updated = created с новыми данными, updated + updated = updated с объединёнными changes,
+    что угодно + deleted = deleted.
+    '''
+    if previous is None or op['op'] != 'updated':
+        return op
+    if previous['op'] == 'created':
+        merged = created_op(op['data'])
+    elif previous['op'] == 'updated':
+        # Прежние значения берём самые ранние: для подписчика карточка переходит из первого состояния в последнее
+        changes = {**previous['changes'], **op['changes']}
+        merged = updated_op(op['data'], changes, {**op.get('previous', {}), **previous.get('previous', {})})
+    else:
+        return op
+    if 'seq' in op:
+        merged['seq'] = op['seq']
+    return merged
+
+
+# --- Кадры для клиента ---
+
+def legacy_payloads(ops):
+    "Старый формат v1: сохранённые карточки целиком (одна - объектом, несколько - списком) и отдельно удалённые id"
+    saved = [op['data'] for op in ops if op['op'] != 'deleted']
+    deleted = [op['id'] for op in ops if op['op'] == 'deleted']
+    payloads = []
+    if saved:
+        payloads.append(saved[0] if len(saved) == 1 else saved)
+    if deleted:
+        payloads.append({'deleted': deleted})
+    return payloads
+
+
+def compact_op(op):
+    "Операция в том виде, в каком она уходит клиенту v2: для updated - только изменённые поля"
+    if op['op'] == 'created':
+        compact = {'op': 'created', 'id': op['id'], 'data': op['data']}
+    elif op['op'] == 'updated':
+        compact = {'op': 'updated', 'id': op['id'], 'changes': op['changes']}
+    else:
+        compact = {'op': 'deleted', 'id': op['id']}
+    if 'seq' in op:
+        compact['seq'] = op['seq']
+    return compact
+
+
+def encode(payload, subprotocol):
+    "Кодирует полезную нагрузку в кадр: {'text_data': ...} или {'bytes_data': ...} для AsyncWebsocketConsumer.send"
+    if subprotocol == MSGPACK:
+        return {'bytes_data': msgpack.packb(payload, use_bin_type=True)}
+    return {'text_data': json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}
+
+
+def encode_ops(ops, subprotocol):
+    "Список кадров для отправки клиенту с данным подпротоколом"
+    if subprotocol is LEGACY:
+        return [{'text_data': json.dumps(payload)} for payload in legacy_payloads(ops)]
+    return [encode({'v': PROTOCOL_VERSION, 'ops': [compact_op(op) for op in ops]}, subprotocol)]
+
+
+def encode_control(payload, subprotocol):
+    "Служебные сообщения (ping, resync) - в том же формате, что и события"
+    if subprotocol is LEGACY:
+        return {'text_data': json.dumps(payload)}
+    return encode(payload, subprotocol)
+
+
+def decode(text_data=None, bytes_data=None):
+    "Сообщение от клиента: JSON текстом или MessagePack бинарным кадром. None - если разобрать не удалось"
+    try:
+        if bytes_data is not None:
+            return msgpack.unpackb(bytes_data, raw=False) if msgpack is not None else None
+        return json.loads(text_data)
+    except (ValueError, TypeError):
+        return None
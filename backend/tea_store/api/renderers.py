@@ -0,0 +1,35 @@
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+
+from tea_store.timing import TimedJSONRenderer, span
+
+
+class FastJSONRenderer(TimedJSONRenderer):
+    '''
+    JSONRenderer с заранее созданным кодировщиком для обычного (компактного) ответа.
+    DRF создаёт рендерер на каждый запрос, а json.dumps(cls=...) каждый раз разбирает аргументы и создаёт JSONEncoder;
+    здесь кодировщик один на класс, а вывод байт в байт тот же, что у JSONRenderer (те же параметры и тот же
+    DRF JSONEncoder для дат, Decimal и т.п.). С отступом (?indent, browsable API) работает обычный путь.
+    '''
+    _encoder = None
+
+    @classmethod
+    def get_encoder(cls):
+        if cls._encoder is None:
+            cls._encoder = cls.encoder_class(
+                ensure_ascii=cls.ensure_ascii, allow_nan=not cls.strict,
+                separators=SHORT_SEPARATORS if cls.compact else LONG_SEPARATORS,
+            )
+        return cls._encoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        with span('render'):
+            ret = self.get_encoder().encode(data)
+            # Как в JSONRenderer: \u2028 и \u2029 всегда экранируются, чтобы JSON был подмножеством JavaScript
+            if '\u2028' in ret or '\u2029' in ret:
+                ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+            return ret.encode()
+
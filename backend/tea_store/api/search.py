@@ -0,0 +1,117 @@
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import CartItem
+
+FTS_TABLE = 'api_cartitem_fts'
+
+# Внешний контент-индекс FTS5: текст хранится в самой таблице api_cartitem, в FTS лежит только индекс.
+# Триггеры поддерживают индекс при любых записях (ORM, bulk_create, сырой SQL, админка).
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        product_name,
+        content='api_cartitem',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON api_cartitem BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, product_name) VALUES (new.id, new.product_name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON api_cartitem BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, product_name) VALUES ('delete', old.id, old.product_name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF product_name ON api_cartitem BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, product_name) VALUES ('delete', old.id, old.product_name);
+        INSERT INTO {FTS_TABLE}(rowid, product_name) VALUES (new.id, new.product_name);
+    END
+    """,
+]
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_supported(connection):
+    return connection.vendor == 'sqlite'
+
+
+def install_search_index(connection, rebuild=False):
+    '''
+    Создаёт FTS5-таблицу и триггеры (если их ещё нет).
+    На SQLite Django пересоздаёт таблицу при некоторых миграциях (например, при добавлении поля),
+    и триггеры при этом пропадают, поэтому функция вызывается ещё и после каждого migrate.
+    '''
+    if not fts_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for statement in FTS_SCHEMA:
+            cursor.execute(statement)
+        if rebuild:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(connection):
+    if not fts_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def build_match_expression(terms):
+    '''
+    Превращает поисковую строку в выражение FTS5: каждое слово в кавычках (чтобы спецсимволы не ломали синтаксис)
+    и со звёздочкой для поиска по префиксу. Слова объединяются через AND.
+    '''
+    tokens = []
+    for term in terms:
+        tokens.extend(TOKEN_RE.findall(term))
+    return ' '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    '''
+    Поиск по названию товара через индекс FTS5 вместо LIKE '%term%'.
+    Поддерживает поиск по префиксу ("улу" найдёт "Улун") и сортирует результаты по релевантности (bm25),
+    если клиент не передал свою сортировку. На других СУБД откатывается к обычному SearchFilter.
+    '''
+    rank_annotation = 'search_rank'
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        connection = connections[queryset.db]
+        if queryset.model is not CartItem or not fts_supported(connection):
+            return super().filter_queryset(request, queryset, view)
+
+        match = build_match_expression(search_terms)
+        if not match:
+            return queryset.none()
+
+        # Соединяем с FTS-таблицей по rowid: фильтрация и ранг bm25 считаются за один проход по индексу,
+        # без коррелированного подзапроса на каждую строку
+        table = connection.ops.quote_name(CartItem._meta.db_table)
+        return (
+            queryset
+            .extra(
+                tables=[FTS_TABLE],
+                where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+                params=[match],
+            )
+            # Аннотация (а не extra select), чтобы по рангу можно было фильтровать в keyset-пагинации
+            .annotate(**{self.rank_annotation: RawSQL(f'{FTS_TABLE}.rank', [])})
+            .order_by(self.rank_annotation, 'id') # OrderingFilter перезапишет, если передан ?ordering=
+        )
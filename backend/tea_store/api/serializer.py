@@ -1,12 +1,26 @@
 from rest_framework import serializers
-from .models import CartItem
+from tea_store.timing import TimedListSerializer, TimedSerializerMixin
+from .models import CartItem, CartSummary
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer): # Время сериализации попадает в Server-Timing
     product_name = serializers.CharField(max_length=200)
     product_price = serializers.FloatField()
-    product_quantity = serializers.IntegerField(required=False, default=1) # Если пользователь не указал количество товаров, то по уполчанию считаем, что он покупает 1 товар 
+    product_quantity = serializers.IntegerField(required=False, default=1, min_value=0) # Если пользователь не указал количество товаров, то по уполчанию считаем, что он покупает 1 товар (в модели PositiveIntegerField, поэтому не меньше 0)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        # fields - имена полей, которые нужно оставить в ответе (?fields=/?exclude=, см. api/sparse.py)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
     class Meta: # Этот класс нужен для связи сериализатора с моделью Django, просто добавляем его для работы
         model = CartItem
-        fields = ('__all__') # Это автоматически включит author, поэтому это поле не нужно объявлять руками
-        read_only_fields = ('author',) # Это поле нельзя менять, оно должно быть только для чтения 
\ No newline at end of file
+        exclude = ('updated_at',) # Все поля модели (включая author, поэтому его не нужно объявлять руками), кроме служебного updated_at
+        read_only_fields = ('author',) # Это поле нельзя менять, оно должно быть только для чтения
+        list_serializer_class = TimedListSerializer # Список замеряется одним интервалом, а не по карточке 
+
+class CartSummarySerializer(serializers.ModelSerializer): # Итоги корзины автора (/api/cartitems/summary/)
+    class Meta:
+        model = CartSummary
+        fields = ('author', 'item_count', 'total_quantity', 'total_value')
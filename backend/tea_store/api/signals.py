@@ -1,22 +1,97 @@
-from django.db.models.signals import post_save
+import contextvars
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from .models import CartItem
 from .serializer import CartItemSerializer
+from .cache import bump_catalog_version
+from .events import get_dispatcher
+from .protocol import created_op, deleted_op, updated_op
+from .changelog import record_changes
+from . import summary
+
+_batch = contextvars.ContextVar('cartitem_batch', default=False)
+
+
+@contextmanager
+def batch_changes():
+    '''
+    Внутри блока сигналы CartItem ничего не делают: итоги корзин, журнал, версию каталога и рассылку
+    вызывающий делает сам, один раз на пачку (views.bulk_destroy). Каскады и чужие обработчики сигналов работают как обычно.
+    '''
+    token = _batch.set(True)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+
+
+def invalidate_catalog():
+    # Версия меняется в той же транзакции, что и карточки: запрос, прочитавший версию до коммита,
+    # читает после неё данные не старше этой версии
+    bump_catalog_version()
+
+
+def build_update_op(instance, data):
+    '''
+    Операция updated только с реально изменившимися полями (сравниваем с тем, что было загружено из базы).
+    None - если видимые клиенту поля не изменились и рассылать нечего.
+    '''
+    changed = instance.get_changed_fields()
+    if changed is None: # Объект не загружался из базы - не знаем, что изменилось, отправляем всё
+        return updated_op(data)
+    changes = {name: data[name] for name in changed if name in data}
+    if not changes:
+        return None
+    return updated_op(data, changes, previous=instance.get_loaded_values(changes))
+
+
+def build_delete_op(instance):
+    # Автор и цена нужны, чтобы отправить удаление подписчикам этих тем (см. topics.py)
+    return deleted_op(instance.pk, {'id': instance.pk, 'author': instance.author_id, 'product_price': instance.product_price})
+
+
+def update_summary(instances, created):
+    "Меняет итоги корзин (api.CartSummary) на дельту созданных или изменённых карточек, в текущей транзакции"
+    deltas = summary.new_deltas()
+    if created:
+        summary.apply(summary.add_items(deltas, instances))
+    else:
+        summary.apply(deltas, summary.add_changes(deltas, instances))
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-import json
 
 @receiver(post_save, sender=CartItem)
 def product_saved(sender, instance, created, **kwargs):
-    serializer = CartItemSerializer(instance) 
-    data = serializer.data
-
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'products_updates',
-        {
-            'type': 'product_update',
-            'message': data
-        }
-    )
\ No newline at end of file
+    if _batch.get():
+        return
+    # Сериализуем сейчас (состояние на момент сохранения), а рассылку отдаём диспетчеру только после коммита:
+    # при откате транзакции подписчики ничего не получат, а запрос не ждёт channel layer
+    data = CartItemSerializer(instance).data
+    op = created_op(data) if created else build_update_op(instance, data)
+    update_summary([instance], created) # До reset_changed_fields: нужны прежние цена и количество
+    instance.reset_changed_fields()
+    if op is not None:
+        record_changes([op]) # CartItem.save() выполняется в транзакции, так что запись в журнал атомарна с самой карточкой
+        transaction.on_commit(lambda: get_dispatcher().publish([op]))
+
+
+@receiver(post_delete, sender=CartItem)
+def product_deleted(sender, instance, **kwargs):
+    # Срабатывает и для queryset.delete(), и для каскадного удаления вместе с автором.
+    # DELETE /cartitems/bulk/ делает то же самое один раз на пачку (batch_changes, views.bulk_destroy)
+    if _batch.get():
+        return
+    op = build_delete_op(instance)
+    summary.apply(summary.add_items(summary.new_deltas(), [instance], sign=-1))
+    record_changes([op]) # Collector.delete() шлёт post_delete внутри своей транзакции
+    transaction.on_commit(lambda: get_dispatcher().publish([op]))
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def catalog_changed(sender, instance, **kwargs):
+    if _batch.get():
+        return
+    invalidate_catalog()
@@ -0,0 +1,91 @@
+'''
+Выборочные поля ответа: ?fields=id,product_name,product_price или ?exclude=author,product_quantity.
+
+Работает для GET list/retrieve. Лишние поля убираются и из ответа (сериализатор получает fields=...),
+и из SQL: обычный путь загружает только нужные колонки через .only(), быстрый путь (fast_read.py) -
+через .values() по урезанной карте полей. Колонки сортировки и первичный ключ читаются всегда:
+без них не построить курсор keyset-пагинации.
+'''
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+SCHEMA_PARAMETERS = [
+    OpenApiParameter(
+        FIELDS_PARAM, OpenApiTypes.STR, OpenApiParameter.QUERY,
+        description='Вернуть только эти поля (через запятую), например id,product_name,product_price',
+    ),
+    OpenApiParameter(
+        EXCLUDE_PARAM, OpenApiTypes.STR, OpenApiParameter.QUERY,
+        description='Не возвращать эти поля (через запятую)',
+    ),
+]
+
+
+def parse_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    "Миксин для ViewSet: разбор ?fields=/?exclude= и урезание queryset и сериализатора"
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        "Имена полей ответа по ?fields=/?exclude= или None, если выбор не задан (или действие не чтение)"
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = self.parse_sparse_fields()
+        return self._sparse_fields
+
+    def parse_sparse_fields(self):
+        params = self.request.query_params
+        if self.action not in self.sparse_actions or (FIELDS_PARAM not in params and EXCLUDE_PARAM not in params):
+            return None
+        available = list(self.get_readable_fields())
+        selected = parse_names(params[FIELDS_PARAM]) if FIELDS_PARAM in params else list(available)
+        excluded = parse_names(params.get(EXCLUDE_PARAM, ''))
+
+        unknown = [name for name in [*selected, *excluded] if name not in available]
+        if unknown:
+            raise ValidationError({
+                FIELDS_PARAM if FIELDS_PARAM in params else EXCLUDE_PARAM:
+                    [f'Неизвестные поля: {", ".join(unknown)}. Доступны: {", ".join(available)}.']
+            })
+        fields = [name for name in available if name in selected and name not in excluded] # Порядок - как в сериализаторе
+        if not fields:
+            raise ValidationError({FIELDS_PARAM: ['Не осталось ни одного поля.']})
+        return fields
+
+    def get_readable_fields(self):
+        "Поля сериализатора, которые попадают в ответ: {имя: поле}"
+        if not hasattr(self, '_readable_fields'):
+            fields = self.get_serializer_class()().fields
+            self._readable_fields = {name: field for name, field in fields.items() if not field.write_only}
+        return self._readable_fields
+
+    def get_sparse_columns(self, queryset, fields):
+        "Колонки модели для выбранных полей + первичный ключ и поля сортировки"
+        serializer_fields = self.get_readable_fields()
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        columns = [queryset.model._meta.pk.name]
+        for name in fields:
+            columns.append(serializer_fields[name].source)
+        for field in queryset.query.order_by:
+            if isinstance(field, str) and field.lstrip('-') in model_fields:
+                columns.append(field.lstrip('-'))
+        return list(dict.fromkeys(columns))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+        return queryset.only(*self.get_sparse_columns(queryset, fields))
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
@@ -0,0 +1,117 @@
+'''
+Итоги корзин по авторам (api.CartSummary): число карточек, общее количество товаров и общая стоимость.
+
+Таблица не пересчитывается, а меняется на дельту: каждое создание, изменение и удаление карточки
+(сигналы post_save/post_delete и bulk-операции) в той же транзакции делает UPDATE ... SET x = x + дельта
+по строке автора. Если строки автора ещё нет или прежние значения карточки неизвестны, итоги этого автора
+пересчитываются одним агрегатом. manage.py cart_summary сверяет таблицу с пересчётом с нуля и пересобирает её.
+'''
+import math
+from collections import defaultdict
+
+from django.db.models import Count, F, Sum
+
+from .models import CartItem, CartSummary
+
+FIELDS = ['item_count', 'total_quantity', 'total_value']
+VALUE_FIELDS = ['author', 'product_price', 'product_quantity'] # Поля карточки, от которых зависят итоги
+
+
+def new_deltas():
+    "Дельты итогов по авторам: {author_id: [item_count, total_quantity, total_value]}"
+    return defaultdict(lambda: [0, 0, 0.0])
+
+
+def add(deltas, author_id, price, quantity, sign=1):
+    delta = deltas[author_id]
+    delta[0] += sign
+    delta[1] += sign * quantity
+    delta[2] += sign * price * quantity
+
+
+def add_items(deltas, items, sign=1):
+    "Дельты для созданных (sign=1) или удалённых (sign=-1) карточек"
+    for item in items:
+        add(deltas, item.author_id, item.product_price, item.product_quantity, sign)
+    return deltas
+
+
+def add_changes(deltas, items):
+    '''
+    Дельты для изменённых карточек: прежние значения (как их загрузили из базы) вычитаются, новые прибавляются.
+    Возвращает id авторов, для которых прежние значения неизвестны - их итоги нужно пересчитать.
+    '''
+    unknown = set()
+    for item in items:
+        loaded = item.get_loaded_values(VALUE_FIELDS)
+        if len(loaded) != len(VALUE_FIELDS): # Объект не загружался из базы или загружен через .only()
+            unknown.add(item.author_id)
+            continue
+        if (loaded['author'], loaded['product_price'], loaded['product_quantity']) != (
+            item.author_id, item.product_price, item.product_quantity
+        ):
+            add(deltas, loaded['author'], loaded['product_price'], loaded['product_quantity'], -1)
+            add(deltas, item.author_id, item.product_price, item.product_quantity)
+    return unknown
+
+
+def apply(deltas, recompute_authors=()):
+    "Применяет дельты (в текущей транзакции). Одна UPDATE на автора, пересчёт - если строки автора ещё нет"
+    missing = set(recompute_authors)
+    for author_id, (count, quantity, value) in deltas.items():
+        if author_id in missing or not (count or quantity or value):
+            continue
+        updated = CartSummary.objects.filter(author_id=author_id).update(
+            item_count=F('item_count') + count, total_quantity=F('total_quantity') + quantity, total_value=F('total_value') + value,
+        )
+        if not updated:
+            missing.add(author_id)
+    if missing:
+        recompute(missing)
+
+
+def compute(author_ids=None):
+    "Итоги, посчитанные по CartItem с нуля: {author_id: (item_count, total_quantity, total_value)}"
+    items = CartItem.objects.all()
+    if author_ids is not None:
+        items = items.filter(author_id__in=author_ids)
+    rows = items.order_by().values('author').annotate(
+        item_count=Count('id'), total_quantity=Sum('product_quantity'), total_value=Sum(F('product_price') * F('product_quantity')),
+    )
+    return {row['author']: (row['item_count'], row['total_quantity'], row['total_value']) for row in rows}
+
+
+def recompute(author_ids):
+    "Пересчитывает итоги авторов одним агрегатом; строки авторов без карточек удаляются"
+    totals = compute(author_ids)
+    CartSummary.objects.bulk_create(
+        [CartSummary(author_id=author_id, **dict(zip(FIELDS, values))) for author_id, values in totals.items()],
+        update_conflicts=True, unique_fields=['author'], update_fields=FIELDS,
+    )
+    CartSummary.objects.filter(author_id__in=set(author_ids) - set(totals)).delete()
+
+
+def drift():
+    '''
+    Расхождения таблицы с пересчётом с нуля: {author_id: (в таблице, пересчитано)}.
+    Строка с нулевыми итогами равна отсутствующей, стоимость сравнивается с допуском на ошибку округления.
+    '''
+    stored = {row[0]: row[1:] for row in CartSummary.objects.values_list('author_id', *FIELDS)}
+    actual = compute()
+    empty = (0, 0, 0.0)
+    result = {}
+    for author_id in stored.keys() | actual.keys():
+        before, after = stored.get(author_id, empty), actual.get(author_id, empty)
+        if before[:2] != after[:2] or not math.isclose(before[2], after[2], rel_tol=1e-9, abs_tol=1e-6):
+            result[author_id] = (before, after)
+    return result
+
+
+def rebuild():
+    "Пересобирает таблицу с нуля (вызывать в транзакции). Возвращает число строк"
+    totals = compute()
+    CartSummary.objects.all().delete()
+    CartSummary.objects.bulk_create(
+        [CartSummary(author_id=author_id, **dict(zip(FIELDS, values))) for author_id, values in totals.items()], batch_size=1000,
+    )
+    return len(totals)
@@ -1,8 +1,55 @@
+import asyncio
+import base64
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import closing
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
+from django.utils import timezone
+from tea_store.channel_layers import SQLiteChannelLayer
+from tea_store import metrics, profiling, routers, timing
+from tea_store.middlewares import JsonFormatter, ReplicaRoutingMiddleware, RequestLoggingMiddleware, ServerTimingMiddleware
+from tea_store.replication import replicate
+from tea_store.sqlite_backend import PRAGMAS, production_database, replica_database
+from rest_framework import serializers, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
-from .models import CartItem
+from .models import CartItem, CartSummary, CatalogImport, CatalogVersion, ProductChange
+from .cache import get_response_cache
+from .fast_read import FieldMap
+from .importer import CatalogImporter, CatalogImportError
+from .renderers import FastJSONRenderer
+from .serializer import CartItemSerializer
+from . import benchmarks, changelog, protocol, summary
+from .consumers import IDLE_CLOSE_CODE, ProductConsumer
+from .events import PRODUCTS_GROUP, ProductEventDispatcher, publish_catalog_changed
+from .topics import Subscription
 
 User = get_user_model() # Получаем текущую активную модель пользователя
 
@@ -213,4 +260,1786 @@ class CartItemTests(APITestCase):
         response = self.client.post(self.list_url, payload_without_quantity, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         new_item = CartItem.objects.get(product_name='Чай без количества')
-        self.assertEqual(new_item.product_quantity, 1) # Должно быть 1 по умолчанию
\ No newline at end of file
+        self.assertEqual(new_item.product_quantity, 1) # Должно быть 1 по умолчанию
+
+class CartItemCursorPaginationTests(APITestCase):
+    """
+    Тесты keyset-пагинации (?pagination=cursor) для списка карточек.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pageuser', password='testpassword')
+        # Специально делаем повторяющиеся цены и названия, чтобы проверить tie-breaker по id
+        for i in range(23):
+            CartItem.objects.create(
+                product_name=f'Чай {i % 5}',
+                product_price=float(i % 4) + 0.5,
+                product_quantity=(i * 7) % 3 + 1,
+                author=self.user
+            )
+        self.list_url = reverse('cartitem-list')
+
+    def walk(self, params, backwards=False):
+        """Проходит все страницы по ссылкам next и возвращает id в порядке выдачи."""
+        response = self.client.get(self.list_url, {'pagination': 'cursor', 'page_size': 4, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in response.data['results']]
+        last_response = response
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            last_response = response
+        if not backwards:
+            return ids
+
+        # Идём обратно по ссылкам previous от последней страницы
+        response = last_response
+        back_ids = [item['id'] for item in response.data['results']]
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            back_ids = [item['id'] for item in response.data['results']] + back_ids
+        return ids, back_ids
+
+    def test_cursor_pages_match_full_ordering(self):
+        """Keyset-страницы в сумме дают тот же порядок, что и обычный order_by с tie-breaker по id."""
+        for ordering in ['product_name', '-product_name', 'product_price', '-product_price',
+                         'product_quantity', '-product_quantity', 'product_price,-product_name', '']:
+            with self.subTest(ordering=ordering):
+                fields = [f for f in ordering.split(',') if f]
+                direction = '-' if fields and fields[-1].startswith('-') else ''
+                expected = list(
+                    CartItem.objects.order_by(*fields, direction + 'id').values_list('id', flat=True)
+                )
+                ids, back_ids = self.walk({'ordering': ordering} if ordering else {}, backwards=True)
+                self.assertEqual(ids, expected)
+                self.assertEqual(back_ids, expected)
+
+    def test_cursor_keeps_price_filter(self):
+        """Фильтры по цене продолжают работать вместе с курсором."""
+        ids = self.walk({'product_price__gte': 1.5, 'product_price__lte': 2.5, 'ordering': '-product_price'})
+        expected = list(
+            CartItem.objects.filter(product_price__gte=1.5, product_price__lte=2.5)
+            .order_by('-product_price', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_cursor_without_count_skips_count_query(self):
+        """Без ?count=true нет поля count и нет запроса COUNT(*)."""
+        with self.assertNumQueries(2): # Версия каталога и сама страница
+            response = self.client.get(self.list_url, {'pagination': 'cursor'})
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 10)
+
+        response = self.client.get(self.list_url, {'pagination': 'cursor', 'count': 'true'})
+        self.assertEqual(response.data['count'], 23)
+
+    def test_cursor_from_other_ordering_is_rejected(self):
+        """Курсор, выданный для одной сортировки, нельзя использовать с другой."""
+        response = self.client.get(self.list_url, {'pagination': 'cursor', 'ordering': 'product_price'})
+        next_url = response.data['next']
+        response = self.client.get(next_url.replace('ordering=product_price', 'ordering=product_name'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_wrong_typed_position_is_rejected(self):
+        """Подделанный курсор со значениями не того типа даёт 404, а не 500."""
+        cases = [
+            ({'ordering': 'product_price'}, ['product_price', 'id'], [{'a': 1}, 1]),
+            ({'ordering': 'product_price'}, ['product_price', 'id'], [1.5, 'zz']),
+            ({'ordering': 'product_price'}, ['product_price', 'id'], [None, 1]),
+            ({}, ['id'], ['zz']),
+            ({}, ['id'], [[1]]),
+        ]
+        for params, ordering, position in cases:
+            with self.subTest(position=position):
+                cursor = base64.urlsafe_b64encode(json.dumps({'o': ordering, 'p': position}).encode()).decode()
+                response = self.client.get(self.list_url, {'pagination': 'cursor', 'cursor': cursor, **params})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Число строкой приводится к типу поля, как и в обычных фильтрах
+        cursor = base64.urlsafe_b64encode(json.dumps({'o': ['id'], 'p': ['5']}).encode()).decode()
+        response = self.client.get(self.list_url, {'pagination': 'cursor', 'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_page_number_pagination_is_default(self):
+        """Без параметров остаётся обычная пагинация с count."""
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.data['count'], 23)
+        self.assertEqual(len(response.data['results']), 10)
+
+
+class CartItemFullTextSearchTests(APITestCase):
+    """
+    Тесты поиска по названию через индекс FTS5.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='searchuser', password='testpassword')
+        self.oolong = CartItem.objects.create(product_name='Молочный Улун', product_price=100, product_quantity=1, author=self.user)
+        self.puer = CartItem.objects.create(product_name='Шу Пуэр', product_price=200, product_quantity=1, author=self.user)
+        self.double = CartItem.objects.create(product_name='Улун улун улун', product_price=300, product_quantity=1, author=self.user)
+        self.list_url = reverse('cartitem-list')
+
+    def search(self, term, **params):
+        response = self.client.get(self.list_url, {'search': term, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data['results']]
+
+    def test_prefix_and_case_insensitive_search(self):
+        """Поиск по началу слова без учёта регистра."""
+        self.assertCountEqual(self.search('улу'), [self.oolong.id, self.double.id])
+        self.assertEqual(self.search('ПУЭР'), [self.puer.id])
+        self.assertEqual(self.search('молоч улун'), [self.oolong.id])
+
+    def test_results_are_ranked_by_relevance(self):
+        """Без ?ordering результаты отсортированы по релевантности, с ?ordering - как просили."""
+        self.assertEqual(self.search('улун'), [self.double.id, self.oolong.id])
+        self.assertEqual(self.search('улун', ordering='product_price'), [self.oolong.id, self.double.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        """Индекс обновляется при изменении и удалении карточки."""
+        self.puer.product_name = 'Шэн Пуэр'
+        self.puer.save()
+        self.assertEqual(self.search('шэн'), [self.puer.id])
+        self.assertEqual(self.search('шу'), [])
+
+        self.puer.delete()
+        self.assertEqual(self.search('пуэр'), [])
+
+    def test_special_characters_do_not_break_query(self):
+        """Спецсимволы синтаксиса FTS5 в запросе не приводят к ошибке."""
+        self.assertEqual(self.search('"улун* ('), [self.double.id, self.oolong.id])
+        self.assertEqual(self.search('***'), [])
+
+
+@override_settings(CARTITEMS_RESPONSE_CACHE=None) # Иначе повторные запросы не дойдут до базы
+class CartItemQueryPlanTests(APITestCase):
+    """
+    Регрессионные тесты планов запросов: для каждой комбинации фильтра по цене, сортировки и пагинации,
+    которую отдаёт CartItemViewSet, SELECT не должен превращаться в полный скан таблицы + сортировку во временном B-дереве.
+    """
+    price_filters = [
+        {},
+        {'product_price__gte': 50},
+        {'product_price__lte': 150},
+        {'product_price__gte': 50, 'product_price__lte': 150},
+    ]
+    orderings = [None, 'product_name', '-product_name', 'product_price', '-product_price',
+                 'product_quantity', '-product_quantity']
+    paginations = [{}, {'pagination': 'cursor'}]
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='planuser', password='testpassword')
+        CartItem.objects.bulk_create([
+            CartItem(product_name=f'Чай {i}', product_price=i, product_quantity=i % 7 + 1, author=self.user)
+            for i in range(200)
+        ])
+        self.list_url = reverse('cartitem-list')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def list_queries(self, params):
+        """Выполняет запрос к API (и к следующей странице для курсора) и возвращает SELECT-ы по карточкам."""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.list_url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if response.data['next']:
+                self.assertEqual(self.client.get(response.data['next']).status_code, status.HTTP_200_OK)
+        return [
+            query['sql'] for query in ctx.captured_queries
+            if query['sql'].startswith('SELECT') and 'COUNT(*)' not in query['sql'] and '"api_cartitem"' in query['sql']
+        ]
+
+    def test_no_full_scan_with_temp_sort(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+
+        for price_filter, ordering, pagination in itertools.product(self.price_filters, self.orderings, self.paginations):
+            params = {**price_filter, **pagination}
+            if ordering:
+                params['ordering'] = ordering
+            for sql in self.list_queries(params):
+                plan = self.explain(sql)
+                with self.subTest(params=params, plan=plan):
+                    full_scan = any(step.startswith('SCAN api_cartitem') and 'INDEX' not in step for step in plan)
+                    temp_sort = any('USE TEMP B-TREE FOR ORDER BY' in step for step in plan)
+                    self.assertFalse(full_scan and temp_sort, f'{sql}\n{plan}')
+
+
+@override_settings(CARTITEMS_RESPONSE_CACHE={
+    'BACKEND': 'api.cache.LRUResponseCache',
+    'OPTIONS': {'MAX_ENTRIES': 2, 'TIMEOUT': 300},
+})
+class CartItemResponseCacheTests(APITestCase):
+    """
+    Тесты кэша ответов list/retrieve и его инвалидации по версии каталога.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheuser', password='testpassword')
+        self.admin_user = User.objects.create_superuser(username='cacheadmin', password='adminpassword')
+        self.cart_item = CartItem.objects.create(product_name='Кэшируемый Чай', product_price=10, product_quantity=1, author=self.user)
+        self.list_url = reverse('cartitem-list')
+        self.detail_url = reverse('cartitem-detail', args=[self.cart_item.id])
+
+    def test_repeated_get_is_served_from_cache(self):
+        """Повторный GET с теми же параметрами (в любом порядке) читает из базы только версию каталога."""
+        response = self.client.get(self.list_url + '?ordering=product_price&page=1')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_url + '?page=1&ordering=product_price')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['results'][0]['product_name'], 'Кэшируемый Чай')
+
+    def test_save_and_delete_invalidate_cache(self):
+        """Изменение и удаление карточки меняют версию каталога, и кэш перестаёт отдавать старые данные."""
+        self.client.get(self.detail_url)
+        self.cart_item.product_price = 99
+        self.cart_item.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['product_price'], 99)
+
+        self.client.get(self.list_url)
+        self.cart_item.delete()
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'], [])
+
+    def test_version_is_shared_between_workers(self):
+        """Версия каталога в базе: изменение, сделанное другим воркером, сбрасывает и кэш этого процесса."""
+        self.client.get(self.list_url)
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], 'HIT')
+        CartItem.objects.filter(pk=self.cart_item.pk).update(product_price=55) # Запись мимо сигналов этого процесса
+        CatalogVersion.objects.update(version=F('version') + 1) # ...и смена версии в той же базе
+        response = self.client.get(self.list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['product_price'], 55)
+
+    def test_lru_eviction_and_stats(self):
+        """При переполнении вытесняется самая старая запись, счётчики доступны админу."""
+        cache = get_response_cache()
+        cache.stats.reset()
+        for ordering in ['product_name', 'product_price', 'product_quantity']:
+            self.client.get(self.list_url, {'ordering': ordering})
+        self.assertEqual(self.client.get(self.list_url, {'ordering': 'product_name'})['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.list_url, {'ordering': 'product_quantity'})['X-Cache'], 'HIT')
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(self.list_url + 'cache-stats/').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.admin_user)
+        stats = self.client.get(self.list_url + 'cache-stats/').data
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 4)
+        self.assertEqual(stats['evictions'], 2)
+
+    @override_settings(CARTITEMS_RESPONSE_CACHE={'BACKEND': 'api.cache.DjangoResponseCache', 'OPTIONS': {'CACHE_ALIAS': 'default'}})
+    def test_django_cache_backend(self):
+        """Бэкенд поверх кэша Django работает так же."""
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+
+
+class CartItemConditionalRequestTests(APITestCase):
+    """
+    Тесты ETag / Last-Modified и условных запросов (If-None-Match, If-Match).
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='etaguser', password='testpassword')
+        self.another_user = User.objects.create_user(username='etagother', password='testpassword')
+        self.cart_item = CartItem.objects.create(product_name='Чай с ETag', product_price=10, product_quantity=1, author=self.user)
+        self.list_url = reverse('cartitem-list')
+        self.detail_url = reverse('cartitem-detail', args=[self.cart_item.id])
+
+    def test_list_not_modified_without_queries(self):
+        """Совпавший If-None-Match для списка возвращает 304 одним запросом (версия каталога), без чтения строк."""
+        response = self.client.get(self.list_url, {'ordering': 'product_price'})
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(1):
+            response = self.client.get(self.list_url, {'ordering': 'product_price'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Другие параметры - другой ETag
+        response = self.client.get(self.list_url, {'ordering': '-product_price'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_validators_follow_shared_version(self):
+        """ETag и Last-Modified списка берутся из общей версии: после записи в другом воркере старый ETag не даёт 304."""
+        response = self.client.get(self.list_url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(self.list_url)['ETag'], etag)
+        CatalogVersion.objects.update(version=F('version') + 1, modified_at=timezone.now() + timedelta(seconds=5))
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_detail_etag_changes_after_update(self):
+        """ETag карточки меняется после изменения, 304 отдаётся одним запросом."""
+        etag = self.client.get(self.detail_url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.cart_item.product_price = 11
+        self.cart_item.save()
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stale_if_match_is_rejected(self):
+        """Изменение с устаревшим If-Match не перезаписывает данные (412), с актуальным - проходит."""
+        self.client.force_authenticate(user=self.user)
+        etag = self.client.get(self.detail_url)['ETag']
+
+        response = self.client.patch(self.detail_url, {'product_price': 20}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_etag = response['ETag']
+        self.assertNotEqual(new_etag, etag)
+
+        response = self.client.patch(self.detail_url, {'product_price': 30}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.detail_url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.cart_item.refresh_from_db()
+        self.assertEqual(self.cart_item.product_price, 20)
+
+        response = self.client.delete(self.detail_url, HTTP_IF_MATCH=new_etag)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_if_match_checks_permissions_first(self):
+        """Чужой пользователь получает 403, а не 412."""
+        self.client.force_authenticate(user=self.another_user)
+        response = self.client.put(self.detail_url, {'product_name': 'x', 'product_price': 1}, format='json', HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_non_numeric_pk_is_not_found(self):
+        """Нечисловой id в URL - 404, а не ошибка при вычислении ETag."""
+        self.client.force_authenticate(user=self.user)
+        url = '/api/cartitems/abc/'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"x"').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.patch(url, {'product_price': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CartItemBulkTests(APITestCase):
+    """
+    Тесты пакетных операций /api/cartitems/bulk/.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulkuser', password='testpassword')
+        self.another_user = User.objects.create_user(username='bulkother', password='testpassword')
+        self.own_items = [
+            CartItem.objects.create(product_name=f'Свой чай {i}', product_price=10 + i, product_quantity=1, author=self.user)
+            for i in range(3)
+        ]
+        self.foreign_item = CartItem.objects.create(product_name='Чужой чай', product_price=50, product_quantity=1, author=self.another_user)
+        self.bulk_url = reverse('cartitem-bulk')
+
+    def test_guest_cannot_bulk_create(self):
+        response = self.client.post(self.bulk_url, [{'product_name': 'x', 'product_price': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_create_in_one_transaction_with_one_broadcast(self):
+        """Пачка создаётся одним запросом, автор проставляется, подписчики получают одно сообщение."""
+        self.client.force_authenticate(user=self.user)
+        payload = [{'product_name': f'Новый чай {i}', 'product_price': i + 0.5} for i in range(5)]
+        with mock.patch('api.views.get_dispatcher') as get_dispatcher, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.bulk_url, payload, format='json')
+        broadcast = get_dispatcher.return_value.publish
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(CartItem.objects.filter(author=self.user, product_name__startswith='Новый').count(), 5)
+        self.assertEqual(CartItem.objects.get(product_name='Новый чай 0').product_quantity, 1)
+        broadcast.assert_called_once()
+        ops = broadcast.call_args.args[0]
+        self.assertEqual([op['op'] for op in ops], ['created'] * 5)
+
+    def test_bulk_create_validates_every_item(self):
+        """Если хоть один элемент невалиден, ничего не создаётся."""
+        self.client.force_authenticate(user=self.user)
+        payload = [{'product_name': 'Хороший', 'product_price': 1}, {'product_name': 'Плохой'}]
+        response = self.client.post(self.bulk_url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CartItem.objects.filter(product_name='Хороший').exists())
+
+    def test_bulk_update(self):
+        """Владелец меняет несколько своих карточек одним запросом."""
+        self.client.force_authenticate(user=self.user)
+        payload = [{'id': item.id, 'product_price': 100 + i} for i, item in enumerate(self.own_items)]
+        payload[0]['product_name'] = self.own_items[0].product_name # Значение не изменилось - в дельту не попадает
+        with mock.patch('api.views.get_dispatcher') as get_dispatcher, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.bulk_url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        prices = list(CartItem.objects.filter(author=self.user).order_by('id').values_list('product_price', flat=True))
+        self.assertEqual(prices, [100, 101, 102])
+        ops = get_dispatcher.return_value.publish.call_args.args[0]
+        self.assertEqual([op['op'] for op in ops], ['updated'] * 3)
+        self.assertEqual(ops[0]['changes'], {'product_price': 100.0})
+
+    def test_bulk_update_checks_each_object(self):
+        """Если в пачке есть чужая карточка, запрос отклоняется целиком."""
+        self.client.force_authenticate(user=self.user)
+        payload = [{'id': self.own_items[0].id, 'product_price': 1}, {'id': self.foreign_item.id, 'product_price': 1}]
+        response = self.client.patch(self.bulk_url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.own_items[0].refresh_from_db()
+        self.assertEqual(self.own_items[0].product_price, 10)
+
+    def test_bulk_delete(self):
+        """Удаление пачкой: свои можно, несуществующие дают 404, чужие - 403."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(self.bulk_url, [self.own_items[0].id, 999999], format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(self.bulk_url, [self.own_items[0].id, self.foreign_item.id], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        before = ProductChange.objects.count()
+        with mock.patch('api.views.get_dispatcher') as get_dispatcher, \
+                mock.patch('api.signals.get_dispatcher') as signal_dispatcher, \
+                self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(self.bulk_url, [item.id for item in self.own_items], format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(CartItem.objects.filter(author=self.user).exists())
+        # Одна рассылка на пачку, наши обработчики post_delete на каждую строку ничего не делают
+        get_dispatcher.return_value.publish.assert_called_once()
+        signal_dispatcher.return_value.publish.assert_not_called()
+        ops = get_dispatcher.return_value.publish.call_args.args[0]
+        self.assertEqual({op['op'] for op in ops}, {'deleted'})
+        self.assertCountEqual([op['id'] for op in ops], [item.id for item in self.own_items])
+        self.assertEqual(ProductChange.objects.count() - before, len(self.own_items))
+        statements = [query['sql'].split()[0] for query in queries.captured_queries]
+        self.assertEqual(statements.count('UPDATE'), 2) # Итоги корзин и версия каталога - по одному разу
+        self.assertFalse(CartSummary.objects.filter(author=self.user, item_count__gt=0).exists())
+
+    def test_bulk_delete_sends_post_delete(self):
+        """Удаление пачкой идёт через delete(): сторонние обработчики post_delete получают каждую строку."""
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance.pk)
+
+        post_delete.connect(receiver, sender=CartItem)
+        self.addCleanup(post_delete.disconnect, receiver, sender=CartItem)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(self.bulk_url, [item.id for item in self.own_items], format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertCountEqual(deleted, [item.id for item in self.own_items])
+
+
+class ProductEventDispatcherTests(APITestCase):
+    """
+    Тесты рассылки изменений карточек: только после коммита, со схлопыванием, из фоновой задачи.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='eventuser', password='testpassword')
+
+    def test_broadcast_happens_only_after_commit(self):
+        """Сохранение не трогает channel layer, событие публикуется только после коммита."""
+        with mock.patch('api.signals.get_dispatcher') as get_dispatcher:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                item = CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+            get_dispatcher.return_value.publish.assert_not_called()
+            for callback in callbacks:
+                callback()
+        get_dispatcher.return_value.publish.assert_called_once()
+        [op] = get_dispatcher.return_value.publish.call_args.args[0]
+        self.assertEqual((op['op'], op['id'], op['data']['product_name']), ('created', item.id, 'Чай'))
+
+    def test_rolled_back_save_is_not_broadcast(self):
+        """Если транзакция откатилась, подписчики ничего не получают."""
+        with mock.patch('api.signals.get_dispatcher') as get_dispatcher:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+        get_dispatcher.return_value.publish.assert_not_called()
+
+    def test_update_sends_only_changed_fields(self):
+        """При изменении в событие попадают только изменившиеся поля; сохранение без изменений ничего не рассылает."""
+        item = CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+        item = CartItem.objects.get(pk=item.pk)
+        with mock.patch('api.signals.get_dispatcher') as get_dispatcher:
+            with self.captureOnCommitCallbacks(execute=True):
+                item.product_price = 5
+                item.save()
+                item.product_quantity = 2
+                item.save()
+                item.save()
+        ops = [call.args[0][0] for call in get_dispatcher.return_value.publish.call_args_list]
+        self.assertEqual([(op['op'], op['changes']) for op in ops], [
+            ('updated', {'product_price': 5.0}),
+            ('updated', {'product_quantity': 2}),
+        ])
+
+    def test_delete_is_broadcast(self):
+        """Удаление одной карточки через API тоже рассылается (хук post_delete)."""
+        item = CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+        self.client.force_authenticate(user=self.user)
+        with mock.patch('api.signals.get_dispatcher') as get_dispatcher, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse('cartitem-detail', args=[item.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        [op] = get_dispatcher.return_value.publish.call_args.args[0]
+        self.assertEqual(op['data'], {'id': item.id, 'author': self.user.id, 'product_price': 1})
+        self.assertEqual((op['op'], op['id']), ('deleted', item.id))
+
+    def test_events_are_coalesced(self):
+        """В пределах окна операции над одной карточкой схлопываются, удаление перекрывает изменение."""
+        dispatcher = ProductEventDispatcher(debounce=60)
+        dispatcher.publish([protocol.created_op({'id': 1, 'product_price': 1})])
+        dispatcher.publish([protocol.updated_op({'id': 2, 'product_price': 2}, {'product_price': 2})])
+        dispatcher.publish([protocol.updated_op({'id': 1, 'product_price': 3}, {'product_price': 3})])
+        dispatcher.publish([protocol.updated_op({'id': 3, 'product_name': 'a', 'product_price': 4}, {'product_name': 'a'})])
+        dispatcher.publish([protocol.updated_op({'id': 3, 'product_name': 'a', 'product_price': 5}, {'product_price': 5})])
+        dispatcher.publish([protocol.deleted_op(2), protocol.deleted_op(5)])
+        message = dispatcher.build_message(dispatcher._take_pending())
+        self.assertEqual(message['ops'], [
+            {'op': 'created', 'id': 1, 'data': {'id': 1, 'product_price': 3}},
+            {'op': 'updated', 'id': 3, 'data': {'id': 3, 'product_name': 'a', 'product_price': 5},
+             'changes': {'product_name': 'a', 'product_price': 5}},
+            {'op': 'deleted', 'id': 2},
+            {'op': 'deleted', 'id': 5},
+        ])
+        self.assertEqual(dispatcher.stats['coalesced'], 3)
+
+    def test_background_flush_sends_one_message(self):
+        """Фоновая задача отправляет накопленные изменения одной пачкой."""
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)('products_updates', channel_name)
+        try:
+            dispatcher = ProductEventDispatcher(debounce=0.01)
+            dispatcher.publish([protocol.created_op({'id': 1}), protocol.created_op({'id': 2})])
+            dispatcher.publish([protocol.deleted_op(1)])
+            for _ in range(100):
+                if dispatcher.stats['messages']:
+                    break
+                time.sleep(0.01)
+            message = async_to_sync(channel_layer.receive)(channel_name)
+        finally:
+            async_to_sync(channel_layer.group_discard)('products_updates', channel_name)
+        self.assertEqual(message['type'], 'product_events')
+        self.assertEqual(message['ops'], [{'op': 'created', 'id': 2, 'data': {'id': 2}}, {'op': 'deleted', 'id': 1}])
+        self.assertEqual(dispatcher.stats['flushes'], 1)
+        # Одно сообщение в общую группу и по одному в группу каждой карточки
+        self.assertEqual(dispatcher.stats['messages'], 3)
+
+    def test_ops_are_routed_to_topic_groups(self):
+        """Операция попадает в группы автора, карточки и корзин прежней и новой цены."""
+        dispatcher = ProductEventDispatcher(debounce=60)
+        data = {'id': 7, 'author': 3, 'product_price': 250.0}
+        dispatcher.publish([protocol.updated_op(data, {'product_price': 250.0}, previous={'product_price': 50.0})])
+        dispatcher.publish([protocol.deleted_op(8, {'id': 8, 'author': 4, 'product_price': 20.0})])
+        messages = dispatcher.build_messages(dispatcher._take_pending())
+        routes = {group: [op['id'] for op in message['ops']] for group, message in messages.items()}
+        self.assertEqual(routes, {
+            'products_updates': [7, 8],
+            'products.item.7': [7], 'products.author.3': [7], 'products.price.2': [7], 'products.price.0': [7, 8],
+            'products.item.8': [8], 'products.author.4': [8],
+        })
+        self.assertEqual(len({message['eid'] for message in messages.values()}), 1)
+
+    def test_drain_sends_pending_ops(self):
+        """drain() отправляет накопленное сразу, не дожидаясь окна (так же и при выходе из процесса)."""
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)('products_updates', channel_name)
+        try:
+            dispatcher = ProductEventDispatcher(debounce=60)
+            dispatcher.publish([protocol.created_op({'id': 1})])
+            dispatcher.drain()
+            self.assertEqual(dispatcher.stats['flushes'], 1)
+            message = async_to_sync(channel_layer.receive)(channel_name)
+        finally:
+            async_to_sync(channel_layer.group_discard)('products_updates', channel_name)
+        self.assertEqual(message['ops'], [{'op': 'created', 'id': 1, 'data': {'id': 1}}])
+        self.assertEqual(dispatcher._take_pending(), {})
+
+    async def test_pending_ops_are_kept_per_loop(self):
+        """Отправка, запланированная в фоновом loop, не мешает запланировать её в loop сервера и не забирает его операции."""
+        dispatcher = ProductEventDispatcher(debounce=60)
+        thread = threading.Thread(target=dispatcher.publish, args=([protocol.created_op({'id': 1})],))
+        thread.start()
+        thread.join()
+        loop = asyncio.get_running_loop()
+        with mock.patch.object(loop, 'call_soon_threadsafe') as arm:
+            dispatcher.publish([protocol.created_op({'id': 2})])
+        arm.assert_called_once()
+        self.assertEqual(list(dispatcher._take_pending(loop)), [2])
+        self.assertEqual(list(dispatcher._take_pending()), [1])
+
+
+class SQLiteChannelLayerTests(APITestCase):
+    """
+    Тесты межпроцессного channel layer поверх SQLite (два экземпляра на одном файле = два воркера).
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+
+    def run_async(self, coroutine):
+        return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+    def test_group_send_reaches_other_worker(self):
+        async def scenario():
+            worker_a = SQLiteChannelLayer(path=self.path)
+            worker_b = SQLiteChannelLayer(path=self.path)
+            channel_a = await worker_a.new_channel()
+            channel_b = await worker_b.new_channel()
+            await worker_a.group_add('products_updates', channel_a)
+            await worker_b.group_add('products_updates', channel_b)
+
+            await worker_a.group_send('products_updates', {'type': 'product_update', 'message': {'id': 1}})
+            received = [await worker_a.receive(channel_a), await worker_b.receive(channel_b)]
+
+            await worker_b.group_discard('products_updates', channel_b)
+            await worker_a.group_send('products_updates', {'type': 'product_update', 'message': {'id': 2}})
+            received.append(await worker_a.receive(channel_a))
+            await worker_a.close()
+            await worker_b.close()
+            return received
+
+        received = self.run_async(scenario())
+        self.assertEqual([message['message']['id'] for message in received], [1, 1, 2])
+
+    def test_capacity_and_expiry(self):
+        async def scenario():
+            layer = SQLiteChannelLayer(path=self.path, capacity=2, expiry=0.2)
+            await layer.send('plain', {'type': 'a'})
+            await layer.send('plain', {'type': 'b'})
+            with self.assertRaises(ChannelFull):
+                await layer.send('plain', {'type': 'c'})
+            await asyncio.sleep(0.3) # Сообщения протухли - канал снова свободен
+            await layer.send('plain', {'type': 'd'})
+            message = await layer.receive('plain')
+            await layer.close()
+            return message
+
+        self.assertEqual(self.run_async(scenario())['type'], 'd')
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    PRODUCT_EVENTS={'MAX_PENDING': 3, 'HEARTBEAT': None, 'IDLE_TIMEOUT': None},
+)
+class ProductConsumerTests(APITestCase):
+    """
+    Тесты асинхронного консьюмера ws/products/: доставка, схлопывание и ограничение очереди, heartbeat.
+    """
+
+    async def connect(self, subprotocols=None):
+        communicator = WebsocketCommunicator(ProductConsumer.as_asgi(), '/ws/products/', subprotocols=subprotocols)
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        if subprotocols:
+            self.assertEqual(subprotocol, subprotocols[0])
+        return communicator
+
+    def events_message(self):
+        data = {'id': 1, 'author': 1, 'product_name': 'Улун', 'product_price': 10.0, 'product_quantity': 3}
+        return {'type': 'product_events', 'v': 2, 'ops': [
+            protocol.created_op({**data, 'id': 2}),
+            protocol.updated_op(data, {'product_price': 10.0}),
+            protocol.deleted_op(3),
+        ]}
+
+    async def test_v2_json_frames_carry_deltas(self):
+        communicator = await self.connect([protocol.JSON])
+        await get_channel_layer().group_send(PRODUCTS_GROUP, self.events_message())
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['v'], 2)
+        self.assertEqual(frame['ops'][1:], [
+            {'op': 'updated', 'id': 1, 'changes': {'product_price': 10.0}},
+            {'op': 'deleted', 'id': 3},
+        ])
+        self.assertEqual(frame['ops'][0]['data']['product_name'], 'Улун')
+        await communicator.disconnect()
+
+    @unittest.skipIf(protocol.msgpack is None, 'msgpack не установлен')
+    async def test_v2_msgpack_frames(self):
+        communicator = await self.connect([protocol.MSGPACK, protocol.JSON])
+        await get_channel_layer().group_send(PRODUCTS_GROUP, self.events_message())
+        frame = protocol.msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual([op['op'] for op in frame['ops']], ['created', 'updated', 'deleted'])
+        await communicator.disconnect()
+
+    async def test_legacy_client_gets_full_objects(self):
+        """Клиент без подпротокола получает карточки целиком, как раньше, и удаления отдельным сообщением."""
+        communicator = await self.connect()
+        await get_channel_layer().group_send(PRODUCTS_GROUP, self.events_message())
+        saved = await communicator.receive_json_from()
+        self.assertEqual([item['id'] for item in saved], [2, 1])
+        self.assertEqual(saved[1]['product_name'], 'Улун')
+        self.assertEqual(await communicator.receive_json_from(), {'deleted': [3]})
+        await communicator.disconnect()
+
+    async def test_group_messages_are_delivered(self):
+        communicator = await self.connect()
+        channel_layer = get_channel_layer()
+        await channel_layer.group_send(PRODUCTS_GROUP, {'type': 'product_update', 'message': {'id': 1, 'product_price': 10}})
+        self.assertEqual(await communicator.receive_json_from(), {'id': 1, 'product_price': 10})
+        await channel_layer.group_send(PRODUCTS_GROUP, {'type': 'product_delete', 'message': {'deleted': [1]}})
+        self.assertEqual(await communicator.receive_json_from(), {'deleted': [1]})
+        await communicator.disconnect()
+
+    async def test_slow_client_outbox_is_coalesced_and_bounded(self):
+        """Пока клиент не забрал события, изменения одной карточки схлопываются, а лишние вытесняются с флагом resync."""
+        consumer = ProductConsumer() # Без подключения: фоновая задача отправки не запущена, события только копятся
+        for price in (1, 2, 3):
+            await consumer.product_update({'message': {'id': 1, 'product_price': price}})
+        await consumer.product_update({'message': [{'id': 2}, {'id': 3}]})
+        self.assertEqual(list(consumer.outbox), [1, 2, 3])
+        self.assertEqual(consumer.stats['coalesced'], 2)
+        self.assertFalse(consumer.resync_required)
+
+        await consumer.product_delete({'message': {'deleted': [4]}})
+        self.assertEqual(list(consumer.outbox), [2, 3, 4]) # Самое старое событие вытеснено
+        self.assertEqual(consumer.stats['dropped'], 1)
+        pending, resync = consumer.take_outbox()
+        self.assertTrue(resync)
+        self.assertEqual(len(pending), 3)
+        self.assertFalse(consumer.outbox)
+
+    async def test_resync_is_sent_after_overflow(self):
+        communicator = await self.connect()
+        await get_channel_layer().group_send(
+            PRODUCTS_GROUP, {'type': 'product_update', 'message': [{'id': pk} for pk in range(5)]},
+        )
+        self.assertEqual(await communicator.receive_json_from(), {'resync': True})
+        self.assertEqual(await communicator.receive_json_from(), [{'id': 2}, {'id': 3}, {'id': 4}])
+        await communicator.disconnect()
+
+    async def test_heartbeat_and_idle_timeout(self):
+        with self.settings(PRODUCT_EVENTS={'HEARTBEAT': 0.05, 'IDLE_TIMEOUT': 0.2}):
+            communicator = await self.connect([protocol.JSON])
+            ping = await communicator.receive_json_from()
+            self.assertIn('ping', ping)
+            await communicator.send_json_to({'pong': ping['ping']})
+            # Дальше клиент молчит - сервер закрывает соединение
+            while True:
+                message = await communicator.receive_output(timeout=2)
+                if message['type'] == 'websocket.close':
+                    break
+            self.assertEqual(message['code'], IDLE_CLOSE_CODE)
+            await communicator.disconnect()
+
+    async def test_legacy_client_has_no_heartbeat(self):
+        """Старому клиенту не уходит ping, и молчащее соединение не закрывается по IDLE_TIMEOUT."""
+        with self.settings(PRODUCT_EVENTS={'HEARTBEAT': 0.05, 'IDLE_TIMEOUT': 0.1}):
+            communicator = await self.connect()
+            self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+            await get_channel_layer().group_send(PRODUCTS_GROUP, {'type': 'product_delete', 'message': {'deleted': [1]}})
+            self.assertEqual(await communicator.receive_json_from(), {'deleted': [1]})
+            await communicator.disconnect()
+
+    async def send_ops(self, *ops):
+        "Рассылает операции так же, как это делает ProductEventDispatcher (общая группа + группы тем)"
+        dispatcher = ProductEventDispatcher(debounce=60)
+        dispatcher.publish(ops)
+        channel_layer = get_channel_layer()
+        for group, message in dispatcher.build_messages(dispatcher._take_pending()).items():
+            await channel_layer.group_send(group, message)
+
+    async def subscribe(self, communicator, spec, action='subscribe'):
+        await communicator.send_json_to({action: spec})
+        return await communicator.receive_json_from()
+
+    async def test_topic_subscriptions_route_only_matching_ops(self):
+        communicator = await self.connect([protocol.JSON])
+        reply = await self.subscribe(communicator, {'author': 3, 'products': [1]})
+        self.assertEqual(reply['subscribed']['authors'], [3])
+
+        await self.send_ops(
+            protocol.created_op({'id': 1, 'author': 3, 'product_price': 10.0}),
+            protocol.created_op({'id': 2, 'author': 4, 'product_price': 10.0}),
+        )
+        frame = await communicator.receive_json_from()
+        self.assertEqual([op['id'] for op in frame['ops']], [1]) # Пришла из двух групп, но отправлена один раз
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_price_range_subscription(self):
+        communicator = await self.connect([protocol.JSON])
+        await self.subscribe(communicator, {'product_price__gte': 100, 'product_price__lte': 150})
+        await self.send_ops(
+            protocol.created_op({'id': 1, 'author': 3, 'product_price': 120.0}),
+            protocol.created_op({'id': 2, 'author': 3, 'product_price': 180.0}), # Та же корзина, но вне диапазона
+            protocol.updated_op({'id': 3, 'author': 3, 'product_price': 900.0}, {'product_price': 900.0}, {'product_price': 110.0}),
+        )
+        frame = await communicator.receive_json_from()
+        self.assertEqual([op['id'] for op in frame['ops']], [1, 3]) # 3 ушла из диапазона - клиент должен об этом узнать
+        await communicator.disconnect()
+
+    async def test_catalog_event_reaches_every_socket(self):
+        "Событие о каталоге целиком получают и сокеты с подписками; накопленные операции при этом не нужны"
+        communicator = await self.connect([protocol.JSON])
+        await self.subscribe(communicator, {'author': 3})
+        consumer_message = {'type': 'catalog_changed', 'v': 2, 'details': {'records': 10, 'created': 7, 'updated': 3, 'invalid': 0}}
+        await database_sync_to_async(publish_catalog_changed)(consumer_message['details'])
+        self.assertEqual(await communicator.receive_json_from(), {'resync': True, 'import': consumer_message['details']})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_invalid_subscription_and_unsubscribe(self):
+        communicator = await self.connect([protocol.JSON])
+        self.assertIn('error', await self.subscribe(communicator, {'products': ['x']}))
+        self.assertIn('error', await self.subscribe(communicator, {'author': 'me'})) # Анонимный пользователь
+        await self.subscribe(communicator, {'products': [1]})
+        reply = await self.subscribe(communicator, {'products': [1]}, action='unsubscribe')
+        self.assertEqual(reply['subscribed']['products'], [])
+
+        # Подписок не осталось - сокет снова получает все изменения
+        await self.send_ops(protocol.created_op({'id': 5, 'author': 3, 'product_price': 1.0}))
+        self.assertEqual([op['id'] for op in (await communicator.receive_json_from())['ops']], [5])
+        await communicator.disconnect()
+
+    def test_wide_price_range_uses_common_group(self):
+        subscription = Subscription()
+        subscription.add({'product_price__gte': 100, 'product_price__lte': 350})
+        self.assertEqual(subscription.groups(), ({'products.price.1', 'products.price.2', 'products.price.3'}, False))
+        subscription.add({'product_price__gte': 1000})
+        self.assertEqual(subscription.groups(), (set(), True))
+
+    async def test_reconnect_with_since_gets_missed_ops_then_live(self):
+        @database_sync_to_async
+        def make_changes():
+            user = User.objects.create_user(username='sinceuser', password='testpassword')
+            first = CartItem.objects.create(product_name='Улун', product_price=10, product_quantity=1, author=user)
+            since = ProductChange.objects.latest('seq').seq
+            second = CartItem.objects.create(product_name='Пуэр', product_price=20, product_quantity=1, author=user)
+            first.product_price = 15
+            first.save()
+            second_id = second.id
+            second.delete()
+            return since, first.id, second_id
+
+        since, first_id, second_id = await make_changes()
+        communicator = WebsocketCommunicator(ProductConsumer.as_asgi(), f'/ws/products/?since={since}', subprotocols=[protocol.JSON])
+        await communicator.connect()
+        frame = await communicator.receive_json_from()
+        self.assertEqual(
+            [(op['op'], op['id']) for op in frame['ops']],
+            [('created', second_id), ('updated', first_id), ('deleted', second_id)],
+        )
+        self.assertEqual(frame['ops'][1]['changes'], {'product_price': 15.0})
+        latest = frame['ops'][-1]['seq']
+        self.assertEqual(await communicator.receive_json_from(), {'caught_up': latest})
+
+        # Живая операция, уже отданная при догонянии, повторно не отправляется
+        await self.send_ops(
+            {**protocol.created_op({'id': second_id, 'author': 1, 'product_price': 20.0}), 'seq': latest},
+            {**protocol.created_op({'id': 99, 'author': 1, 'product_price': 1.0}), 'seq': latest + 1},
+        )
+        self.assertEqual([op['id'] for op in (await communicator.receive_json_from())['ops']], [99])
+        await communicator.disconnect()
+
+
+class ProductChangeLogTests(APITestCase):
+    """
+    Тесты журнала изменений: запись в той же транзакции, seq в событиях, удержание и снимок.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='loguser', password='testpassword')
+
+    def test_every_write_is_logged_with_seq(self):
+        with mock.patch('api.signals.get_dispatcher') as get_dispatcher, \
+                self.captureOnCommitCallbacks(execute=True):
+            item = CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+            item.product_quantity = 5
+            item.save()
+            item.delete()
+        changes = list(ProductChange.objects.values_list('op', 'payload'))
+        self.assertEqual([op for op, _ in changes], ['created', 'updated', 'deleted'])
+        self.assertEqual(changes[1][1], {'product_quantity': 5})
+        seqs = [call.args[0][0]['seq'] for call in get_dispatcher.return_value.publish.call_args_list]
+        self.assertEqual(seqs, list(ProductChange.objects.values_list('seq', flat=True)))
+
+    def test_rolled_back_write_is_not_logged(self):
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(ProductChange.objects.exists())
+
+    def test_bulk_writes_are_logged(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('cartitem-bulk'), [{'product_name': f'Чай {i}', 'product_price': i} for i in range(3)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ProductChange.objects.filter(op='created').count(), 3)
+
+    def test_catch_up(self):
+        item = CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+        since = ProductChange.objects.latest('seq').seq
+        item.product_price = 2
+        item.save()
+
+        result = changelog.catch_up(since)
+        self.assertEqual([(op['op'], op['changes']) for op in result['ops']], [('updated', {'product_price': 2.0})])
+        self.assertEqual(changelog.catch_up(result['seq']), {'ops': [], 'seq': result['seq']})
+
+        # since из другой базы (больше последнего seq) - снимок
+        snapshot = changelog.catch_up(result['seq'] + 100)['snapshot']
+        self.assertEqual(snapshot['fields'], changelog.SNAPSHOT_FIELDS)
+        self.assertEqual(snapshot['rows'], [[item.id, self.user.id, 'Чай', 2.0, 1]])
+
+    @override_settings(PRODUCT_CHANGELOG={'RETENTION': 3, 'PRUNE_EVERY': 1, 'SNAPSHOT_MAX_ROWS': 2})
+    def test_retention_and_snapshot_fallback(self):
+        item = CartItem.objects.create(product_name='Чай', product_price=1, product_quantity=1, author=self.user)
+        since = ProductChange.objects.latest('seq').seq
+        for price in range(2, 7):
+            item.product_price = price
+            item.save()
+        self.assertEqual(ProductChange.objects.count(), 3) # Старые записи удалены
+
+        result = changelog.catch_up(since)
+        self.assertNotIn('ops', result)
+        self.assertEqual(result['snapshot']['rows'], [[item.id, self.user.id, 'Чай', 6.0, 1]])
+
+        for i in range(2):
+            CartItem.objects.create(product_name=f'Чай {i}', product_price=1, product_quantity=1, author=self.user)
+        self.assertTrue(changelog.catch_up(since)['resync']) # Каталог больше SNAPSHOT_MAX_ROWS
+
+
+class RequestLoggingMiddlewareTests(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+
+    def get_records(self, path, **settings):
+        with override_settings(REQUEST_LOGGING=settings), self.assertLogs('tea_store.requests', 'INFO') as logs:
+            logging.getLogger('tea_store.requests').info('marker') # assertLogs требует хотя бы одну запись
+            self.client.get(path)
+        return [record.request_log for record in logs.records if hasattr(record, 'request_log')]
+
+    def test_one_json_line_per_request(self):
+        self.client.force_authenticate(user=self.user)
+        records = self.get_records(reverse('cartitem-list'))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['method'], 'GET')
+        self.assertEqual(records[0]['status'], 200)
+        self.assertEqual(records[0]['user'], self.user.id) # DRF уже загрузил пользователя
+
+        record = logging.makeLogRecord({'request_log': records[0]})
+        self.assertEqual(json.loads(JsonFormatter().format(record))['path'], reverse('cartitem-list'))
+
+    def test_sampling(self):
+        path = reverse('cartitem-list')
+        self.assertEqual(self.get_records(path, SAMPLING={'/api/': 1.0, path: 0.0}), [])
+        self.assertEqual(len(self.get_records(path, SAMPLING={'/api/': 0.0}, DEFAULT_RATE=0.0, SLOW_MS=0)), 1) # Медленные пишутся всегда
+
+    def test_user_is_not_loaded_for_logging(self):
+        self.client.force_login(self.user)
+        with self.assertNumQueries(0): # Ни сессии, ни пользователя: view их не трогает
+            records = self.get_records('/no-such-page/')
+        self.assertEqual(records[0]['status'], 404)
+        self.assertIsNone(records[0]['user'])
+
+    def test_async_get_response(self):
+        async def get_response(request):
+            return HttpResponse(status=503)
+
+        middleware = RequestLoggingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with override_settings(REQUEST_LOGGING={'DEFAULT_RATE': 0.0}), self.assertLogs('tea_store.requests', 'INFO') as logs:
+            response = async_to_sync(middleware)(RequestFactory().get('/api/'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(logs.records[0].request_log['status'], 503) # Ошибки пишутся всегда
+
+
+class MetricsTests(APITestCase):
+    """
+    Тесты метрик процесса и /metrics.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+
+    def sample(self, name, **labels):
+        key = tuple(str(labels[label]) for label in metrics.REGISTRY.metrics[name].labelnames)
+        return metrics.collect()[name].get(key)
+
+    def test_http_metrics_exposed(self):
+        self.client.force_authenticate(user=self.user)
+        before = self.sample('tea_store_http_requests_total', route='cartitem-list', method='GET', status=200) or 0
+        self.client.get(reverse('cartitem-list'))
+        self.assertEqual(self.sample('tea_store_http_requests_total', route='cartitem-list', method='GET', status=200), before + 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('# TYPE tea_store_http_request_duration_seconds histogram', text)
+        self.assertIn('tea_store_http_request_duration_seconds_bucket{route="cartitem-list",method="GET",le="+Inf"}', text)
+        self.assertIn('tea_store_http_requests_in_flight 1', text) # Сам запрос к /metrics
+
+    def test_allowed_ips(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK) # По умолчанию - loopback
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS={'ALLOWED_IPS': ['10.0.0.1']}):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS={'ALLOWED_IPS': None}):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_histogram_seconds', 'Тест', buckets=(0.1, 1.0))
+        self.addCleanup(metrics.REGISTRY.metrics.pop, histogram.name)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        text = metrics.render()
+        self.assertIn('test_histogram_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('test_histogram_seconds_bucket{le="1.0"} 2\n', text)
+        self.assertIn('test_histogram_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn('test_histogram_seconds_sum 5.55\n', text)
+        self.assertIn('test_histogram_seconds_count 3\n', text)
+
+    def test_multiprocess_merge(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+            labels = {'route': 'cartitem-list', 'method': 'GET', 'status': '200'}
+            before = self.sample('tea_store_http_requests_total', **labels) or 0
+            connections = self.sample('tea_store_ws_connections', consumer='products') or 0
+            snapshot = {
+                'tea_store_http_requests_total': [[list(labels.values()), 5]],
+                'tea_store_ws_connections': [[['products'], 7]],
+            }
+            alive_pid = os.getppid() # Живой процесс, но не текущий
+            alive_path = os.path.join(directory, f'{alive_pid}.json')
+            with open(alive_path, 'w') as file:
+                json.dump({'pid': alive_pid, 'metrics': snapshot}, file)
+            dead_pid = 2 ** 22 + 1 # Больше pid_max по умолчанию: такого процесса нет
+            dead_path = os.path.join(directory, f'{dead_pid}.json')
+            with open(dead_path, 'w') as file:
+                json.dump({'pid': dead_pid, 'metrics': snapshot}, file)
+            self.assertEqual(self.sample('tea_store_http_requests_total', **labels), before + 5)
+            self.assertEqual(self.sample('tea_store_ws_connections', consumer='products'), connections + 7)
+            self.assertFalse(os.path.exists(dead_path)) # Файл завершившегося процесса удалён
+
+            # Файл давно не обновлялся: pid достался другому процессу
+            stale = time.time() - metrics.STALE_INTERVALS * metrics.get_config()['FLUSH_INTERVAL'] - 1
+            os.utime(alive_path, (stale, stale))
+            self.assertEqual(self.sample('tea_store_http_requests_total', **labels) or 0, before)
+            self.assertEqual(self.sample('tea_store_ws_connections', consumer='products') or 0, connections)
+            self.assertFalse(os.path.exists(alive_path))
+
+            writer = metrics.MultiprocessWriter(directory, 5)
+            writer.write()
+            with open(writer.path) as file:
+                self.assertIn('tea_store_http_requests_total', json.load(file)['metrics'])
+
+    async def test_ws_connections(self):
+        before = self.sample('tea_store_ws_connections', consumer='products') or 0
+        communicator = WebsocketCommunicator(ProductConsumer.as_asgi(), '/ws/products/')
+        await communicator.connect()
+        self.assertEqual(self.sample('tea_store_ws_connections', consumer='products'), before + 1)
+        await communicator.disconnect()
+        self.assertEqual(self.sample('tea_store_ws_connections', consumer='products'), before)
+
+    def test_group_send_latency(self):
+        before = sum(sum(value[:-1]) for value in metrics.collect()['tea_store_group_send_duration_seconds'].values())
+        dispatcher = ProductEventDispatcher(debounce=0)
+        dispatcher.publish([protocol.deleted_op(1, {'id': 1, 'author': 1, 'product_price': 1.0})])
+        async_to_sync(dispatcher.flush)()
+        after = sum(sum(value[:-1]) for value in metrics.collect()['tea_store_group_send_duration_seconds'].values())
+        self.assertEqual(after - before, 4) # Общая группа + карточка, автор, корзина цены
+
+
+class ServerTimingTests(APITestCase):
+    """
+    Тесты разбивки времени запроса (Server-Timing).
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        CartItem.objects.bulk_create([CartItem(product_name=f'Чай {i}', product_price=i, product_quantity=1, author=self.user) for i in range(3)])
+        self.client.force_authenticate(user=self.user)
+        cache = get_response_cache()
+        if cache is not None: # bulk_create не меняет версию каталога, ответ мог остаться от другого теста
+            cache.clear()
+
+    def parse(self, header):
+        result = {}
+        for part in header.split(', '):
+            name, *params = part.split(';')
+            result[name] = dict(param.split('=', 1) for param in params)
+        return result
+
+    def test_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cartitem-list'))
+        timings = self.parse(response['Server-Timing'])
+        self.assertEqual(set(timings), {'db', 'auth', 'serialize', 'render', 'total'})
+        self.assertEqual(timings['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreater(float(timings['total']['dur']), 0)
+
+    @override_settings(SERVER_TIMING={'HEADER': False})
+    def test_header_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('cartitem-list')))
+
+    @override_settings(SERVER_TIMING={'QUERY_BUDGET': 0})
+    def test_query_budget(self):
+        with self.assertLogs('tea_store.timing', 'WARNING'), self.assertLogs('tea_store.requests', 'INFO') as logs:
+            self.client.get(reverse('cartitem-list'))
+        record = logs.records[0].request_log
+        self.assertEqual(record['query_budget'], 0)
+        self.assertGreater(record['db_queries'], 0)
+        self.assertIn('serialize_ms', record)
+
+    def test_execute_wrapper_is_not_displaced(self):
+        # Обёртка timing ставится при первом запросе потока - внутри чужого connection.execute_wrapper()
+        if timing.query_wrapper in connection.execute_wrappers:
+            connection.execute_wrappers.remove(timing.query_wrapper)
+        counter = benchmarks.QueryCounter()
+        with connection.execute_wrapper(counter):
+            self.client.get(reverse('cartitem-list'))
+        self.assertGreater(counter.count, 0)
+        self.assertNotIn(counter, connection.execute_wrappers)
+        self.assertIn(timing.query_wrapper, connection.execute_wrappers)
+
+    def test_async_get_response(self):
+        async def get_response(request):
+            with timing.span('render'):
+                pass
+            return HttpResponse()
+
+        middleware = ServerTimingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/api/'))
+        self.assertIn('render', self.parse(response['Server-Timing']))
+        self.assertIsNone(timing.current())
+
+
+class ProfilingTests(APITestCase):
+    """
+    Тесты профилирования запроса по требованию.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.staff = get_user_model().objects.create_user(username='staff', password='testpassword', is_staff=True)
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+
+    def profiling_settings(self, **options):
+        return override_settings(PROFILING={'ENABLED': True, 'DIR': self.directory, **options})
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        with self.profiling_settings():
+            response = self.client.get(reverse('cartitem-list'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile_id = response[profiling.RESPONSE_HEADER]
+        [meta] = profiling.list_profiles(self.directory)
+        self.assertEqual((meta['id'], meta['status'], meta['path']), (profile_id, 200, reverse('cartitem-list')))
+
+        output = io.StringIO()
+        call_command('profiles', profile_id, dir=self.directory, limit=5, stdout=output)
+        self.assertIn('function calls', output.getvalue())
+        output = io.StringIO()
+        call_command('profiles', dir=self.directory, stdout=output)
+        self.assertIn(profile_id, output.getvalue())
+
+    def test_not_profiled(self):
+        self.client.force_login(self.user)
+        with self.profiling_settings():
+            response = self.client.get(reverse('cartitem-list'), {'_profile': '1'}) # Не staff
+        self.assertNotIn(profiling.RESPONSE_HEADER, response)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('cartitem-list'), HTTP_X_PROFILE='1') # Выключено настройкой
+        self.assertNotIn(profiling.RESPONSE_HEADER, response)
+        self.assertEqual(profiling.list_profiles(self.directory), [])
+
+    def test_rotation(self):
+        self.client.force_login(self.staff)
+        with self.profiling_settings(MAX_BYTES=1):
+            ids = [self.client.get(reverse('cartitem-list'), HTTP_X_PROFILE='1')[profiling.RESPONSE_HEADER] for _ in range(3)]
+        self.assertEqual([meta['id'] for meta in profiling.list_profiles(self.directory)], ids[-1:]) # Остался только последний
+
+
+class BenchmarkToolsTests(APITestCase):
+    """
+    Тесты генератора каталога и сравнения результатов бенчмарков.
+    """
+
+    def test_generate_catalog_command(self):
+        call_command('generate_catalog', users=3, items=25, batch=10, stdout=io.StringIO())
+        self.assertEqual(get_user_model().objects.filter(username__startswith='bench_user').count(), 3)
+        self.assertEqual(CartItem.objects.count(), 25)
+        self.assertEqual(CartItem.objects.filter(product_name__icontains='№').count(), 25)
+
+    def test_compare(self):
+        previous = {'list': {'p50_ms': 10.0, 'rps': 100.0}, 'removed': {'p50_ms': 1.0}}
+        current = {'list': {'p50_ms': 8.0, 'rps': 125.0}, 'added': {'p50_ms': 1.0}}
+        self.assertEqual(benchmarks.compare(previous, current), {'list': {'p50_ms': (10.0, 8.0, -20.0), 'rps': (100.0, 125.0, 25.0)}})
+
+    def test_scenario_result(self):
+        result = benchmarks.scenario_result([0.01, 0.02, 0.03], queries=9)
+        self.assertEqual((result['rps'], result['queries_per_request'], result['p50_ms']), (50.0, 3.0, 20.0))
+
+
+@override_settings(CARTITEMS_RESPONSE_CACHE=None)
+class CartItemFastReadTests(APITestCase):
+    """
+    Быстрое чтение (.values() + карта полей) должно отдавать те же байты, что и CartItemSerializer с JSONRenderer.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        names = ['Улун', 'Пуэр "Шу"', 'Tea Line', 'Сенча <b>', 'Матча', 'Ассам', 'Пуэр жасминовый']
+        prices = [1, 2.5, 0.1, 1e16, 100, 99.99, 3]
+        CartItem.objects.bulk_create([
+            CartItem(product_name=name, product_price=price, product_quantity=i + 1, author=self.user)
+            for i, (name, price) in enumerate(zip(names, prices))
+        ])
+
+    def assertSameBytes(self, url, params=None):
+        with override_settings(CARTITEMS_FAST_READ=False):
+            expected = self.client.get(url, params)
+        actual = self.client.get(url, params)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.content)
+        return actual
+
+    def test_list_matches_serializer(self):
+        url = reverse('cartitem-list')
+        for params in [
+            None,
+            {'page': 2, 'page_size': 3},
+            {'ordering': '-product_price'},
+            {'product_price__gte': 2, 'product_price__lte': 100},
+            {'search': 'пуэр'},
+            {'search': 'пуэр', 'pagination': 'cursor', 'page_size': 1},
+            {'pagination': 'cursor', 'page_size': 2, 'ordering': 'product_name'},
+        ]:
+            with self.subTest(params=params):
+                self.assertSameBytes(url, params)
+
+    def test_cursor_pages_match_serializer(self):
+        response = self.assertSameBytes(reverse('cartitem-list'), {'pagination': 'cursor', 'page_size': 2, 'ordering': '-product_price'})
+        next_url = response.json()['next']
+        while next_url:
+            response = self.assertSameBytes(next_url)
+            next_url = response.json()['next']
+
+    def test_retrieve_matches_serializer(self):
+        for item in CartItem.objects.all():
+            self.assertSameBytes(reverse('cartitem-detail', args=[item.id]))
+        self.assertSameBytes(reverse('cartitem-detail', args=[10 ** 6])) # 404
+
+    def test_fast_path_skips_model_instances(self):
+        with mock.patch.object(CartItem, 'from_db', side_effect=AssertionError('экземпляры модели не нужны')):
+            response = self.client.get(reverse('cartitem-list'), {'page_size': 100})
+        self.assertEqual(len(response.json()['results']), 7)
+
+    def test_unsupported_serializer_falls_back(self):
+        class Serializer(CartItemSerializer):
+            title = serializers.SerializerMethodField()
+
+            def get_title(self, obj):
+                return obj.product_name.upper()
+
+        self.assertIsNone(FieldMap.for_serializer(Serializer))
+        self.assertEqual(
+            [name for name, _, _ in FieldMap.for_serializer(CartItemSerializer).fields],
+            list(CartItemSerializer(CartItem.objects.first()).data),
+        )
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'name': 'Tea  "Улун"', 'price': Decimal('1.10'), 'at': datetime(2024, 1, 2, 3, 4, 5),
+            'items': [1, 2.5, None, True],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'), JSONRenderer().render(data, 'application/json; indent=2')
+        )
+
+
+@override_settings(CARTITEMS_RESPONSE_CACHE=None)
+class CartItemSparseFieldsTests(APITestCase):
+    """
+    ?fields=/?exclude= урезают и ответ, и список колонок в SQL - на обычном и на быстром пути.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='testuser', password='testpassword')
+        CartItem.objects.bulk_create([
+            CartItem(product_name=f'Улун {i}', product_price=i * 10, product_quantity=i, author=self.user) for i in range(1, 6)
+        ])
+
+    def get(self, url, params):
+        "Ответ и SQL выборки карточек для обоих путей чтения"
+        results = []
+        for fast_read in (True, False):
+            with override_settings(CARTITEMS_FAST_READ=fast_read), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            sql = [query['sql'] for query in queries if 'FROM "api_cartitem"' in query['sql'] and 'COUNT(' not in query['sql']]
+            results.append((response, sql[-1] if sql else ''))
+        return results
+
+    def test_fields_trim_response_and_columns(self):
+        for response, sql in self.get(reverse('cartitem-list'), {'fields': 'product_price,id'}):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(list(response.json()['results'][0]), ['id', 'product_price']) # Порядок полей - как в сериализаторе
+            self.assertIn('"product_price"', sql)
+            self.assertNotIn('"product_name"', sql)
+            self.assertNotIn('"author_id"', sql)
+
+    def test_exclude(self):
+        for response, sql in self.get(reverse('cartitem-list'), {'exclude': 'author,product_quantity'}):
+            self.assertEqual(list(response.json()['results'][0]), ['id', 'product_name', 'product_price'])
+            self.assertNotIn('"product_quantity"', sql)
+
+    def test_retrieve(self):
+        item = CartItem.objects.first()
+        for response, sql in self.get(reverse('cartitem-detail', args=[item.id]), {'fields': 'product_name'}):
+            self.assertEqual(response.json(), {'product_name': item.product_name})
+            self.assertNotIn('"product_price"', sql)
+
+    def test_cursor_pagination_with_sparse_fields(self):
+        "Колонки сортировки читаются, даже если их нет в ответе: по ним строится курсор"
+        for fast_read in (True, False):
+            with self.subTest(fast_read=fast_read), override_settings(CARTITEMS_FAST_READ=fast_read):
+                names, url = [], reverse('cartitem-list')
+                params = {'pagination': 'cursor', 'page_size': 2, 'ordering': '-product_price', 'fields': 'product_name'}
+                while url:
+                    data = self.client.get(url, params).json()
+                    names += [row['product_name'] for row in data['results']]
+                    url, params = data['next'], None
+                self.assertEqual(names, [f'Улун {i}' for i in range(5, 0, -1)])
+
+    def test_invalid_fields(self):
+        url = reverse('cartitem-list')
+        response = self.client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('password', response.json()['fields'][0])
+        response = self.client.get(url, {'fields': 'id', 'exclude': 'id'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_write_ignores_fields(self):
+        self.client.force_authenticate(user=self.user)
+        item = CartItem.objects.first()
+        response = self.client.patch(reverse('cartitem-detail', args=[item.id]) + '?fields=id', {'product_price': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('product_name', response.json())
+
+    def test_schema_documents_parameters(self):
+        response = self.client.get(reverse('schema'), {'format': 'json'})
+        operation = response.json()['paths']['/api/cartitems/']['get']
+        self.assertTrue({'fields', 'exclude'} <= {parameter['name'] for parameter in operation['parameters']})
+
+
+class CartSummaryTests(APITestCase):
+    """
+    Итоги корзин меняются на дельту при каждой записи карточки и всегда совпадают с пересчётом с нуля.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other = User.objects.create_user(username='otheruser', password='otherpassword')
+        self.client.force_authenticate(user=self.user)
+
+    def assertSummary(self, user, expected):
+        self.assertEqual(summary.drift(), {})
+        row = CartSummary.objects.filter(author=user).values_list('item_count', 'total_quantity', 'total_value').first()
+        if expected is None:
+            self.assertIn(row, [None, (0, 0, 0)])
+        else:
+            self.assertEqual(row[:2], expected[:2])
+            self.assertAlmostEqual(row[2], expected[2])
+
+    def test_save_and_delete_apply_deltas(self):
+        item = CartItem.objects.create(product_name='Улун', product_price=10.5, product_quantity=2, author=self.user)
+        CartItem.objects.create(product_name='Пуэр', product_price=3, product_quantity=1, author=self.user)
+        self.assertSummary(self.user, (2, 3, 24))
+
+        with CaptureQueriesContext(connection) as queries:
+            item.product_quantity = 4
+            item.save()
+        self.assertEqual(len([query for query in queries if 'api_cartsummary' in query['sql']]), 1) # Одна UPDATE, без пересчёта
+        self.assertSummary(self.user, (2, 5, 45))
+
+        item.author = self.other
+        item.save()
+        self.assertSummary(self.user, (1, 1, 3))
+        self.assertSummary(self.other, (1, 4, 42))
+
+        item.delete()
+        self.assertSummary(self.other, None)
+
+    def test_rollback_keeps_summary(self):
+        CartItem.objects.create(product_name='Улун', product_price=10, product_quantity=1, author=self.user)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            CartItem.objects.create(product_name='Пуэр', product_price=5, product_quantity=1, author=self.user)
+            raise RuntimeError
+        self.assertSummary(self.user, (1, 1, 10))
+
+    def test_bulk_endpoints(self):
+        url = reverse('cartitem-bulk')
+        created = self.client.post(url, [
+            {'product_name': 'Улун', 'product_price': 10, 'product_quantity': 2},
+            {'product_name': 'Пуэр', 'product_price': 5, 'product_quantity': 1},
+        ], format='json').json()
+        self.assertSummary(self.user, (2, 3, 25))
+
+        self.client.patch(url, [{'id': created[0]['id'], 'product_price': 1}], format='json')
+        self.assertSummary(self.user, (2, 3, 7))
+
+        self.client.delete(url, [created[1]['id']], format='json')
+        self.assertSummary(self.user, (1, 2, 2))
+
+    def test_cascade_delete_of_author(self):
+        CartItem.objects.create(product_name='Улун', product_price=10, product_quantity=1, author=self.other)
+        self.other.delete()
+        self.assertFalse(CartSummary.objects.exists())
+
+    def test_summary_endpoint(self):
+        CartItem.objects.create(product_name='Улун', product_price=10, product_quantity=2, author=self.user)
+        CartItem.objects.create(product_name='Пуэр', product_price=1.5, product_quantity=2, author=self.other)
+        url = reverse('cartitem-summary')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'author': self.user.id, 'item_count': 1, 'total_quantity': 2, 'total_value': 20.0},
+            {'author': self.other.id, 'item_count': 1, 'total_quantity': 2, 'total_value': 3.0},
+        ])
+        self.assertEqual([row['author'] for row in self.client.get(url, {'author': self.other.id}).json()], [self.other.id])
+        self.assertEqual(self.client.get(url, {'author': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command_detects_and_fixes_drift(self):
+        CartItem.objects.create(product_name='Улун', product_price=10, product_quantity=2, author=self.user)
+        CartItem.objects.bulk_create([CartItem(product_name='Пуэр', product_price=1, product_quantity=1, author=self.other)]) # Мимо сигналов
+        with self.assertRaises(CommandError):
+            call_command('cart_summary', '--check', stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('cart_summary', stdout=out)
+        self.assertIn('Расхождений: 1', out.getvalue())
+        self.assertSummary(self.other, (1, 1, 1))
+        call_command('cart_summary', '--check', stdout=io.StringIO())
+
+
+class CartItemExportTests(APITestCase):
+    """
+    /api/cartitems/export/ отдаёт все карточки потоком (NDJSON/CSV) и только администратору.
+    """
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.admin = User.objects.create_superuser(username='admin', password='adminpassword')
+        CartItem.objects.bulk_create([
+            CartItem(product_name=f'Улун "{i}", №{i}', product_price=i + 0.5, product_quantity=i, author=self.user) for i in range(1, 8)
+        ])
+        self.url = reverse('cartitem-export')
+
+    def test_requires_admin(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(EXPORTS={'CHUNK_SIZE': 3})
+    def test_ndjson_is_streamed_in_chunks(self):
+        self.client.force_authenticate(user=self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertFalse([query for query in queries if 'api_cartitem' in query['sql']]) # Строки читаются уже при отдаче
+
+        with mock.patch.object(CartItem, 'from_db', side_effect=AssertionError('экземпляры модели не нужны')):
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3) # 7 строк по 3
+        rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual(rows, list(CartItem.objects.order_by('id').values(*changelog.SNAPSHOT_FIELDS)))
+
+    def test_csv_with_filters(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(self.url, {'output': 'csv', 'product_price__gte': 5, 'ordering': '-product_price'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="cartitems.csv"')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], changelog.SNAPSHOT_FIELDS)
+        self.assertEqual([row[2] for row in rows[1:]], [f'Улун "{i}", №{i}' for i in (7, 6, 5)])
+
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_asgi_response_is_async_iterator(self):
+        "Под ASGI синхронный итератор Django собрал бы в список целиком"
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(self.url)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(body.decode().splitlines()), 7)
+
+
+class CatalogImportTests(APITestCase):
+    """
+    manage.py import_catalog: проверка правилами сериализатора, upsert по id пачками, контрольная точка.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='supplier', password='testpassword')
+        self.item = CartItem.objects.create(product_name='Улун', product_price=10, product_quantity=1, author=self.user)
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def csv_file(self):
+        return self.write_file('catalog.csv', '\n'.join([
+            'id,product_name,product_price,product_quantity',
+            f'{self.item.id},Улун молочный,12.5,2', # Обновление существующей карточки
+            ',Пуэр,30,', # Новая карточка, количество по умолчанию
+            ',,5,1', # Нет названия
+            ',Сенча,дорого,1', # Цена не число
+            ',Матча,100,-1', # Количество меньше нуля
+            ',Ассам,7,3',
+        ]) + '\n')
+
+    def test_csv_import(self):
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch('api.signals.product_saved') as product_saved, mock.patch('api.importer.publish_catalog_changed') as publish:
+            call_command('import_catalog', self.csv_file(), '--author', 'supplier', '--batch', '2', stdout=out, stderr=err)
+        product_saved.assert_not_called()
+        publish.assert_called_once_with({'records': 6, 'created': 2, 'updated': 1, 'invalid': 3}) # Одно событие на весь импорт
+        self.assertIn('создано 2, обновлено 1, отклонено 3', out.getvalue())
+        self.assertEqual([line.split(':')[0] for line in err.getvalue().splitlines()], ['Запись 3', 'Запись 4', 'Запись 5'])
+
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.product_name, self.item.product_price, self.item.product_quantity), ('Улун молочный', 12.5, 2))
+        self.assertEqual(CartItem.objects.get(product_name='Пуэр').product_quantity, 1)
+        self.assertEqual(CartItem.objects.count(), 3)
+        self.assertEqual(summary.drift(), {}) # Итоги корзин изменены на дельту в тех же транзакциях
+        self.assertFalse(ProductChange.objects.exists()) # Журнал не покрывает импорт - клиенты с ?since= получат снимок
+        self.assertFalse(CatalogImport.objects.exists())
+
+    def test_jsonl_with_author_column(self):
+        other = get_user_model().objects.create_user(username='other', password='testpassword')
+        path = self.write_file('catalog.jsonl', '\n'.join([
+            json.dumps({'product_name': 'Габа', 'product_price': 3, 'product_quantity': 2, 'author': other.id}),
+            'не json',
+            json.dumps({'product_name': 'Кудин', 'product_price': 3, 'product_quantity': 2, 'author': 10 ** 6}),
+            json.dumps({'product_name': 'Ходзича', 'product_price': 3, 'product_quantity': 2}), # Нет автора и нет --author
+        ]))
+        errors = []
+        stats = CatalogImporter(report_error=lambda number, error: errors.append(number)).run(path)
+        self.assertEqual(stats, {'records': 4, 'created': 1, 'updated': 0, 'invalid': 3})
+        self.assertEqual(errors, [2, 3, 4])
+        self.assertEqual(CartItem.objects.get(product_name='Габа').author, other)
+
+    def test_resume_from_checkpoint(self):
+        path = self.csv_file()
+        importer = CatalogImporter(batch_size=2, default_author=self.user.id)
+        write, calls = importer.write, []
+
+        def fail_on_second_batch(items):
+            calls.append(items)
+            if len(calls) == 2:
+                raise RuntimeError('сбой')
+            return write(items)
+
+        with mock.patch.object(importer, 'write', side_effect=fail_on_second_batch), self.assertRaises(RuntimeError):
+            importer.run(path)
+        self.assertEqual(CatalogImport.objects.get().stats['records'], 2) # Первая пачка закоммичена
+
+        stats = CatalogImporter(batch_size=2, default_author=self.user.id).run(path)
+        self.assertEqual(stats, {'records': 6, 'created': 2, 'updated': 1, 'invalid': 3})
+        self.assertEqual(CartItem.objects.count(), 3) # Первая пачка не записана повторно
+
+    def test_checkpoint_is_committed_with_the_batch(self):
+        """Сбой после записи пачки, но до коммита откатывает и карточки, и контрольную точку: без повторов при продолжении."""
+        path = self.write_file('new.csv', 'product_name,product_price\nПуэр,1\nСенча,2\nМатча,3\n')
+        with mock.patch('api.importer.save_checkpoint', side_effect=RuntimeError('сбой')), self.assertRaises(RuntimeError):
+            CatalogImporter(batch_size=2, default_author=self.user.id).run(path)
+        self.assertFalse(CartItem.objects.filter(product_name='Пуэр').exists())
+
+        stats = CatalogImporter(batch_size=2, default_author=self.user.id).run(path)
+        self.assertEqual(stats['created'], 3)
+        self.assertEqual(CartItem.objects.filter(product_name__in=['Пуэр', 'Сенча', 'Матча']).count(), 3)
+
+    def test_checkpoint_of_other_file_is_rejected(self):
+        path = self.csv_file()
+        CatalogImport.objects.create(source=os.path.abspath(path), signature={'file': 'other.csv'}, stats={})
+        with self.assertRaises(CatalogImportError):
+            CatalogImporter(default_author=self.user.id).run(path)
+        self.assertEqual(CatalogImporter(default_author=self.user.id).run(path, restart=True)['created'], 2)
+
+
+class SQLiteProductionBackendTests(unittest.TestCase):
+    """
+    Production-режим SQLite: прагмы на каждом соединении и очередь писателей (tea_store/sqlite_backend).
+    Отдельная база в файле под своим псевдонимом, без тестовой базы default.
+    """
+    alias = 'sqlite_production_test'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config = production_database(os.path.join(directory, 'db.sqlite3'), write_lock=True, busy_timeout=5)
+        connections.settings[self.alias] = connections.configure_settings({'default': {}, self.alias: config})[self.alias]
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(self.close)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE events (name TEXT)')
+
+    def close(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+
+    def test_pragmas_on_new_connection(self):
+        with connections[self.alias].cursor() as cursor:
+            values = {}
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size'):
+                cursor.execute(f'PRAGMA {pragma}')
+                values[pragma] = cursor.fetchone()[0]
+        self.assertEqual(values, {
+            'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000,
+            'cache_size': PRAGMAS['cache_size'], 'mmap_size': PRAGMAS['mmap_size'],
+        })
+        self.assertEqual(connections[self.alias].transaction_mode, 'IMMEDIATE')
+
+    def test_writers_wait_in_queue(self):
+        "Вторая транзакция начинается только после коммита первой; запись вне транзакции тоже ждёт очередь"
+        events, started = [], threading.Event()
+
+        def write(name):
+            try:
+                with transaction.atomic(using=self.alias):
+                    events.append(f'{name} begin')
+                    started.set()
+                    time.sleep(0.2)
+                    with connections[self.alias].cursor() as cursor:
+                        cursor.execute('INSERT INTO events VALUES (%s)', [name])
+                    events.append(f'{name} commit')
+            finally:
+                connections[self.alias].close()
+
+        first = threading.Thread(target=write, args=['first'])
+        first.start()
+        started.wait()
+        second = threading.Thread(target=write, args=['second'])
+        second.start()
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('INSERT INTO events VALUES (%s)', ['autocommit'])
+        events.append('autocommit')
+        self.assertFalse(connections[self.alias].write_lock_held)
+        first.join()
+        second.join()
+        self.assertEqual(events[:2], ['first begin', 'first commit'])
+        self.assertEqual(sorted(events[2:]), ['autocommit', 'second begin', 'second commit'])
+        # Запись вне транзакции не вклинивается во вторую транзакцию
+        self.assertNotEqual(events.index('second commit') - events.index('second begin'), 2)
+
+    def test_lock_is_released_on_rollback(self):
+        with self.assertRaises(RuntimeError), transaction.atomic(using=self.alias):
+            raise RuntimeError
+        self.assertFalse(connections[self.alias].write_lock_held)
+        self.assertFalse(connections[self.alias].write_lock.locked())
+
+
+class ReadReplicaRouterTests(unittest.TestCase):
+    "Роутер чтения из реплик (tea_store/routers.py) и копирование базы в реплику (tea_store/replication.py)"
+    alias = 'replica_test'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.source_path = os.path.join(directory, 'db.sqlite3')
+        self.replica_path = os.path.join(directory, 'db.replica.sqlite3')
+        with closing(sqlite3.connect(self.source_path)) as source:
+            source.executescript('PRAGMA journal_mode=WAL; CREATE TABLE items (name TEXT); INSERT INTO items VALUES ("first");')
+        config = replica_database(self.replica_path, busy_timeout=1)
+        connections.settings[self.alias] = connections.configure_settings({'default': {}, self.alias: config})[self.alias]
+        self.addCleanup(connections.settings.pop, self.alias)
+        self.addCleanup(self.close)
+        self.addCleanup(routers._unavailable.clear)
+        _, token = routers.activate()
+        self.addCleanup(routers.deactivate, token)
+        self.router = routers.ReadReplicaRouter()
+
+    def close(self):
+        connections[self.alias].close()
+        del connections[self.alias]
+
+    def read_replica(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('SELECT name FROM items ORDER BY rowid')
+            return [name for name, in cursor.fetchall()]
+
+    def test_replicate_updates_open_connections(self):
+        replicate(self.source_path, self.replica_path)
+        self.assertEqual(self.read_replica(), ['first'])
+        with closing(sqlite3.connect(self.source_path)) as source, source:
+            source.execute('INSERT INTO items VALUES ("second")')
+        replicate(self.source_path, self.replica_path)
+        self.assertEqual(self.read_replica(), ['first', 'second']) # То же соединение видит новую копию
+        with self.assertRaises(OperationalError), connections[self.alias].cursor() as cursor:
+            cursor.execute('INSERT INTO items VALUES ("third")') # Реплика только на чтение
+
+    def test_reads_go_to_replica_until_write(self):
+        replicate(self.source_path, self.replica_path)
+        with override_settings(READ_REPLICAS={'ALIASES': [self.alias]}):
+            self.assertEqual(self.router.db_for_read(CartItem), self.alias)
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(CartItem), 'default')
+            self.assertEqual(self.router.db_for_write(CartItem), 'default')
+            self.assertEqual(self.router.db_for_read(CartItem), 'default')
+            self.assertFalse(self.router.allow_migrate(self.alias, 'api'))
+
+    def test_missing_replica_falls_back_to_primary(self):
+        with override_settings(READ_REPLICAS={'ALIASES': [self.alias, 'not_configured']}):
+            with self.assertLogs('tea_store.routers', 'WARNING') as logs:
+                self.assertEqual(self.router.db_for_read(CartItem), 'default')
+            self.assertEqual(len(logs.output), 2)
+            self.assertFalse(os.path.exists(self.replica_path)) # mode=ro не создаёт пустой файл
+            replicate(self.source_path, self.replica_path)
+            self.assertEqual(self.router.db_for_read(CartItem), 'default') # До RETRY_AFTER реплику не пробуем
+            del routers._unavailable[self.alias] # Прошло RETRY_AFTER
+            self.assertEqual(self.router.db_for_read(CartItem), self.alias)
+
+    def test_middleware_sets_sticky_cookie_after_write(self):
+        def view(request):
+            pinned_before = routers.is_pinned()
+            if request.GET.get('write'):
+                self.router.db_for_write(CartItem)
+            return HttpResponse(f'{pinned_before} {routers.is_pinned()}')
+
+        middleware = ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+        with override_settings(READ_REPLICAS={'ALIASES': [self.alias], 'STICKY_SECONDS': 7}):
+            response = middleware(factory.get('/'))
+            self.assertEqual(response.content, b'False False')
+            self.assertNotIn('use_primary', response.cookies)
+
+            response = middleware(factory.get('/', {'write': 1}))
+            self.assertEqual(response.content, b'False True')
+            self.assertEqual(response.cookies['use_primary']['max-age'], 7)
+
+            self.assertEqual(middleware(factory.post('/')).content, b'True True')
+            request = factory.get('/')
+            request.COOKIES['use_primary'] = '1'
+            self.assertEqual(middleware(request).content, b'True True')
+        self.assertFalse(routers.is_pinned()) # Состояние запроса не утекает наружу
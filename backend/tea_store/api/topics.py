@@ -0,0 +1,174 @@
+'''
+Подписки ws/products/ на темы вместо одной общей группы.
+
+Клиент после подключения присылает:
+    {"subscribe": {"author": 5, "products": [1, 2], "product_price__gte": 100, "product_price__lte": 500}}
+    {"unsubscribe": {...то же самое...}}
+author может быть "me" (текущий пользователь сессии). Диапазон цены задаётся как в CartItemFilter.
+
+Индекс подписок - это группы channel layer (он и так хранит группа -> каналы для всех процессов):
+    products.author.<id>     - карточки автора
+    products.item.<id>       - конкретная карточка
+    products.price.<bucket>  - карточки с ценой в корзине [bucket * PRICE_BUCKET, (bucket + 1) * PRICE_BUCKET)
+Диспетчер для каждой операции считает её группы (op_groups) и отправляет её только туда, поэтому выбор получателей
+не перебирает клиентов. Корзины цены крупнее диапазонов, поэтому консьюмер дополнительно проверяет Subscription.matches.
+Слишком широкий или открытый диапазон цены обслуживается через общую группу с фильтрацией на стороне консьюмера.
+'''
+import math
+
+from django.conf import settings
+
+AUTHOR_GROUP = 'products.author.{}'
+PRODUCT_GROUP = 'products.item.{}'
+PRICE_GROUP = 'products.price.{}'
+MAX_PRODUCTS = 500 # Сколько отдельных карточек можно отслеживать одним соединением
+
+
+def price_bucket_size():
+    return getattr(settings, 'PRODUCT_EVENTS', {}).get('PRICE_BUCKET', 100)
+
+
+def max_price_buckets():
+    return getattr(settings, 'PRODUCT_EVENTS', {}).get('MAX_PRICE_BUCKETS', 50)
+
+
+def price_bucket(price):
+    return math.floor(price / price_bucket_size())
+
+
+def op_groups(op):
+    "Группы, в которые нужно отправить операцию (по её текущему и, для updated, прежнему состоянию)"
+    data = op.get('data') or {}
+    groups = {PRODUCT_GROUP.format(op['id'])}
+    if data.get('author') is not None:
+        groups.add(AUTHOR_GROUP.format(data['author']))
+    for price in (data.get('product_price'), (op.get('previous') or {}).get('product_price')):
+        if price is not None:
+            groups.add(PRICE_GROUP.format(price_bucket(price)))
+    return groups
+
+
+class SubscriptionError(ValueError):
+    pass
+
+
+class Subscription:
+    "Подписки одного соединения"
+
+    def __init__(self):
+        self.authors = set()
+        self.products = set()
+        self.price_ranges = set() # (gte, lte), любая граница может быть None
+
+    def __bool__(self):
+        return bool(self.authors or self.products or self.price_ranges)
+
+    def as_dict(self):
+        return {
+            'authors': sorted(self.authors),
+            'products': sorted(self.products),
+            'prices': [{'product_price__gte': gte, 'product_price__lte': lte} for gte, lte in sorted(self.price_ranges, key=str)],
+        }
+
+    # --- Разбор запроса клиента ---
+
+    @staticmethod
+    def parse(spec, user=None):
+        "Проверяет запрос подписки и возвращает (авторы, карточки, диапазон цены или None)"
+        if not isinstance(spec, dict) or not spec:
+            raise SubscriptionError('Ожидается объект с author, products или product_price__gte/product_price__lte.')
+
+        authors = set()
+        if 'author' in spec:
+            author = spec['author']
+            if author == 'me':
+                if user is None or not user.is_authenticated:
+                    raise SubscriptionError('Для author="me" нужна авторизация.')
+                author = user.pk
+            authors.add(Subscription._parse_id(author, 'author'))
+
+        products = set()
+        if 'products' in spec:
+            if not isinstance(spec['products'], list):
+                raise SubscriptionError('products должен быть списком id.')
+            products = {Subscription._parse_id(pk, 'products') for pk in spec['products']}
+
+        price_range = None
+        if 'product_price__gte' in spec or 'product_price__lte' in spec:
+            gte = Subscription._parse_price(spec.get('product_price__gte'))
+            lte = Subscription._parse_price(spec.get('product_price__lte'))
+            if gte is not None and lte is not None and gte > lte:
+                raise SubscriptionError('product_price__gte больше product_price__lte.')
+            price_range = (gte, lte)
+
+        if not (authors or products or price_range):
+            raise SubscriptionError('Не указано ни одной темы.')
+        return authors, products, price_range
+
+    @staticmethod
+    def _parse_id(value, name):
+        if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+            raise SubscriptionError(f'{name}: ожидается положительный целочисленный id.')
+        return value
+
+    @staticmethod
+    def _parse_price(value):
+        if value is None:
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise SubscriptionError('Граница цены должна быть числом.')
+        return float(value)
+
+    # --- Изменение подписок ---
+
+    def add(self, spec, user=None):
+        authors, products, price_range = self.parse(spec, user)
+        if len(self.products | products) > MAX_PRODUCTS:
+            raise SubscriptionError(f'Можно отслеживать не больше {MAX_PRODUCTS} карточек.')
+        self.authors |= authors
+        self.products |= products
+        if price_range is not None:
+            self.price_ranges.add(price_range)
+
+    def remove(self, spec, user=None):
+        authors, products, price_range = self.parse(spec, user)
+        self.authors -= authors
+        self.products -= products
+        self.price_ranges.discard(price_range)
+
+    # --- Группы и фильтрация ---
+
+    def price_groups(self):
+        "Группы корзин цены или None, если какой-то диапазон открыт или слишком широк (тогда нужна общая группа)"
+        groups = set()
+        for gte, lte in self.price_ranges:
+            if gte is None or lte is None:
+                return None
+            first, last = price_bucket(gte), price_bucket(lte)
+            if last - first + 1 > max_price_buckets():
+                return None
+            groups.update(PRICE_GROUP.format(bucket) for bucket in range(first, last + 1))
+        return groups
+
+    def groups(self):
+        "Группы channel layer для текущих подписок и признак, нужна ли ещё общая группа"
+        groups = {AUTHOR_GROUP.format(pk) for pk in self.authors} | {PRODUCT_GROUP.format(pk) for pk in self.products}
+        price_groups = self.price_groups()
+        if price_groups is not None:
+            groups |= price_groups
+        return groups, price_groups is None
+
+    def price_matches(self, price):
+        if price is None:
+            return False
+        return any(
+            (gte is None or price >= gte) and (lte is None or price <= lte)
+            for gte, lte in self.price_ranges
+        )
+
+    def matches(self, op):
+        data = op.get('data') or {}
+        if op['id'] in self.products or data.get('author') in self.authors:
+            return True
+        # Для updated подходит и прежняя цена: клиент должен узнать, что карточка ушла из его диапазона
+        return self.price_matches(data.get('product_price')) or self.price_matches((op.get('previous') or {}).get('product_price'))
@@ -1,24 +1,167 @@
 from django.shortcuts import render
+from django.db import transaction
+from django.utils import timezone
 
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions, filters, status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import CartItem
-from .serializer import CartItemSerializer
+from .models import CartItem, CartSummary
+from .serializer import CartItemSerializer, CartSummarySerializer
 from .permissions import IsOwnerOrReadOnly
 from .filters import CartItemFilter
+from .pagination import CartItemPagination
+from .search import FullTextSearchFilter
+from .cache import CachedResponseMixin, get_response_cache
+from .conditional import ConditionalResponseMixin
+from .signals import batch_changes, build_delete_op, build_update_op, invalidate_catalog, update_summary
+from .events import get_dispatcher
+from .protocol import created_op
+from .changelog import SNAPSHOT_FIELDS, record_changes
+from . import summary
+from .fast_read import FastReadMixin
+from .sparse import SCHEMA_PARAMETERS, SparseFieldsMixin
+from tea_store.exports import CONTENT_TYPES, FORMAT_PARAM, export_response
+from tea_store.timing import TimedViewMixin
+from users.wraps import drf_admin_required
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, extend_schema_view
 
-class CartItemViewSet(viewsets.ModelViewSet): # !! Как оказалось, CartViewSet нельзя, а CartItemViewSet - можно. Видимо, это связано с тем, что объект в моделе называется CartItem
+@extend_schema_view(list=extend_schema(parameters=SCHEMA_PARAMETERS), retrieve=extend_schema(parameters=SCHEMA_PARAMETERS)) # ?fields=/?exclude= в схеме OpenAPI
+class CartItemViewSet(TimedViewMixin, ConditionalResponseMixin, CachedResponseMixin, SparseFieldsMixin, FastReadMixin, viewsets.ModelViewSet): # !! Как оказалось, CartViewSet нельзя, а CartItemViewSet - можно. Видимо, это связано с тем, что объект в моделе называется CartItem
     "Представление для карточек товаров"
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
     permission_classes = [IsOwnerOrReadOnly | permissions.IsAdminUser] # Карточку может редактировать только владелец, смотреть могут все ИЛИ (|) админ может всё
 
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, filters.OrderingFilter] # Поиск через индекс FTS5 вместо LIKE '%...%'
 
     filterset_class = CartItemFilter # Фильтрация
-    search_fields = ['product_name'] # Поиск
+    search_fields = ['product_name'] # Поиск (используется как запасной вариант, если FTS5 недоступен)
     ordering_fields = ['product_name', 'product_price', 'product_quantity'] # Сортировка
+    pagination_class = CartItemPagination # ?page=N как раньше или ?pagination=cursor для keyset-пагинации без OFFSET
+    bulk_max_items = 1000 # Максимум карточек в одном bulk-запросе
 
     def perform_create(self, serializer): # Метод, который вызывается при создании
         serializer.save(author=self.request.user) # Записываем в поле author текущего аутентифицированного пользователя
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request): # Статистика кэша ответов (только для админа): попадания, промахи, вытеснения
+        cache = get_response_cache()
+        if cache is None:
+            return Response({'enabled': False})
+        return Response({'enabled': True, 'backend': type(cache).__name__, **cache.stats.as_dict()})
+
+    @extend_schema(
+        responses=CartSummarySerializer(many=True),
+        parameters=[OpenApiParameter('author', int, description='Только итоги этого автора')],
+    )
+    @action(detail=False, methods=['get'], url_path='summary')
+    def summary(self, request): # Итоги корзин по авторам: число карточек, количество товаров и стоимость (таблица api.CartSummary)
+        summaries = CartSummary.objects.filter(item_count__gt=0).order_by('author')
+        author = request.query_params.get('author')
+        if author is not None:
+            if not author.isdigit():
+                raise ValidationError({'author': ['Ожидается id пользователя.']})
+            summaries = summaries.filter(author_id=author)
+        return Response(CartSummarySerializer(summaries, many=True).data)
+
+    @extend_schema(parameters=[OpenApiParameter(FORMAT_PARAM, str, enum=list(CONTENT_TYPES))], responses={200: OpenApiTypes.BINARY})
+    @action(detail=False, methods=['get'], url_path='export')
+    @drf_admin_required
+    def export(self, request): # Все карточки потоком (NDJSON/CSV) с теми же фильтрами, поиском и сортировкой, что и список
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.query.order_by:
+            queryset = queryset.order_by('id')
+        return export_response(request, queryset, SNAPSHOT_FIELDS, 'cartitems')
+
+    # --- Пакетные операции: /api/cartitems/bulk/ (POST - создать, PATCH - изменить, DELETE - удалить) ---
+    # Всё в одной транзакции, права IsOwnerOrReadOnly проверяются для каждой карточки,
+    # после коммита пачка операций уходит в диспетчер событий, который разошлёт её подписчикам WebSocket одним сообщением.
+
+    def get_bulk_payload(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'detail': 'Ожидается непустой список.'})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({'detail': f'Не больше {self.bulk_max_items} элементов за один запрос.'})
+        return items
+
+    def get_bulk_objects(self, request, ids):
+        "Загружает карточки одним запросом и проверяет права на каждую"
+        try:
+            ids = [int(pk) for pk in ids]
+        except (TypeError, ValueError):
+            raise ValidationError({'detail': 'Каждый элемент должен содержать целочисленный id.'})
+        if len(set(ids)) != len(ids):
+            raise ValidationError({'detail': 'id в списке не должны повторяться.'})
+
+        objects = self.get_queryset().in_bulk(ids)
+        missing = [pk for pk in ids if pk not in objects]
+        if missing:
+            raise NotFound({'detail': 'Карточки не найдены.', 'missing': missing})
+        for pk in ids:
+            self.check_object_permissions(request, objects[pk])
+        return [objects[pk] for pk in ids]
+
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk')
+    def bulk_create(self, request):
+        serializer = self.get_serializer(data=self.get_bulk_payload(request), many=True)
+        serializer.is_valid(raise_exception=True)
+
+        objects = [CartItem(author=request.user, **item) for item in serializer.validated_data]
+        with transaction.atomic():
+            CartItem.objects.bulk_create(objects, batch_size=500)
+            update_summary(objects, created=True) # bulk_create не шлёт post_save
+            invalidate_catalog()
+            data = self.get_serializer(objects, many=True).data
+            ops = record_changes([created_op(item) for item in data])
+            transaction.on_commit(lambda: get_dispatcher().publish(ops))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request):
+        items = self.get_bulk_payload(request)
+        if not all(isinstance(item, dict) for item in items):
+            raise ValidationError({'detail': 'Каждый элемент должен быть объектом с полем id.'})
+        objects = self.get_bulk_objects(request, [item.get('id') for item in items])
+
+        serializers = [self.get_serializer(obj, data=item, partial=True) for obj, item in zip(objects, items)]
+        if not all([serializer.is_valid() for serializer in serializers]):
+            raise ValidationError([serializer.errors for serializer in serializers])
+
+        fields = {'updated_at'} # bulk_update не вызывает save(), поэтому auto_now проставляем сами
+        now = timezone.now()
+        for serializer in serializers:
+            for attr, value in serializer.validated_data.items():
+                setattr(serializer.instance, attr, value)
+                fields.add(attr)
+            serializer.instance.updated_at = now
+
+        with transaction.atomic():
+            CartItem.objects.bulk_update(objects, sorted(fields), batch_size=500)
+            invalidate_catalog()
+            data = self.get_serializer(objects, many=True).data
+            ops = [build_update_op(obj, item) for obj, item in zip(objects, data)]
+            update_summary(objects, created=False)
+            for obj in objects:
+                obj.reset_changed_fields()
+            ops = record_changes([op for op in ops if op is not None])
+            transaction.on_commit(lambda: get_dispatcher().publish(ops))
+        return Response(data)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        objects = self.get_bulk_objects(request, self.get_bulk_payload(request))
+        with transaction.atomic():
+            # Обычный delete() (каскады и сигналы на месте), но наши post_delete на каждую строку пропускаются:
+            # итоги корзин, журнал, версия каталога и рассылка - один раз на пачку, как у bulk_create/bulk_update
+            with batch_changes():
+                CartItem.objects.filter(pk__in=[obj.pk for obj in objects]).delete()
+            summary.apply(summary.add_items(summary.new_deltas(), objects, sign=-1))
+            invalidate_catalog()
+            ops = record_changes([build_delete_op(obj) for obj in objects])
+            transaction.on_commit(lambda: get_dispatcher().publish(ops))
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,285 @@
+'''
+Channel layer для нескольких воркеров на одном хосте без внешнего брокера (Redis).
+
+Сообщения и группы хранятся в общем файле SQLite в режиме WAL: любой процесс может сделать group_add/group_send,
+а каждый процесс одним фоновым опросчиком забирает сообщения для своих каналов и раскладывает их по локальным буферам.
+Подходит для нескольких Daphne/uvicorn-воркеров на одной машине; для нескольких машин нужен channels_redis.
+
+Пример:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'tea_store.channel_layers.SQLiteChannelLayer',
+            'CONFIG': {'path': BASE_DIR / 'channels.sqlite3', 'capacity': 100, 'expiry': 60},
+        },
+    }
+'''
+import asyncio
+import json
+import random
+import sqlite3
+import string
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS channel_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT NOT NULL,
+        body TEXT NOT NULL,
+        expires REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS channel_messages_channel_idx ON channel_messages (channel, id)',
+    '''CREATE TABLE IF NOT EXISTS channel_groups (
+        group_name TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        expires REAL NOT NULL,
+        PRIMARY KEY (group_name, channel)
+    )''',
+]
+
+
+class _LocalBuffer:
+    "Буфер сообщений одного локального канала (ограниченный, с истечением срока)"
+
+    def __init__(self, capacity):
+        self.messages = deque(maxlen=capacity) # При переполнении вытесняется самое старое
+        self.last_access = time.time()
+        self.waiting = False
+        self.event = None
+        self.event_loop = None
+
+    def pop(self, now):
+        while self.messages:
+            expires, message = self.messages.popleft()
+            if expires > now:
+                return message
+        return None
+
+    def get_event(self, loop):
+        if self.event is None or self.event_loop is not loop:
+            self.event = asyncio.Event()
+            self.event_loop = loop
+        return self.event
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path='channels.sqlite3', expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 poll_interval=0.005, max_poll_interval=0.05, batch_size=500, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.batch_size = batch_size
+        self.cleanup_interval = 1.0 # Как часто удалять из базы протухшие сообщения (секунды)
+        self._last_cleanup = 0.0
+        # Уникальный префикс процесса: все каналы вида specific.<prefix>!xxx читает опросчик этого процесса
+        self.client_prefix = ''.join(random.choices(string.ascii_letters, k=12))
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-channel-layer')
+        self._connection = None
+        self._buffers = {}
+        self._poller = None
+        self._poller_loop = None
+
+    # --- Работа с базой (всегда в отдельном потоке, чтобы не блокировать event loop) ---
+
+    def _db(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _insert(self, channels, message):
+        "Кладёт сообщение в несколько каналов одной транзакцией, пропуская переполненные. Возвращает число пропущенных."
+        db = self._db()
+        now = time.time()
+        body = json.dumps(message)
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            counts = {}
+            for start in range(0, len(channels), 500):
+                chunk = channels[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                counts.update(db.execute(
+                    f'SELECT channel, COUNT(*) FROM channel_messages WHERE channel IN ({placeholders}) AND expires > ? GROUP BY channel',
+                    [*chunk, now],
+                ).fetchall())
+            rows = [
+                (channel, body, now + self.expiry)
+                for channel in channels if counts.get(channel, 0) < self.get_capacity(channel)
+            ]
+            db.executemany('INSERT INTO channel_messages (channel, body, expires) VALUES (?, ?, ?)', rows)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return len(channels) - len(rows)
+
+    def _pop(self, channel_filter, params, limit):
+        "Забирает (и удаляет) до limit сообщений по условию на канал"
+        db = self._db()
+        now = time.time()
+        if now - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = now
+            db.execute('DELETE FROM channel_messages WHERE expires <= ?', [now])
+        # Сначала дешёвая проверка чтением (в WAL не блокирует писателей), и только если есть что забрать - берём блокировку записи
+        if db.execute(f'SELECT 1 FROM channel_messages WHERE {channel_filter} LIMIT 1', params).fetchone() is None:
+            return []
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            rows = db.execute(
+                f'SELECT id, channel, body, expires FROM channel_messages WHERE {channel_filter} ORDER BY id LIMIT ?',
+                [*params, limit],
+            ).fetchall()
+            if rows:
+                db.execute(f'DELETE FROM channel_messages WHERE id <= ? AND {channel_filter}', [rows[-1][0], *params])
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return [(channel, expires, json.loads(body)) for _, channel, body, expires in rows if expires > now]
+
+    def _group_channels(self, group):
+        db = self._db()
+        now = time.time()
+        db.execute('DELETE FROM channel_groups WHERE expires <= ?', [now])
+        return [row[0] for row in db.execute('SELECT channel FROM channel_groups WHERE group_name = ?', [group])]
+
+    def _group_add(self, group, channel):
+        self._db().execute(
+            'INSERT INTO channel_groups (group_name, channel, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (group_name, channel) DO UPDATE SET expires = excluded.expires',
+            [group, channel, time.time() + self.group_expiry],
+        )
+
+    def _group_discard(self, group, channel):
+        self._db().execute('DELETE FROM channel_groups WHERE group_name = ? AND channel = ?', [group, channel])
+
+    def _flush(self):
+        db = self._db()
+        db.execute('DELETE FROM channel_messages')
+        db.execute('DELETE FROM channel_groups')
+
+    # --- API channel layer ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        if await self._run(self._insert, [channel], message):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+
+        if '!' not in channel:
+            # Обычный (не процесс-локальный) канал: опрашиваем базу сами
+            delay = self.poll_interval
+            while True:
+                messages = await self._run(self._pop, 'channel = ?', [channel], 1)
+                if messages:
+                    return messages[0][2]
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+
+        self._ensure_poller(loop)
+        buffer = self._buffers.setdefault(channel, _LocalBuffer(self.get_capacity(channel)))
+        while True:
+            buffer.last_access = time.time()
+            message = buffer.pop(buffer.last_access)
+            if message is not None:
+                return message
+            event = buffer.get_event(loop)
+            event.clear()
+            buffer.waiting = True
+            try:
+                await event.wait()
+            finally:
+                buffer.waiting = False
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}{self.client_prefix}!' + ''.join(random.choices(string.ascii_letters, k=12))
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_discard, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        channels = await self._run(self._group_channels, group)
+        if channels:
+            await self._run(self._insert, channels, message) # Переполненные каналы в группе пропускаем, как channels_redis
+
+    async def flush(self):
+        self._buffers.clear()
+        await self._run(self._flush)
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    # --- Фоновый опросчик процесса ---
+
+    def _ensure_poller(self, loop):
+        if self._poller is None or self._poller.done() or self._poller_loop is not loop:
+            self._poller_loop = loop
+            self._poller = loop.create_task(self._poll())
+
+    async def _poll(self):
+        prefix = f'specific.{self.client_prefix}!'
+        # Диапазон по индексу вместо LIKE: все каналы, начинающиеся с префикса процесса
+        channel_filter = 'channel >= ? AND channel < ?'
+        params = [prefix, prefix[:-1] + chr(ord('!') + 1)]
+        delay = self.poll_interval
+        while True:
+            messages = await self._run(self._pop, channel_filter, params, self.batch_size)
+            loop = asyncio.get_running_loop()
+            woken = set()
+            for channel, expires, message in messages:
+                buffer = self._buffers.setdefault(channel, _LocalBuffer(self.get_capacity(channel)))
+                buffer.messages.append((expires, message))
+                woken.add(channel)
+            for channel in woken:
+                self._buffers[channel].get_event(loop).set()
+            self._drop_stale_buffers()
+
+            if len(messages) >= self.batch_size:
+                delay = self.poll_interval
+                continue # Есть ещё сообщения - забираем сразу
+            if messages:
+                delay = self.poll_interval
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _drop_stale_buffers(self):
+        "Буферы каналов, которые давно никто не читает (сокет закрылся), удаляем, чтобы не копить память"
+        now = time.time()
+        stale = [
+            channel for channel, buffer in self._buffers.items()
+            if now - buffer.last_access > self.expiry and not buffer.waiting
+        ]
+        for channel in stale:
+            del self._buffers[channel]
@@ -0,0 +1,302 @@
+'''
+Метрики процесса в текстовом формате Prometheus (GET /metrics).
+
+Счётчики, gauge и гистограммы живут в памяти процесса под блокировкой, поэтому запись из потоков
+sync_to_async и из event loop безопасна и дешева (без I/O на пути запроса).
+
+Если запущено несколько воркеров (gunicorn/daphne в нескольких процессах), задайте METRICS['MULTIPROCESS_DIR']
+(или переменную окружения TEA_STORE_METRICS_DIR): каждый процесс раз в FLUSH_INTERVAL секунд и при выходе пишет
+свои значения в <dir>/<pid>.json, а /metrics складывает их со значениями текущего процесса.
+Файлы завершившихся процессов удаляются при сборе: процесс с таким pid не существует или файл не обновлялся
+дольше STALE_INTERVALS * FLUSH_INTERVAL (pid достался другому процессу). Их значения уходят из суммы,
+Prometheus видит это как сброс счётчика, как и при перезапуске воркера. Каталог, как и в multiprocess-режиме
+prometheus_client, должен быть своим у каждого запуска сервера.
+
+По умолчанию /metrics доступен только с loopback (ALLOWED_IPS).
+
+p50/p99 считаются на стороне Prometheus:
+    histogram_quantile(0.99, sum by (le, route) (rate(tea_store_http_request_duration_seconds_bucket[5m])))
+'''
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFAULTS = {
+    'MULTIPROCESS_DIR': os.environ.get('TEA_STORE_METRICS_DIR'), # None - только метрики текущего процесса
+    'FLUSH_INTERVAL': 5, # Как часто процесс сохраняет свои значения в MULTIPROCESS_DIR, секунды
+    'ALLOWED_IPS': ['127.0.0.1', '::1'], # Список адресов, которым доступен /metrics; None - всем
+}
+
+# Сколько пропущенных сохранений подряд означает, что процесс завершился
+STALE_INTERVALS = 3
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} # Кортеж значений меток -> значение
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        "Значения в виде, пригодном для JSON: [[метки, значение], ...]"
+        with self._lock:
+            return [[list(key), self._copy(value)] for key, value in self._values.items()]
+
+    def _copy(self, value):
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets): # Корзин десяток - линейный поиск быстрее bisect с вызовом
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Счётчики по корзинам (не накопительные) + последняя для +Inf, затем сумма
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _copy(self, value):
+        return list(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter('tea_store_http_requests_total', 'HTTP-запросы по маршруту, методу и коду ответа', ('route', 'method', 'status'))
+HTTP_LATENCY = Histogram('tea_store_http_request_duration_seconds', 'Время обработки HTTP-запроса', ('route', 'method'))
+HTTP_IN_FLIGHT = Gauge('tea_store_http_requests_in_flight', 'HTTP-запросы в обработке')
+QUERY_BUDGET_EXCEEDED = Counter('tea_store_query_budget_exceeded_total', 'Запросы, превысившие SERVER_TIMING QUERY_BUDGET', ('route',))
+WS_CONNECTIONS = Gauge('tea_store_ws_connections', 'Открытые WebSocket-соединения', ('consumer',))
+WS_CONNECTIONS_TOTAL = Counter('tea_store_ws_connections_total', 'Принятые WebSocket-соединения', ('consumer',))
+WS_RESYNCS = Counter('tea_store_ws_resyncs_total', 'Переполнения очереди соединения (клиенту ушёл resync)', ('consumer',))
+GROUP_SEND_LATENCY = Histogram('tea_store_group_send_duration_seconds', 'Время одной рассылки channel layer group_send', ('kind',))
+EVENT_FLUSH_LATENCY = Histogram('tea_store_product_events_flush_duration_seconds', 'Время рассылки одной пачки изменений карточек во все группы')
+
+
+# --- Несколько процессов ---
+
+class MultiprocessWriter:
+    "Фоновый поток, который сохраняет значения процесса в <dir>/<pid>.json"
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.path = os.path.join(directory, f'{os.getpid()}.json')
+        self._stop = threading.Event()
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self.run, name='metrics-writer', daemon=True).start()
+        atexit.register(self.stop)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self._stop.set()
+        self.write()
+
+    def write(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'pid': os.getpid(), 'metrics': REGISTRY.snapshot()}, file)
+        os.replace(tmp, self.path) # Читатель видит либо старый, либо новый файл целиком
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start_multiprocess_writer():
+    "Запускает запись значений процесса в MULTIPROCESS_DIR, если она настроена (один раз на процесс)"
+    global _writer
+    directory = get_config()['MULTIPROCESS_DIR']
+    if not directory:
+        return None
+    with _writer_lock:
+        if _writer is None or _writer.path != os.path.join(directory, f'{os.getpid()}.json'):
+            if _writer is not None: # Мы - форк: значения родителя уже лежат в его файле, не считаем их дважды
+                for metric in REGISTRY.metrics.values():
+                    metric.clear()
+            _writer = MultiprocessWriter(directory, get_config()['FLUSH_INTERVAL'])
+            _writer.start()
+    return _writer
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_other_processes(directory, interval):
+    "Снимки живых процессов из MULTIPROCESS_DIR, кроме текущего; файлы завершившихся удаляются"
+    snapshots = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return snapshots
+    stale_before = time.time() - STALE_INTERVALS * interval
+    for name in names:
+        if not name.endswith('.json') or name == f'{os.getpid()}.json':
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path) as file:
+                data = json.load(file)
+                modified = os.fstat(file.fileno()).st_mtime
+        except (OSError, ValueError): # Файл удалили между listdir и open
+            continue
+        if pid_alive(data['pid']) and modified >= stale_before:
+            snapshots.append(data['metrics'])
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError: # Удалил параллельный сбор
+            pass
+    return snapshots
+
+
+def collect():
+    "Значения всех метрик, сложенные по процессам: {имя: {метки: значение}}"
+    merged = {name: {tuple(key): value for key, value in samples} for name, samples in REGISTRY.snapshot().items()}
+    config = get_config()
+    if config['MULTIPROCESS_DIR']:
+        for snapshot in read_other_processes(config['MULTIPROCESS_DIR'], config['FLUSH_INTERVAL']):
+            for name, samples in snapshot.items():
+                metric = REGISTRY.metrics.get(name)
+                if metric is None:
+                    continue
+                values = merged[name]
+                for key, value in samples:
+                    key = tuple(key)
+                    if metric.kind == 'histogram':
+                        current = values.setdefault(key, [0] * len(value))
+                        values[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        values[key] = values.get(key, 0) + value
+    return merged
+
+
+# --- Текстовый формат ---
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def render():
+    lines = []
+    values = collect()
+    for name, metric in REGISTRY.metrics.items():
+        lines.append(f'# HELP {name} {escape(metric.documentation)}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for key, value in sorted(values[name].items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{name}{format_labels(metric.labelnames, key)} {format_value(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*metric.buckets, math.inf), value):
+                cumulative += count
+                labels = format_labels(metric.labelnames, key, [('le', format_value(float(bound)))])
+                lines.append(f'{name}_bucket{labels} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(metric.labelnames, key)} {format_value(value[-1])}')
+            lines.append(f'{name}_count{format_labels(metric.labelnames, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    allowed = get_config()['ALLOWED_IPS']
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
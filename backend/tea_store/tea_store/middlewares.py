@@ -1,54 +1,343 @@
+'''
+Логирование запросов: одна JSON-строка на запрос.
+
+Запрос только кладёт запись в очередь (QueueHandler), а форматирование и запись в поток делает фоновый поток
+QueueListener, поэтому медленный stdout/файл не задерживает ответы. Для шумных путей можно задать долю
+логируемых запросов (SAMPLING), ошибки 5xx и медленные запросы логируются всегда.
+
+Пользователь в запись попадает, только если его уже загрузил кто-то другой (DRF, view): сама запись в лог
+не должна вызывать запросы к сессии и таблице пользователей.
+
+Настройки (settings.REQUEST_LOGGING):
+    'SAMPLING': {'/static/': 0.0, '/api/cartitems/': 0.1} - доля по префиксу пути (берётся самый длинный префикс)
+    'DEFAULT_RATE': 1.0 - доля для остальных путей
+    'SLOW_MS': 1000 - запросы дольше логируются всегда
+    'OUTPUT': 'stream' - писать в stderr; None - никуда (тесты), записи по-прежнему видны через assertLogs
+'''
+import atexit
+import json
 import logging
+import queue
+import random
+import threading
 import time
+from logging.handlers import QueueHandler, QueueListener
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+
+from . import metrics, profiling, routers, timing
+
+logger = logging.getLogger('tea_store.requests')
+
+DEFAULTS = {
+    'SAMPLING': {},
+    'DEFAULT_RATE': 1.0,
+    'SLOW_MS': 1000,
+    'OUTPUT': 'stream',
+}
+
+
+class JsonFormatter(logging.Formatter):
+    "Запись лога запроса (record.request_log) - одной JSON-строкой"
+
+    def format(self, record):
+        data = getattr(record, 'request_log', None)
+        if data is None:
+            data = {'message': record.getMessage()}
+        return json.dumps({'ts': round(record.created, 3), 'level': record.levelname, **data}, ensure_ascii=False, default=str)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_LOGGING', {})}
+
+
+def get_rate(path, config):
+    "Доля для пути по самому длинному подходящему префиксу"
+    rate, matched = config['DEFAULT_RATE'], -1
+    for prefix, prefix_rate in config['SAMPLING'].items():
+        if len(prefix) > matched and path.startswith(prefix):
+            rate, matched = prefix_rate, len(prefix)
+    return rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    "QueueHandler, который не форматирует запись в потоке запроса: это сделает JsonFormatter в потоке QueueListener"
+
+    def prepare(self, record):
+        return record
+
 
-logger = logging.getLogger(__name__)
-handler = logging.StreamHandler()
-formatter = logging.Formatter(fmt='%(asctime)s %(levelname)s; %(message)s', )
-handler.formatter = formatter
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+_listener = None
+_listener_lock = threading.Lock()
 
 
-class LoggingProductsMiddleware(object):
+def start_listener():
+    "Подключает к логгеру очередь и запускает фоновый поток записи (один раз на процесс)"
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return _listener
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if get_config()['OUTPUT'] is None:
+            logger.addHandler(logging.NullHandler())
+            _listener = False # Запускать нечего, но и повторно настраивать логгер не нужно
+            return _listener
+        records = queue.SimpleQueue()
+        stream = logging.StreamHandler()
+        stream.setFormatter(JsonFormatter())
+        _listener = QueueListener(records, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop) # Дописываем хвост очереди при выходе
+        logger.addHandler(DeferredQueueHandler(records))
+        return _listener
+
+
+def loaded_user_id(request):
+    '''
+    id пользователя, если он уже загружен, иначе None.
+    AuthenticationMiddleware кладёт в request.user ленивый объект - если его ещё никто не трогал, не трогаем и мы.
+    DRF после аутентификации записывает в request.user уже настоящего пользователя.
+    '''
+    user = request.__dict__.get('user')
+    if isinstance(user, SimpleLazyObject):
+        user = user._wrapped
+        if user is empty:
+            return None
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+class RequestLoggingMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-        # One-time configuration and initialization.
+        if iscoroutinefunction(get_response): # В ASGI-цепочке работаем как async, без перехода в поток
+            markcoroutinefunction(self)
+        start_listener()
 
     def __call__(self, request):
-        # Code to be executed for each request before
-        # the view (and later middleware) are called.
-        start_time = time.time()
-        request_data = {
-            'request': request.method,
-            'ip_adress': request.META.get('REMOTE_ADDR'),
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.log(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.log(request, response, start)
+        return response
+
+    def log(self, request, response, start):
+        duration_ms = (time.perf_counter() - start) * 1000
+        config = get_config()
+        rate = get_rate(request.path, config)
+        always = response.status_code >= 500 or duration_ms >= config['SLOW_MS']
+        if not always and (rate <= 0 or (rate < 1 and random.random() >= rate)):
+            return
+        logger.info('request', extra={'request_log': {
+            'method': request.method,
             'path': request.path,
-            'user': request.user if request.user.is_authenticated else 'Anonymous',
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'ip': request.META.get('REMOTE_ADDR'),
+            'user': loaded_user_id(request),
+            'rate': 1.0 if always else rate, # Вес записи при подсчётах: 1 / rate
+            **self.timings(request),
+        }})
 
-        }
-        logger.info(request_data)
-        method = request.method
-        ip_address = request.META.get('REMOTE_ADDR')
-        path = request.path
+    @staticmethod
+    def timings(request):
+        "Разбивка времени от ServerTimingMiddleware (см. timing.py)"
+        timings = getattr(request, 'timings', None)
+        if timings is None:
+            return {}
+        data = timings.as_dict()
+        budget = timing.get_config()['QUERY_BUDGET']
+        if timings.over_budget(budget):
+            data['query_budget'] = budget
+        return data
 
-        response = self.get_response(request)
-        # Code to be executed for each request/response after
-        # the view is called.
-        duration = time.time() - start_time
-        user = request.user if request.user.is_authenticated else 'Anonymous'
 
+class MetricsMiddleware:
+    "Задержка, коды ответа и число запросов в обработке для /metrics (см. metrics.py)"
+    sync_capable = True
+    async_capable = True
 
-        request_data = {
-            'request': method,
-            'ip_adress': ip_address,
-            'path': path,
-            'user': user,
-        }
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        metrics.start_multiprocess_writer()
 
-        response_dict = {
-            'status_code': response.status_code,
-            'duration': duration,
-        }
-        logger.info(request_data)
-        logger.info(response_dict)
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics.HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.HTTP_IN_FLIGHT.dec()
+        self.observe(request, response, start)
+        return response
 
+    async def __acall__(self, request):
+        metrics.HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.HTTP_IN_FLIGHT.dec()
+        self.observe(request, response, start)
         return response
+
+    @staticmethod
+    def route(request):
+        "Имя маршрута, а не путь: у /api/cartitems/1/ и /api/cartitems/2/ одна метка, число рядов ограничено"
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return '<unmatched>'
+        return match.view_name
+
+    def observe(self, request, response, start):
+        route = self.route(request)
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
+        metrics.HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+
+
+class ServerTimingMiddleware:
+    "Число и время запросов к базе, время сериализации и рендера - в заголовок Server-Timing (см. timing.py)"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.timings = timings = timing.RequestTimings()
+        token = timing.activate(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.deactivate(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        request.timings = timings = timing.RequestTimings()
+        token = timing.activate(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.deactivate(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        timings.finish()
+        config = timing.get_config()
+        if config['HEADER']:
+            response['Server-Timing'] = timings.header()
+        if timings.over_budget(config['QUERY_BUDGET']):
+            route = MetricsMiddleware.route(request)
+            metrics.QUERY_BUDGET_EXCEEDED.inc(route=route)
+            timing.logger.warning(
+                '%s %s: %d запросов к базе при бюджете %d', request.method, request.path, timings.db_queries, config['QUERY_BUDGET']
+            )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    '''
+    Состояние роутера реплик на запрос (см. routers.py): небезопасные методы и клиенты с кукой после недавней
+    записи читают из основной базы, а запрос с записью ставит куку. Должен стоять до SessionMiddleware:
+    сессия и пользователь тоже читаются из базы.
+    '''
+    sync_capable = True
+    async_capable = True
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = routers.get_config()
+        state, token = routers.activate(self.is_pinned(request, config))
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(response, state, config)
+
+    async def __acall__(self, request):
+        config = routers.get_config()
+        state, token = routers.activate(self.is_pinned(request, config))
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.deactivate(token)
+        return self.finish(response, state, config)
+
+    def is_pinned(self, request, config):
+        return request.method not in self.SAFE_METHODS or config['COOKIE'] in request.COOKIES
+
+    @staticmethod
+    def finish(response, state, config):
+        if state.wrote and config['ALIASES']:
+            response.set_cookie(config['COOKIE'], '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax')
+        return response
+
+
+class ProfilingMiddleware:
+    '''
+    Профиль одного запроса по требованию staff-пользователя (см. profiling.py).
+    View запускается из process_view: так и в WSGI, и в ASGI он выполняется в том же потоке, что и cProfile.
+    Должен стоять последним в MIDDLEWARE, чтобы process_view остальных middleware уже отработали.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        return self.get_response(request) # В async-режиме это корутина, её дождётся вызывающий
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not profiling.is_requested(request):
+            return None
+        response, profiler, duration = profiling.profile_call(self.run_view, request, view_func, view_args, view_kwargs)
+        response[profiling.RESPONSE_HEADER] = profiling.save(profiler, {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'user': request.user.pk,
+        })
+        return response
+
+    @staticmethod
+    def run_view(request, view_func, view_args, view_kwargs):
+        response = view_func(request, *view_args, **view_kwargs)
+        if callable(getattr(response, 'render', None)) and not response.is_rendered: # Рендер DRF тоже попадает в профиль
+            response.render()
+        return response
+
+
+LoggingProductsMiddleware = RequestLoggingMiddleware # Старое имя, чтобы не ломать чужие настройки MIDDLEWARE
@@ -0,0 +1,119 @@
+'''
+Профиль (cProfile) одного конкретного запроса на staging/production.
+
+Включается настройкой PROFILING['ENABLED'] и срабатывает только для staff-пользователя, который прислал
+заголовок X-Profile: 1 или параметр ?_profile=1. View (вместе с рендером ответа) выполняется под cProfile,
+результат сохраняется в PROFILING['DIR'] как <id>.prof (формат pstats) и <id>.json (запрос, код ответа, время),
+а id возвращается в заголовке X-Profile-Id. Когда каталог больше MAX_BYTES, самые старые профили удаляются.
+
+Смотреть: python manage.py profiles (список) и python manage.py profiles <id> (самые дорогие функции).
+'''
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY_PARAM = '_profile'
+RESPONSE_HEADER = 'X-Profile-Id'
+
+DEFAULTS = {
+    'ENABLED': False,
+    'DIR': os.path.join(settings.BASE_DIR, 'profiles'),
+    'MAX_BYTES': 50 * 1024 * 1024, # Общий размер сохранённых профилей
+}
+
+_rotate_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def is_requested(request):
+    "Профиль включён настройкой, запрошен и пользователь - staff (посторонним флаг ничего не даёт)"
+    if not get_config()['ENABLED']:
+        return False
+    if request.META.get(HEADER) != '1' and request.GET.get(QUERY_PARAM) != '1':
+        return False
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and user.is_staff
+
+
+def new_profile_id():
+    "Сортируется по времени создания"
+    return f'{datetime.now().strftime("%Y%m%d%H%M%S%f")}-{uuid.uuid4().hex[:8]}'
+
+
+def profile_call(func, *args, **kwargs):
+    "(результат, профиль, секунды)"
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, profiler, time.perf_counter() - start
+
+
+def save(profiler, meta, directory=None):
+    "Сохраняет профиль и его описание, затем ограничивает размер каталога. Возвращает id"
+    config = get_config()
+    directory = directory or config['DIR']
+    os.makedirs(directory, exist_ok=True)
+    profile_id = new_profile_id()
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as file:
+        json.dump({'id': profile_id, 'created': time.time(), **meta}, file, ensure_ascii=False)
+    rotate(directory, config['MAX_BYTES'])
+    return profile_id
+
+
+def list_profiles(directory=None):
+    "Описания сохранённых профилей, от старых к новым"
+    directory = directory or get_config()['DIR']
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                meta = json.load(file)
+        except (OSError, ValueError): # Профиль удалили при ротации
+            continue
+        meta['file'] = os.path.join(directory, f'{meta["id"]}.prof')
+        profiles.append(meta)
+    return profiles
+
+
+def rotate(directory, max_bytes):
+    "Удаляет самые старые профили, пока каталог не станет меньше max_bytes. Возвращает число удалённых"
+    with _rotate_lock:
+        ids = sorted({name.rsplit('.', 1)[0] for name in os.listdir(directory) if name.endswith(('.prof', '.json'))})
+        sizes = {}
+        for profile_id in ids:
+            sizes[profile_id] = sum(
+                os.path.getsize(path) for path in profile_files(directory, profile_id) if os.path.exists(path)
+            )
+        total, removed = sum(sizes.values()), 0
+        for profile_id in ids[:-1]: # Только что записанный профиль не удаляем, даже если он один больше лимита
+            if total <= max_bytes:
+                break
+            for path in profile_files(directory, profile_id):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= sizes[profile_id]
+            removed += 1
+        return removed
+
+
+def profile_files(directory, profile_id):
+    return [os.path.join(directory, f'{profile_id}.prof'), os.path.join(directory, f'{profile_id}.json')]
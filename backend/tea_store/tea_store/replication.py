@@ -0,0 +1,54 @@
+'''
+Реплики SQLite для локальной проверки роутера (tea_store/routers.py): копия основной базы через backup API.
+
+Backup API копирует согласованный снимок основной базы, не останавливая ни читателей, ни писателей (в WAL).
+Копия сначала пишется во временный файл и переводится из WAL в обычный журнал: реплику открывают с mode=ro,
+а такому соединению WAL-база без файла -shm недоступна. Потом временный файл тем же backup API переносится
+в файл реплики на месте - открытые соединения реплики (CONN_MAX_AGE) сразу видят новые данные,
+а чтение во время переноса ждёт его окончания (busy_timeout), а не видит половину.
+
+Периодически: manage.py replicate_db --interval 2.
+'''
+import os
+import sqlite3
+import time
+from contextlib import closing
+from urllib.parse import unquote, urlparse
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .routers import get_config
+
+
+def database_path(alias):
+    "Путь к файлу базы: NAME бывает и путём, и URI file:...?mode=ro"
+    name = str(connections.settings[alias]['NAME'])
+    if name.startswith('file:'):
+        return unquote(urlparse(name).path)
+    return name
+
+
+def replicate(source_path, replica_path, busy_timeout=20):
+    "Переносит снимок source_path в replica_path. Возвращает размер копии в байтах"
+    tmp_path = f'{replica_path}.tmp'
+    try:
+        with closing(sqlite3.connect(source_path, timeout=busy_timeout)) as source, closing(sqlite3.connect(tmp_path)) as tmp:
+            source.backup(tmp)
+            tmp.execute('PRAGMA journal_mode=DELETE')
+            with closing(sqlite3.connect(replica_path, timeout=busy_timeout)) as replica:
+                tmp.backup(replica)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(replica_path)
+
+
+def replicate_all(aliases=None):
+    "Обновляет реплики из READ_REPLICAS['ALIASES']. Возвращает {псевдоним: (байт, секунд)}"
+    source_path = database_path(DEFAULT_DB_ALIAS)
+    results = {}
+    for alias in aliases or get_config()['ALIASES']:
+        start = time.perf_counter()
+        size = replicate(source_path, database_path(alias))
+        results[alias] = (size, time.perf_counter() - start)
+    return results
@@ -0,0 +1,134 @@
+'''
+Роутер баз данных: чтение - из реплик, запись - в основную базу (DATABASE_ROUTERS).
+
+Чтение уходит в случайную доступную реплику из READ_REPLICAS['ALIASES'], кроме случаев, когда нужна свежая база:
+    - запрос уже что-то записал (db_for_write) или пришёл небезопасным методом (POST/PUT/PATCH/DELETE):
+      всё остальное в этом запросе читается из основной базы;
+    - после записи ReplicaRoutingMiddleware ставит куку на STICKY_SECONDS: следующие запросы этого клиента
+      тоже читают из основной базы, пока реплика не догонит ("read your own writes");
+    - открыта транзакция на основной базе (transaction.atomic): чтение внутри неё должно видеть её же данные.
+Вне запроса (manage.py, shell) после первой записи чтение в том же контексте тоже идёт в основную базу.
+
+Если реплика недоступна (нет файла, ошибка соединения), она пропускается на RETRY_AFTER секунд, а чтение
+идёт в другую реплику или в основную базу. Без реплик в настройках роутер ничего не меняет.
+
+Настройки (settings.READ_REPLICAS):
+    'ALIASES': []        - псевдонимы реплик из DATABASES (только чтение, см. sqlite_backend.replica_database)
+    'STICKY_SECONDS': 10 - сколько читать из основной базы после записи; должно быть больше задержки репликации
+    'RETRY_AFTER': 30    - через сколько секунд снова пробовать недоступную реплику
+    'COOKIE': 'use_primary'
+'''
+import contextvars
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger('tea_store.routers')
+
+DEFAULTS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 10,
+    'RETRY_AFTER': 30,
+    'COOKIE': 'use_primary',
+}
+
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+# Псевдоним -> time.monotonic(), до которого реплика считается недоступной (общее для всех потоков)
+_unavailable = {}
+_unavailable_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+class RoutingState:
+    "Куда читать в текущем запросе. Объект общий для потоков sync_to_async, поэтому запись из view видна middleware"
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned # Читать из основной базы
+        self.wrote = False # Была запись - клиенту нужна кука
+
+
+def activate(pinned=False):
+    "Новое состояние для запроса. Возвращает (state, token) - token для deactivate()"
+    state = RoutingState(pinned)
+    return state, _state.set(state)
+
+
+def deactivate(token):
+    _state.reset(token)
+
+
+def pin_to_primary():
+    "Дальше в этом запросе (или контексте) читать из основной базы"
+    state = _state.get()
+    if state is None:
+        state = RoutingState()
+        _state.set(state)
+    state.pinned = True
+    state.wrote = True
+
+
+def is_pinned():
+    state = _state.get()
+    return state is not None and state.pinned
+
+
+def mark_unavailable(alias, error, retry_after):
+    with _unavailable_lock:
+        _unavailable[alias] = time.monotonic() + retry_after
+    logger.warning('Реплика %s недоступна, читаем из основной базы ещё %s с: %s', alias, retry_after, error)
+
+
+def is_available(alias, retry_after):
+    until = _unavailable.get(alias)
+    if until is not None:
+        if time.monotonic() < until:
+            return False
+        with _unavailable_lock:
+            _unavailable.pop(alias, None)
+    if alias not in connections.settings:
+        mark_unavailable(alias, 'нет в DATABASES', retry_after)
+        return False
+    try:
+        connections[alias].ensure_connection() # Уже открытое соединение не проверяется повторно
+    except DatabaseError as error:
+        mark_unavailable(alias, error, retry_after)
+        return False
+    return True
+
+
+def choose_replica():
+    "Доступная реплика или None"
+    config = get_config()
+    replicas = [alias for alias in config['ALIASES'] if is_available(alias, config['RETRY_AFTER'])]
+    return random.choice(replicas) if replicas else None
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not get_config()['ALIASES'] or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return choose_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Явно основная база: иначе Django записал бы объект туда, откуда он прочитан, т.е. в реплику
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_config()['ALIASES']:
+            return False # Реплики получают схему вместе с данными (tea_store/replication.py)
+        return None
@@ -10,11 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
+from tea_store.sqlite_backend import production_database, replica_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+TESTING = sys.argv[1:2] == ['test'] # manage.py test
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -62,16 +68,111 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',                # Поиск
         'rest_framework.filters.OrderingFilter',              # Сортировка
     ),
+    'DEFAULT_RENDERER_CLASSES': ( # Как в DRF по умолчанию, но с замером времени рендера для Server-Timing
+        'api.renderers.FastJSONRenderer', # Тот же JSON, что у JSONRenderer, без создания кодировщика на каждый ответ
+        'tea_store.timing.TimedBrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',  # Пагинация
     'PAGE_SIZE': 10,  # Размер страницы
 }
 
+# Кэш ответов для GET /api/cartitems/ (list/retrieve). Инвалидируется версией каталога, которую меняют сигналы api.signals.
+# BACKEND: 'api.cache.LRUResponseCache' (в памяти процесса) или 'api.cache.DjangoResponseCache' (поверх CACHES).
+# None - кэш выключен.
+CARTITEMS_RESPONSE_CACHE = {
+    'BACKEND': 'api.cache.LRUResponseCache',
+    'OPTIONS': {
+        'MAX_ENTRIES': 1024, # Максимум записей в LRU
+        'TIMEOUT': 300, # Время жизни записи в секундах
+    },
+}
+
 ASGI_APPLICATION = 'tea_store.asgi.application'
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer', # InMemoryChannelLayer - это простой способ, для нас подойдёт. Ещё есть через брокер сообщений (Redis)
     },
 }
+# Несколько воркеров Daphne/uvicorn на одном хосте: InMemory не видит сокеты других процессов,
+# поэтому включаем общий channel layer поверх файла SQLite (без Redis): TEA_STORE_CHANNEL_LAYER=sqlite
+if os.environ.get('TEA_STORE_CHANNEL_LAYER') == 'sqlite':
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'tea_store.channel_layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': os.environ.get('TEA_STORE_CHANNEL_LAYER_PATH', BASE_DIR / 'channels.sqlite3'),
+            'capacity': 100, # Максимум недоставленных сообщений на канал
+            'expiry': 60, # Через сколько секунд недоставленное сообщение выбрасывается
+        },
+    }
+
+# Рассылка изменений карточек в ws/products/ (api.events): события после коммита копятся DEBOUNCE секунд,
+# схлопываются по id и уходят в channel layer из фоновой asyncio-задачи
+PRODUCT_EVENTS = {
+    'DEBOUNCE': 0.05,
+    'MAX_PENDING': 1000, # Сколько несхлопнутых событий держим для одного медленного сокета, дальше - {"resync": true}
+    'HEARTBEAT': 25, # Период ping (секунды), None - без ping
+    'IDLE_TIMEOUT': 60, # Закрываем сокет, если клиент столько секунд ничего не присылал
+    'PRICE_BUCKET': 100, # Ширина корзины цены для подписок на диапазон цены (api/topics.py)
+    'MAX_PRICE_BUCKETS': 50, # Более широкий диапазон обслуживается через общую группу с фильтрацией
+}
+
+PRODUCT_CHANGELOG = { # Журнал изменений карточек для ws/products/?since=<seq> (api/changelog.py)
+    'RETENTION': 10000, # Сколько последних изменений хранить
+    'MAX_CATCH_UP': 5000, # Если клиент пропустил больше - отдаём снимок каталога
+    'SNAPSHOT_MAX_ROWS': 10000, # Каталог больше - вместо снимка клиент перезагружает список через API
+}
+
+CARTITEMS_FAST_READ = True # GET list/retrieve карточек через .values() без сериализатора (api/fast_read.py)
+
+REQUEST_LOGGING = { # JSON-лог запросов (tea_store/middlewares.py)
+    'SAMPLING': { # Доля логируемых запросов по префиксу пути, ошибки 5xx и медленные запросы пишутся всегда
+        '/static/': 0.0,
+    },
+    'DEFAULT_RATE': 1.0,
+    'SLOW_MS': 1000,
+    'OUTPUT': None if TESTING else 'stream', # В тестах лог не печатается, его проверяют через assertLogs
+}
+
+SERVER_TIMING = { # Заголовок Server-Timing и разбивка времени в логе запросов (tea_store/timing.py)
+    'HEADER': True,
+    'QUERY_BUDGET': None, # Например 10: запросы с большим числом обращений к базе попадут в лог (warning) и метрики
+}
+
+PROFILING = { # Профиль запроса по X-Profile: 1 или ?_profile=1 от staff-пользователя (tea_store/profiling.py)
+    'ENABLED': os.environ.get('TEA_STORE_PROFILING') == '1',
+    'DIR': os.path.join(BASE_DIR, 'profiles'),
+    'MAX_BYTES': 50 * 1024 * 1024, # Старые профили удаляются, когда каталог больше
+}
+
+METRICS = { # Метрики Prometheus на /metrics (tea_store/metrics.py)
+    'MULTIPROCESS_DIR': os.environ.get('TEA_STORE_METRICS_DIR'), # Общий каталог, если воркеров несколько
+    'FLUSH_INTERVAL': 5,
+    'ALLOWED_IPS': ['127.0.0.1', '::1'], # None - метрики видны всем
+}
+
+EXPORTS = { # Потоковые выгрузки /api/cartitems/export/ и /api/users/export/ (tea_store/exports.py)
+    'CHUNK_SIZE': 2000, # Строк в одной выборке из курсора и в одном куске ответа
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'auth': { # Сессии и пользователи запросов (users/backends.py): в памяти процесса, не больше MAX_ENTRIES записей
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Сессия и пользователь запроса из кэша 'auth' вместо двух запросов к базе на каждый запрос (users/backends.py)
+SESSION_ENGINE = 'users.sessions'
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+AUTH_CACHE = {
+    'CACHE_ALIAS': 'auth',
+    'USER_TTL': 60, # Изменения пользователя мимо save() и из других процессов видны не позже чем через столько секунд
+    'SESSION_TTL': 60, # То же для выхода/удаления сессии в другом процессе
+}
 
 SPECTACULAR_SETTINGS = { # Настройки для drf-spectacular
     'TITLE': 'Cart Management API',                              
@@ -81,6 +182,9 @@ SPECTACULAR_SETTINGS = { # Настройки для drf-spectacular
 }
 
 MIDDLEWARE = [
+    'tea_store.middlewares.MetricsMiddleware', # Первым: в задержку входят и остальные middleware
+    'tea_store.middlewares.ServerTimingMiddleware', # До логирования: лог запроса берёт разбивку времени из request.timings
+    'tea_store.middlewares.ReplicaRoutingMiddleware', # До сессий: после записи и они читаются из основной базы
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -90,7 +194,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'tea_store.middlewares.LoggingProductsMiddleware',
+    'tea_store.middlewares.RequestLoggingMiddleware',
+    'tea_store.middlewares.ProfilingMiddleware', # Последним: профилирует только view (см. tea_store/profiling.py)
 ]
 
 # Для разработки - разрешить все origins (не использовать в production!)
@@ -172,6 +277,24 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+# Production-режим SQLite (tea_store/sqlite_backend): WAL и прагмы на каждом соединении, busy_timeout, BEGIN IMMEDIATE,
+# постоянные соединения и (TEA_STORE_SQLITE_WRITE_LOCK=1) очередь писателей внутри процесса
+if os.environ.get('TEA_STORE_SQLITE_PRODUCTION') == '1':
+    DATABASES['default'] = production_database(
+        BASE_DIR / 'db.sqlite3', write_lock=os.environ.get('TEA_STORE_SQLITE_WRITE_LOCK') == '1',
+    )
+
+# Чтение из реплик, запись в основную базу (tea_store/routers.py). Без реплик роутер всё отправляет в default
+DATABASE_ROUTERS = ['tea_store.routers.ReadReplicaRouter']
+READ_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 10, # После записи клиент столько секунд читает из основной базы; больше периода репликации
+    'RETRY_AFTER': 30, # Недоступная реплика пропускается столько секунд
+}
+# Локальная реплика - копия db.sqlite3, которую обновляет manage.py replicate_db --interval 2: TEA_STORE_READ_REPLICA=1
+if os.environ.get('TEA_STORE_READ_REPLICA') == '1':
+    DATABASES['replica'] = replica_database(BASE_DIR / 'db.replica.sqlite3')
+    READ_REPLICAS['ALIASES'] = ['replica']
 
 
 # Password validation
@@ -0,0 +1,71 @@
+'''
+Бэкенд SQLite для production (ENGINE = 'tea_store.sqlite_backend') и его настройки.
+
+production_database() собирает запись DATABASES:
+    - прагмы на каждом новом соединении (OPTIONS['init_command']): WAL - читатели не ждут писателя,
+      synchronous=NORMAL - в режиме WAL без потери целостности, mmap и кэш страниц побольше;
+    - busy_timeout (OPTIONS['timeout']): писатель ждёт освобождения блокировки, а не падает сразу;
+    - transaction_mode=IMMEDIATE: транзакция берёт блокировку записи на BEGIN, поэтому не бывает
+      "database is locked" при переходе транзакции от чтения к записи (его busy_timeout не спасает);
+    - CONN_MAX_AGE: соединение (и его прагмы, кэш страниц, mmap) переиспользуется между запросами.
+
+OPTIONS['write_lock'] = True включает очередь писателей внутри процесса (см. base.py): потоки ждут
+на threading.Lock, а не опрашивают файл блокировки SQLite с засыпанием, отсюда ровнее задержки записи.
+Между процессами по-прежнему работает только busy_timeout.
+
+В settings.py режим включается переменной окружения TEA_STORE_SQLITE_PRODUCTION=1 (очередь писателей -
+TEA_STORE_SQLITE_WRITE_LOCK=1). Сравнение режимов под конкурентной нагрузкой: manage.py bench_sqlite.
+
+replica_database() - запись DATABASES для копии только на чтение (реплика для tea_store/routers.py,
+копию обновляет tea_store/replication.py).
+'''
+from pathlib import Path
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024, # Отрицательное значение - в КиБ, т.е. 64 МиБ
+    'temp_store': 'MEMORY',
+}
+
+
+def init_command(pragmas=PRAGMAS):
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())
+
+
+def production_database(name, write_lock=False, busy_timeout=20, conn_max_age=600):
+    "Запись DATABASES для SQLite в production (busy_timeout - в секундах)"
+    return {
+        'ENGINE': 'tea_store.sqlite_backend',
+        'NAME': name,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': init_command(),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': busy_timeout,
+            'write_lock': write_lock,
+        },
+    }
+
+
+def replica_database(name, busy_timeout=20, conn_max_age=600):
+    '''
+    Копия базы только на чтение: файл открывается с mode=ro, поэтому запись в неё падает, а отсутствующий
+    файл не создаётся пустым, а даёт ошибку соединения (роутер тогда читает из основной базы).
+    В тестах реплика - зеркало тестовой основной базы.
+    '''
+    read_pragmas = {name: value for name, value in PRAGMAS.items() if name in ('mmap_size', 'cache_size', 'temp_store')}
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'{Path(name).absolute().as_uri()}?mode=ro',
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'uri': True,
+            'init_command': init_command(read_pragmas),
+            'timeout': busy_timeout, # Ждём, пока replication.py дописывает копию
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
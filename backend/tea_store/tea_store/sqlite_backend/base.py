@@ -0,0 +1,121 @@
+import threading
+
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+# Одна очередь на файл базы: у каждого потока своё соединение, а блокировка записи SQLite - одна на файл
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+UNLOCKED_STATEMENTS = ('SELECT', 'PRAGMA', 'EXPLAIN', 'BEGIN', 'SAVEPOINT', 'RELEASE') # Не пишут или выполняются внутри транзакции
+
+
+def get_write_lock(name):
+    with _write_locks_guard:
+        return _write_locks.setdefault(str(name), threading.Lock())
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    "Запись вне транзакции (autocommit) тоже занимает очередь писателей - на время одного запроса"
+
+    def execute(self, query, params=None):
+        with self.connection_wrapper.autocommit_write(query):
+            return super().execute(query, params)
+
+    def executemany(self, query, param_list):
+        with self.connection_wrapper.autocommit_write(query):
+            return super().executemany(query, param_list)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    '''
+    sqlite3 с необязательной очередью писателей (OPTIONS['write_lock']).
+    Транзакция (atomic) занимает очередь на BEGIN и освобождает на COMMIT/ROLLBACK, запрос на запись
+    вне транзакции - на время запроса. Ждать очередь дольше busy_timeout (OPTIONS['timeout']) нельзя:
+    будет OperationalError('database is locked'), как и без очереди.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_lock = None
+        self.write_lock_timeout = None
+        self.write_lock_held = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.write_lock = get_write_lock(kwargs['database']) if kwargs.pop('write_lock', False) else None
+        self.write_lock_timeout = kwargs.get('timeout', 5) # Как у sqlite3.connect
+        return kwargs
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.connection_wrapper = self
+        return cursor
+
+    def acquire_write_lock(self):
+        if self.write_lock is None or self.write_lock_held:
+            return False
+        if not self.write_lock.acquire(timeout=self.write_lock_timeout):
+            raise OperationalError('database is locked')
+        self.write_lock_held = True
+        return True
+
+    def release_write_lock(self):
+        if self.write_lock_held:
+            self.write_lock_held = False
+            self.write_lock.release()
+
+    def autocommit_write(self, query):
+        if self.write_lock is not None and not self.in_atomic_block and not query.lstrip()[:9].upper().startswith(UNLOCKED_STATEMENTS):
+            return _WriteLockContext(self)
+        return _NO_LOCK
+
+    def _start_transaction_under_autocommit(self):
+        acquired = self.acquire_write_lock()
+        try:
+            super()._start_transaction_under_autocommit()
+        except BaseException:
+            if acquired:
+                self.release_write_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self.release_write_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_write_lock()
+
+
+class _WriteLockContext:
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+
+    def __enter__(self):
+        self.acquired = self.wrapper.acquire_write_lock()
+
+    def __exit__(self, *exc_info):
+        if self.acquired:
+            self.wrapper.release_write_lock()
+
+
+class _NoLock:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_LOCK = _NoLock()
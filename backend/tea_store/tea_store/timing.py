@@ -0,0 +1,170 @@
+'''
+Разбивка времени запроса для заголовка Server-Timing и лога запросов.
+
+ServerTimingMiddleware создаёт на запрос объект RequestTimings и кладёт его в contextvar (и в request.timings).
+Contextvar переходит в потоки sync_to_async, поэтому замеры работают и в WSGI, и в ASGI.
+Что замеряется:
+    db        - число SQL-запросов и их суммарное время (execute_wrapper на соединениях потока, где выполняется view)
+    auth      - аутентификация, права и throttling DRF (TimedViewMixin)
+    serialize - CartItemSerializer.to_representation (TimedSerializerMixin)
+    render    - рендерер ответа (TimedJSONRenderer/TimedBrowsableAPIRenderer)
+    total     - весь запрос
+Интервалы могут пересекаться (ленивый queryset выполняется внутри serialize), поэтому в сумме они не дают total.
+
+Настройки (settings.SERVER_TIMING):
+    'HEADER': True       - добавлять заголовок Server-Timing
+    'QUERY_BUDGET': None - число запросов к базе, при превышении которого запрос помечается в логе и метриках
+'''
+import contextvars
+import logging
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.dispatch import receiver
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.serializers import ListSerializer
+
+logger = logging.getLogger('tea_store.timing')
+
+DEFAULTS = {
+    'HEADER': True,
+    'QUERY_BUDGET': None,
+}
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SERVER_TIMING', {})}
+
+
+class RequestTimings:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.spans = {} # Имя -> секунды
+        self.active = set() # Открытые интервалы: вложенный интервал с тем же именем не считаем дважды
+        self.total = None
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+
+    def over_budget(self, budget):
+        return budget is not None and self.db_queries > budget
+
+    def as_dict(self):
+        "Для лога запросов, миллисекунды"
+        data = {'db_queries': self.db_queries, 'db_ms': round(self.db_time * 1000, 2)}
+        data.update((f'{name}_ms', round(seconds * 1000, 2)) for name, seconds in self.spans.items())
+        return data
+
+    def header(self):
+        parts = [f'db;dur={self.db_time * 1000:.2f};desc="{self.db_queries} queries"']
+        parts.extend(f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.spans.items())
+        if self.total is not None:
+            parts.append(f'total;dur={self.total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def current():
+    "RequestTimings текущего запроса или None (вне запроса, в консьюмерах, командах)"
+    return _current.get()
+
+
+def activate(timings):
+    return _current.set(timings)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class span:
+    "Контекстный менеджер: with span('serialize'): ..."
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _current.get()
+        if self.timings is None or self.name in self.timings.active:
+            self.timings = None
+            return self
+        self.timings.active.add(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.start)
+            self.timings.active.discard(self.name)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_queries += 1
+        timings.db_time += time.perf_counter() - start
+
+
+@receiver(request_started)
+def install_query_wrapper(sender, **kwargs):
+    '''
+    Соединения у каждого потока свои. request_started приходит в том же потоке, где потом выполняется view
+    (в ASGI - в потоке sync_to_async), поэтому ставим обёртку здесь. Она остаётся на соединении навсегда,
+    вне запроса сразу передаёт вызов дальше. Ставим в начало списка: connection.execute_wrapper() снимает
+    свою обёртку с конца, и наша не должна оказаться на её месте.
+    '''
+    for connection in connections.all():
+        if query_wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, query_wrapper)
+
+
+# --- DRF ---
+
+class TimedViewMixin:
+    "Время аутентификации, проверки прав и throttling (APIView.initial)"
+
+    def initial(self, request, *args, **kwargs):
+        with span('auth'):
+            super().initial(request, *args, **kwargs)
+
+
+class TimedListSerializer(ListSerializer):
+    def to_representation(self, data):
+        with span('serialize'):
+            return super().to_representation(data)
+
+
+class TimedSerializerMixin:
+    '''
+    Время сериализации. Для many=True замеряется весь список одним интервалом (TimedListSerializer),
+    в сериализаторе нужно указать Meta.list_serializer_class = TimedListSerializer.
+    '''
+
+    def to_representation(self, instance):
+        with span('serialize'):
+            return super().to_representation(instance)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class TimedBrowsableAPIRenderer(BrowsableAPIRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('render'):
+            return super().render(data, accepted_media_type, renderer_context)
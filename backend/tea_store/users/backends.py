@@ -0,0 +1,56 @@
+'''
+Пользователь и сессия запроса без обращений к базе в обычном случае.
+
+CachedModelBackend (AUTHENTICATION_BACKENDS) - ModelBackend, который держит загруженного по сессии пользователя
+в кэше CACHE_ALIAS на USER_TTL секунд. Запись сбрасывается при сохранении и удалении пользователя (users/signals.py),
+в том числе после коммита транзакции: иначе параллельный запрос мог бы успеть положить в кэш старую версию.
+Изменения мимо сигналов (queryset.update, bulk_update) и сбросы в других процессах (кэш в памяти процесса)
+видны через USER_TTL, поэтому он короткий.
+
+Сессии (SESSION_ENGINE = 'users.sessions') - cached_db из Django: чтение из кэша, запись и в кэш, и в базу.
+Время жизни сессии в кэше ограничено SESSION_TTL (Django кладёт её туда на весь срок сессии): выход,
+выполненный в другом процессе, удаляет сессию только из его кэша.
+
+Настройки (settings.AUTH_CACHE):
+    'CACHE_ALIAS': 'auth' - кэш из CACHES (LocMemCache с ограниченным MAX_ENTRIES)
+    'USER_TTL': 60
+    'SESSION_TTL': 60
+'''
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'auth',
+    'USER_TTL': 60,
+    'SESSION_TTL': 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AUTH_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_config()['CACHE_ALIAS']]
+
+
+def user_cache_key(user_id):
+    return f'users.user:{user_id}'
+
+
+def invalidate_user(user_id):
+    get_cache().delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        cache, key = get_cache(), user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            # Кэш хранит копию: права (_perm_cache), посчитанные в запросе, в неё не попадают
+            cache.set(key, user, get_config()['USER_TTL'])
+        return user if self.user_can_authenticate(user) else None
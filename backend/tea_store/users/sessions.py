@@ -0,0 +1,38 @@
+'''
+Сессии cached_db с ограниченным временем жизни в кэше (SESSION_ENGINE = 'users.sessions', см. users/backends.py).
+'''
+from django.contrib.sessions.backends import cached_db
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .backends import get_cache, get_config
+
+
+class TTLCache:
+    "Обёртка над кэшем: set/aset не дольше max_timeout секунд, остальное - как у исходного кэша"
+
+    def __init__(self, cache, max_timeout):
+        self.cache = cache
+        self.max_timeout = max_timeout
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def cap(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None or timeout > self.max_timeout:
+            return self.max_timeout
+        return timeout
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.cache.set(key, value, self.cap(timeout), version)
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await self.cache.aset(key, value, self.cap(timeout), version)
+
+
+class SessionStore(cached_db.SessionStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = TTLCache(get_cache(), get_config()['SESSION_TTL'])
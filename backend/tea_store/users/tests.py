@@ -1,8 +1,17 @@
+import csv
+import io
+
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from .backends import get_cache, get_config
+from .sessions import SessionStore
+
 User = get_user_model()
 
 class AuthTestCase(TestCase):
@@ -46,4 +55,69 @@ class SessionTestCase(TestCase):
         self.client.login(username='testuser', password='testpass123')
         session = self.client.session
         self.assertTrue(session.session_key)
-        self.assertEqual(int(session['_auth_user_id']), self.user.pk)
\ No newline at end of file
+        self.assertEqual(int(session['_auth_user_id']), self.user.pk)
+
+class UsersListTestCase(TestCase):
+    def setUp(self):
+        self.api_client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123', email='admin@example.com')
+        User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(12)])
+
+    def test_all_users_is_paginated(self):
+        """Список пользователей отдаётся постранично"""
+        self.api_client.force_authenticate(user=self.admin)
+        response = self.api_client.get(reverse('all_users'), {'page_size': 5})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 13)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_only_admin_can_list_and_export(self):
+        """Список и выгрузка пользователей - только для администратора"""
+        self.api_client.force_authenticate(user=User.objects.get(username='user0'))
+        for name in ('all_users', 'users_export'):
+            self.assertEqual(self.api_client.get(reverse(name)).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_csv(self):
+        """Выгрузка всех пользователей в CSV без паролей"""
+        self.api_client.force_authenticate(user=self.admin)
+        response = self.api_client.get(reverse('users_export'), {'output': 'csv'})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'username', 'email', 'first_name', 'last_name'])
+        self.assertEqual(len(rows), 14)
+        self.assertNotIn('password', rows[0])
+
+
+class CachedAuthTestCase(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+
+    def test_session_and_user_come_from_cache(self):
+        """Повторный запрос не читает ни сессию, ни пользователя из базы"""
+        self.client.get(reverse('profile'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.json()['username'], 'testuser')
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('users_user', tables)
+
+    def test_user_save_invalidates_cache(self):
+        """Изменение пользователя видно в следующем запросе, деактивированный пользователь выходит"""
+        self.client.get(reverse('profile'))
+        self.user.email = 'new@example.com'
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).json()['email'], 'new@example.com')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_logout_removes_cached_session(self):
+        """После выхода сессия не поднимается из кэша, время жизни сессии в кэше ограничено"""
+        store = SessionStore()
+        self.assertEqual(store._cache.cap(store.get_expiry_age()), get_config()['SESSION_TTL'])
+        self.client.get(reverse('logout'))
+        self.assertEqual(self.client.get(reverse('profile')).status_code, status.HTTP_403_FORBIDDEN)
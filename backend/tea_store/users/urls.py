@@ -1,10 +1,11 @@
 from django.urls import path
-from .views import RegisterView, LoginView, LogoutView, UserProfileView, UsersProfileView
+from .views import RegisterView, LoginView, LogoutView, UserProfileView, UsersProfileView, UsersExportView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('profile/', UserProfileView.as_view(), name='profile'),
-    path('all-users/', UsersProfileView.as_view(), name='all_users')
+    path('all-users/', UsersProfileView.as_view(), name='all_users'),
+    path('export/', UsersExportView.as_view(), name='users_export'),
 ]
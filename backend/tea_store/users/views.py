@@ -4,11 +4,14 @@ from django.shortcuts import render
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.pagination import PageNumberPagination
 from django.contrib.auth import login, logout, authenticate
 from .serializers import RegisterSerializer, UserSerializer, LoginSerializer
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import get_user_model
 
+from tea_store.exports import export_response
+
 from .wraps import drf_admin_required
 
 User = get_user_model()
@@ -56,9 +59,23 @@ class UserProfileView(APIView):
         return Response(serializer.data)
 
 
-class UsersProfileView(APIView):
+class UsersPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class UsersProfileView(generics.ListAPIView):
+    queryset = User.objects.order_by('id')  # Постранично (?page=N&page_size=M), а не весь список в памяти
+    serializer_class = UserSerializer
+    pagination_class = UsersPagination
+
+    @drf_admin_required
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+
+class UsersExportView(APIView):
     @drf_admin_required
     def get(self, request):
-        users = User.objects.all()  # Получаем всех пользователей
-        serializer = UserSerializer(users, many=True)  # Сериализуем с many=True
-        return Response(serializer.data)  # Возвращаем данные
+        # Все пользователи потоком, ?output=ndjson|csv (см. tea_store/exports.py)
+        return export_response(request, User.objects.order_by('id'), list(UserSerializer.Meta.fields), 'users')
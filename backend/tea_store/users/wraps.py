@@ -13,5 +13,5 @@ def drf_admin_required(view_func):
                 {"detail": "You do not have permission to perform this action."},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return view_func(args[0], *args, **kwargs)
+        return view_func(self, *args, **kwargs)
     return _wrapped_view
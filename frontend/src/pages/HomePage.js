@@ -1,4 +1,4 @@
-import React, { useEffect, useState, useCallback  } from 'react';
+import React, { useEffect, useState, useCallback, useRef } from 'react';
 import axiosInstance from '../api/axiosInstance';
 import { useAuth } from '../context/AuthContext';
 import { useNavigate } from 'react-router-dom';
@@ -14,6 +14,7 @@ const HomePage = () => {
   const [minPrice, setMinPrice] = useState('');
   const [maxPrice, setMaxPrice] = useState('');
   const [ordering, setOrdering] = useState('');
+  const lastSeq = useRef(null); // Номер последнего полученного изменения - с него продолжаем после переподключения
 
   const fetchProducts = useCallback(async () => { // Функция для загрузки объявлений
     try {
@@ -50,49 +51,121 @@ const HomePage = () => {
   useEffect(() => {
     fetchProducts(); // Запускается при монтировании
 
-    const ws = new WebSocket('ws://localhost:8000/ws/products/'); 
+    let ws;
+    let reconnectTimer;
+    let closed = false;
 
-    ws.onopen = () => {
-        console.log('WebSocket Connected');
-      };
+    const connect = () => {
+      // Протокол v2: сервер присылает операции created/updated/deleted, для updated - только изменённые поля.
+      // После обрыва переподключаемся с ?since=<seq> и получаем только пропущенные изменения, а не весь список
+      const since = lastSeq.current !== null ? `?since=${lastSeq.current}` : '';
+      ws = new WebSocket(`ws://localhost:8000/ws/products/${since}`, ['products.v2.json']);
+
+      ws.onopen = () => {
+          console.log('WebSocket Connected');
+          if (minPrice || maxPrice) {
+            // Фильтр по цене: просим присылать только изменения карточек из этого диапазона
+            const price = {};
+            if (minPrice) price.product_price__gte = Number(minPrice);
+            if (maxPrice) price.product_price__lte = Number(maxPrice);
+            ws.send(JSON.stringify({ subscribe: price }));
+          }
+        };
+
+      ws.onmessage = (event) => {
+          const message = JSON.parse(event.data); // При получении сообщения, разбираем JSON
+          console.log('Received product update:', message);
+
+          if (message.ping) {
+            ws.send(JSON.stringify({ pong: message.ping })); // Отвечаем на heartbeat, иначе сервер закроет соединение по таймауту
+            return;
+          }
+
+          if (message.resync) {
+            fetchProducts(); // Мы отстали и часть изменений пропущена - перезагружаем список целиком
+            return;
+          }
+
+          if (message.snapshot) {
+            // Журнал на сервере уже не покрывает пропуск - перезагружаем нашу страницу списка с текущими фильтрами
+            lastSeq.current = message.seq;
+            fetchProducts();
+            return;
+          }
 
-    ws.onmessage = (event) => {
-        const productData = JSON.parse(event.data); // При получении сообщения, разбираем JSON
-        console.log('Received product update:', productData);
+          if (message.caught_up !== undefined) {
+            lastSeq.current = message.caught_up;
+            return;
+          }
+
+          if (message.error) {
+            console.error('WebSocket subscription error:', message.error);
+            return;
+          }
+
+          if (!message.ops) { // Например, подтверждение подписки {"subscribed": ...}
+            return;
+          }
 
-        setProducts(prevProducts => {
-          const existingProductIndex = prevProducts.findIndex(p => p.id === productData.id);
-          if (existingProductIndex > -1) {
-            // Если товар найден, обновляем его
-            const updatedProducts = [...prevProducts];
-            updatedProducts[existingProductIndex] = productData; // Заменяем старые данные на новые
+          message.ops.forEach(op => {
+            if (op.seq !== undefined) lastSeq.current = Math.max(lastSeq.current || 0, op.seq);
+          });
+
+          setProducts(prevProducts => {
+            let updatedProducts = [...prevProducts];
+            message.ops.forEach(op => {
+              const existingProductIndex = updatedProducts.findIndex(p => p.id === op.id);
+              if (op.op === 'deleted') {
+                // Карточка удалена (в том числе пачкой через /cartitems/bulk/)
+                updatedProducts = updatedProducts.filter(p => p.id !== op.id);
+              } else if (op.op === 'updated') {
+                // Приходят только изменённые поля - накладываем их на карточку, если она есть в списке
+                if (existingProductIndex > -1) {
+                  const product = { ...updatedProducts[existingProductIndex], ...op.changes };
+                  const outOfRange = (minPrice && product.product_price < Number(minPrice)) || (maxPrice && product.product_price > Number(maxPrice));
+                  if (outOfRange) {
+                    // Цена ушла из выбранного диапазона - карточка больше не подходит под фильтр
+                    updatedProducts = updatedProducts.filter(p => p.id !== op.id);
+                  } else {
+                    updatedProducts[existingProductIndex] = product;
+                  }
+                }
+              } else if (op.op === 'created' && existingProductIndex === -1) {
+                // Новая карточка - добавляем её в начало списка
+                updatedProducts.unshift(op.data);
+              }
+            });
             return updatedProducts;
-          } else {
-            // Если товар не найден (например, был только что создан), добавляем его
-            return [productData, ...prevProducts]; // Добавляем новый товар в начало списка
+          });
+        };
+
+        ws.onclose = () => {
+          console.log('WebSocket Disconnected');
+          if (!closed) {
+            reconnectTimer = setTimeout(connect, 1000); // Соединение оборвалось - переподключаемся и догоняем по seq
           }
-        });
-      };
+        };
 
-      ws.onclose = () => {
-        console.log('WebSocket Disconnected');
-      };
+        ws.onerror = (error) => {
+          console.error('WebSocket Error:', error);
+        };
+    };
 
-      ws.onerror = (error) => {
-        console.error('WebSocket Error:', error);
-      };
+    connect();
 
       return () => {
+        closed = true;
+        clearTimeout(reconnectTimer);
         ws.close(); // Очистка: закрываем WebSocket-соединение при размонтировании компонента
       };
-    }, [fetchProducts]);
+    }, [fetchProducts, minPrice, maxPrice]);
 
   const handleDelete = async (productId) => {  // Функция для обработки удаления объявления
     if (window.confirm('Вы уверены, что хотите удалить это объявление?')) {
       try {
         await axiosInstance.delete(`/cartitems/${productId}/`); 
         alert('Объявление успешно удалено!');
-        fetchProducts(); // Перезагружаем список объявлений после удаления
+        setProducts(prevProducts => prevProducts.filter(p => p.id !== productId)); // Убираем карточку локально, перезагружать весь список не нужно
       } catch (err) {
         console.error("Ошибка при удалении объявления:", err.response?.data || err);
         alert('Не удалось удалить объявление. Убедитесь, что вы являетесь его владельцем.');